@@ -0,0 +1,42 @@
+"""
+Shared bootstrap for the benchmark scripts.
+
+Benchmarks run against a throwaway test database created from the active
+settings module (benchmarks.settings by default: SQLite + locmem + in-memory
+layer, or real Redis with BENCH_REDIS_URL). Point DJANGO_SETTINGS_MODULE at
+Postgres-backed settings for numbers that mean something in production.
+"""
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def setup(settings_module="benchmarks.settings"):
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """
+    Create (and afterwards destroy) a migrated test database.
+    """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
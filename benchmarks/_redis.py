@@ -0,0 +1,52 @@
+"""
+Throwaway local redis-server processes for the benchmark scripts.
+"""
+import shutil
+import socket
+import subprocess
+import time
+from contextlib import contextmanager
+
+import redis
+
+
+def available() -> bool:
+    return shutil.which("redis-server") is not None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def redis_servers(count: int):
+    """
+    Start `count` non-persistent redis-server processes; yields their URLs.
+    """
+    procs, urls = [], []
+    try:
+        for _ in range(count):
+            port = _free_port()
+            procs.append(subprocess.Popen(
+                ["redis-server", "--port", str(port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no"],
+                stdout=subprocess.DEVNULL,
+            ))
+            urls.append(f"redis://127.0.0.1:{port}/0")
+        for url in urls:
+            client = redis.Redis.from_url(url)
+            for _ in range(100):
+                try:
+                    client.ping()
+                    break
+                except redis.ConnectionError:
+                    time.sleep(0.05)
+            else:
+                raise RuntimeError(f"redis-server at {url} did not start")
+        yield urls
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
@@ -0,0 +1,97 @@
+"""
+Channel-layer throughput: one Redis host vs the consistent-hash sharded layer
+(chat.layers.ShardedRedisChannelLayer) vs RedisPubSubChannelLayer, each on
+local redis-server processes started by the script.
+
+    python benchmarks/bench_channel_layer.py --shards 4 --groups 50 --members 20 --messages 2000
+
+Every group_send is delivered to all `members` channels of its group and
+awaited by receivers in the same process; reported rates are deliveries/s
+(messages x members) and group_send/s. Skipped when redis-server is not
+installed.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from _django import setup
+
+setup()
+
+from channels_redis.core import RedisChannelLayer  # noqa: E402
+from channels_redis.pubsub import RedisPubSubChannelLayer  # noqa: E402
+
+from chat.layers import ShardedRedisChannelLayer  # noqa: E402
+
+import _redis  # noqa: E402
+
+
+async def _fanout(layer, groups, members, messages, concurrency):
+    channels = [await layer.new_channel() for _ in range(groups * members)]
+    for i, channel in enumerate(channels):
+        await layer.group_add(f"bench_{i // members}", channel)
+
+    remaining = messages * members
+    done = asyncio.Event()
+
+    async def drain(channel):
+        nonlocal remaining
+        while True:
+            await layer.receive(channel)
+            remaining -= 1
+            if remaining == 0:
+                done.set()
+
+    receivers = [asyncio.create_task(drain(c)) for c in channels]
+    await asyncio.sleep(0.2)  # let receivers (and pub/sub subscriptions) settle
+
+    t0 = time.perf_counter()
+    for start in range(0, messages, concurrency):
+        await asyncio.gather(*[
+            layer.group_send(f"bench_{n % groups}", {"type": "bench.message", "n": n})
+            for n in range(start, min(start + concurrency, messages))
+        ])
+    try:
+        await asyncio.wait_for(done.wait(), timeout=60)
+    except asyncio.TimeoutError:
+        pass  # pub/sub is at-most-once; report what arrived
+    elapsed = time.perf_counter() - t0
+
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+    await layer.flush()
+    return messages * members - remaining, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50, help="group_sends in flight")
+    args = parser.parse_args()
+
+    if not _redis.available():
+        print("redis-server not found on PATH; skipping")
+        return 0
+
+    with _redis.redis_servers(args.shards) as urls:
+        layers = [
+            ("RedisChannelLayer (1 host)", lambda: RedisChannelLayer(hosts=urls[:1])),
+            (f"ShardedRedisChannelLayer ({len(urls)})", lambda: ShardedRedisChannelLayer(hosts=urls)),
+            (f"RedisPubSubChannelLayer ({len(urls)})", lambda: RedisPubSubChannelLayer(hosts=urls)),
+        ]
+        print(f"{'layer':<32} {'delivered':>10} {'deliveries/s':>14} {'group_send/s':>14}")
+        for label, make in layers:
+            delivered, elapsed = asyncio.run(
+                _fanout(make(), args.groups, args.members, args.messages, args.concurrency)
+            )
+            print(f"{label:<32} {delivered:>10} {delivered / elapsed:>14.0f} {args.messages / elapsed:>14.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+CPU cost of delivering one room broadcast: per-receiver send_json vs the
+pre-encoded frame forwarded with send(text_data=...).
+
+    python benchmarks/bench_fanout_encoding.py --sizes 10 100 1000 5000
+
+Only the receiving side is measured (handler + encode); channel-layer
+transport is the same for both and left out.
+"""
+import argparse
+import asyncio
+import time
+
+from _django import setup
+
+setup()
+
+from chat.consumers import ChatConsumer  # noqa: E402
+from chat.events import room_event  # noqa: E402
+
+
+MESSAGE = {
+    "id": 123456,
+    "room_id": 42,
+    "sender_id": 7,
+    "content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 3,
+    "created_at": "2025-01-01T12:00:00.000000+00:00",
+}
+
+
+async def _noop(message):
+    pass
+
+
+def _consumer():
+    consumer = ChatConsumer()
+    consumer.base_send = _noop
+    return consumer
+
+
+async def _deliver(consumers, event):
+    for consumer in consumers:
+        await consumer.broadcast_message(event)
+
+
+def _time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    legacy = {"type": "broadcast.message", "message": MESSAGE, "sender_id": 7}
+    loop = asyncio.new_event_loop()
+
+    print(f"{'members':>8} {'send_json':>12} {'pre-encoded':>12} {'saved':>10} {'per recv':>10}")
+    for size in args.sizes:
+        consumers = [_consumer() for _ in range(size)]
+
+        def per_receiver():
+            loop.run_until_complete(_deliver(consumers, legacy))
+
+        def once():
+            event = room_event("broadcast.message", {"type": "message_created", "message": MESSAGE}, sender_id=7)
+            loop.run_until_complete(_deliver(consumers, event))
+
+        old = _time(per_receiver, args.repeat)
+        new = _time(once, args.repeat)
+        print(
+            f"{size:>8} {old * 1000:>10.2f}ms {new * 1000:>10.2f}ms "
+            f"{(old - new) * 1000:>8.2f}ms {(old - new) / size * 1e6:>8.2f}us"
+        )
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
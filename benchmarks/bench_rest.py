@@ -0,0 +1,83 @@
+"""
+REST hot paths: latency percentiles, SQL queries and cache calls per request.
+
+    python benchmarks/bench_rest.py --messages 5000 --rooms 200 --members 50 --requests 200
+    python benchmarks/bench_rest.py --check     # exit 1 if a path is over budget
+    python benchmarks/bench_rest.py --record    # rewrite benchmarks/budgets.json
+
+Paths are defined in benchmarks/hotpaths.py. Budgets (benchmarks/budgets.json)
+hold the worst per-request query and cache-call counts, measured on the
+dataset recorded alongside them; tests/test_query_budgets.py enforces them
+in the normal test run. --check and --record always use that dataset, so
+the counts stay comparable; the size flags only affect the latency run.
+"""
+import argparse
+import json
+import statistics
+import sys
+
+from _django import setup, test_database
+
+setup()
+
+from django.core.cache import cache  # noqa: E402
+
+from hotpaths import BUDGETS_FILE, DEFAULT_DATASET, PATHS, load_budgets, measure, over_budget, seed  # noqa: E402
+
+
+def _report(name, counts, samples):
+    samples.sort()
+    p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1000  # noqa: E731
+    print(
+        f"{name:<26} p50 {p(0.50):7.2f} ms   p95 {p(0.95):7.2f} ms   p99 {p(0.99):7.2f} ms   "
+        f"mean {statistics.fmean(samples) * 1000:7.2f} ms   "
+        f"{counts['queries']:>3} queries   {counts['cache_calls']:>3} cache calls"
+    )
+
+
+def _run(dataset, requests):
+    cache.clear()
+    data = seed(**dataset)
+    return {path.name: measure(path, data, requests) for path in PATHS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--members", type=int, default=30)
+    parser.add_argument("--requests", type=int, default=100)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--check", action="store_true", help="compare counts against budgets.json")
+    mode.add_argument("--record", action="store_true", help="write the measured counts to budgets.json")
+    args = parser.parse_args()
+
+    if args.check or args.record:
+        dataset = load_budgets()["dataset"] if args.check else DEFAULT_DATASET
+    else:
+        dataset = {"messages": args.messages, "rooms": args.rooms, "members": args.members}
+
+    with test_database():
+        results = _run(dataset, args.requests)
+
+    print(f"dataset: {dataset}")
+    for name, (counts, samples) in results.items():
+        _report(name, counts, samples)
+
+    if args.record:
+        budgets = {"dataset": dataset, "paths": {name: counts for name, (counts, _) in results.items()}}
+        with open(BUDGETS_FILE, "w") as f:
+            json.dump(budgets, f, indent=2)
+            f.write("\n")
+        print(f"budgets written to {BUDGETS_FILE}")
+    elif args.check:
+        budgets = load_budgets()
+        failures = [msg for name, (counts, _) in results.items() for msg in over_budget(name, counts, budgets)]
+        for msg in failures:
+            print(f"OVER BUDGET  {msg}")
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Write-behind vs one-INSERT-per-message persistence for WebSocket sends.
+
+    python benchmarks/bench_write_behind.py --messages 5000 --senders 50
+
+Each "sender" is a coroutine standing in for one ChatConsumer calling
+chat.consumers.create_message in a loop. Reports throughput and the
+per-message latency each mode adds.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from _django import setup, test_database
+
+setup()
+
+from django.test import override_settings  # noqa: E402
+
+from chat.consumers import create_message  # noqa: E402
+from chat.models import ChatRoom, Message  # noqa: E402
+from chat.writebehind import batcher  # noqa: E402
+from core.models import User  # noqa: E402
+
+
+async def _run(room_ids, user_id, n_messages, n_senders):
+    latencies = []
+    per_sender = n_messages // n_senders
+
+    async def sender(i):
+        room_id = room_ids[i % len(room_ids)]
+        for j in range(per_sender):
+            t0 = time.perf_counter()
+            await create_message(room_id, user_id, f"bench {i}/{j}")
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[sender(i) for i in range(n_senders)])
+    elapsed = time.perf_counter() - t0
+    return elapsed, latencies
+
+
+def _report(label, elapsed, latencies):
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{label:<22} {len(latencies) / elapsed:>10.0f} msg/s   p50 {p50:7.2f} ms   p99 {p99:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--max-batch", type=int, default=200)
+    parser.add_argument("--max-latency-ms", type=int, default=20)
+    args = parser.parse_args()
+
+    with test_database():
+        user = User.objects.create_user(username="bench", password="x")
+        room_ids = [ChatRoom.objects.create(name=f"bench-{i}").id for i in range(args.rooms)]
+
+        with override_settings(CHAT_WRITE_BEHIND=False):
+            _report("one INSERT / message", *asyncio.run(_run(room_ids, user.id, args.messages, args.senders)))
+
+        with override_settings(
+            CHAT_WRITE_BEHIND=True,
+            CHAT_WRITE_BEHIND_MAX_BATCH=args.max_batch,
+            CHAT_WRITE_BEHIND_MAX_LATENCY_MS=args.max_latency_ms,
+        ):
+            _report(
+                f"write-behind ({args.max_batch}/{args.max_latency_ms}ms)",
+                *asyncio.run(_run(room_ids, user.id, args.messages, args.senders)),
+            )
+
+        print(f"rows written: {Message.objects.count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+WebSocket load test: simulated clients drive the real config.asgi.application
+(JWT auth, ChatConsumer, channel layer) through connect, join, send_message
+and typing, and measure fan-out.
+
+    python benchmarks/bench_ws_load.py --clients 1000 --rooms 10 --senders 50 --duration 10
+    python benchmarks/bench_ws_load.py --redis --processes 4 --clients 4000 --json results.json
+    python benchmarks/bench_ws_load.py --compare results.json
+
+Every client joins one room; senders post at --rate msgs/s each (and typing
+frames at --typing-rate). Reports messages sent/s, deliveries/s, p50/p99
+send-to-receive latency and traced memory per connection. With --processes
+N the clients are split across N worker processes sharing a local
+redis-server (--redis), so deliveries cross nodes. The in-memory layer only
+works in one process.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import _redis
+from _django import setup
+
+
+MESSAGE_FRAME = "message_created"
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def _seed(n_clients, n_rooms):
+    """
+    Users, rooms and participants in bulk; returns one access token per client.
+    """
+    from django.core.management import call_command
+
+    from chat.models import ChatParticipant, ChatRoom
+    from core.models import User
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    call_command("migrate", verbosity=0)
+    users = User.objects.bulk_create(
+        [User(username=f"load{i}", password="!") for i in range(n_clients)], batch_size=1000
+    )
+    rooms = ChatRoom.objects.bulk_create(
+        [ChatRoom(name=f"load room {r}", is_group=True) for r in range(n_rooms)]
+    )
+    ChatParticipant.objects.bulk_create(
+        [ChatParticipant(chat_room=rooms[i % n_rooms], user=u) for i, u in enumerate(users)], batch_size=1000
+    )
+    return [(str(RefreshToken.for_user(u).access_token), rooms[i % n_rooms].id) for i, u in enumerate(users)]
+
+
+async def _drive(clients, opts, start_at):
+    """
+    Run one worker's share of clients: [(token, room_id, is_sender)].
+    """
+    from channels.testing import WebsocketCommunicator
+
+    from config.asgi import application
+
+    tracemalloc.start()
+    mem_before = tracemalloc.get_traced_memory()[0]
+    t0 = time.perf_counter()
+    comms = []
+    for token, room_id, _ in clients:
+        comm = WebsocketCommunicator(application, f"/ws/chat/?token={token}")
+        connected, _ = await comm.connect()
+        if not connected:
+            raise RuntimeError("client was rejected")
+        await comm.send_json_to({"action": "join", "room_id": room_id})
+        comms.append(comm)
+    # every socket has answered its join
+    for comm in comms:
+        while (await comm.receive_json_from(timeout=30))["type"] != "joined":
+            pass
+    connect_seconds = time.perf_counter() - t0
+    mem_per_conn = (tracemalloc.get_traced_memory()[0] - mem_before) / max(1, len(comms))
+    tracemalloc.stop()
+
+    latencies = []
+
+    async def receive(comm):
+        while True:
+            # straight off the queue: a receive_output() timeout would cancel the app
+            frame = await comm.output_queue.get()
+            if frame.get("type") != "websocket.send" or MESSAGE_FRAME not in (frame.get("text") or ""):
+                continue
+            event = json.loads(frame["text"])
+            if event.get("type") == MESSAGE_FRAME and "temp_id" not in event:  # skip the sender's ACK
+                latencies.append(time.time() - json.loads(event["message"]["content"])["t"])
+
+    async def send(comm, room_id, until):
+        sent = 0
+        interval = 1.0 / opts["rate"]
+        typing_every = max(1, round(opts["rate"] / opts["typing_rate"])) if opts["typing_rate"] else 0
+        next_at = time.time()
+        while time.time() < until:
+            if typing_every and sent % typing_every == 0:
+                await comm.send_json_to({"action": "typing", "room_id": room_id, "is_typing": True})
+            await comm.send_json_to({
+                "action": "send_message", "room_id": room_id, "content": json.dumps({"t": time.time()}),
+            })
+            sent += 1
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.time()))
+        return sent
+
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    until = time.time() + opts["duration"]  # late workers still send for the full duration
+    receivers = [asyncio.create_task(receive(comm)) for comm in comms]
+    sent = sum(await asyncio.gather(*[
+        send(comm, room_id, until) for comm, (_, room_id, is_sender) in zip(comms, clients) if is_sender
+    ]))
+    await asyncio.sleep(opts["drain"])
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+    for comm in comms:
+        await comm.disconnect()
+
+    return {
+        "clients": len(comms),
+        "sent": sent,
+        "latencies": latencies,
+        "connect_seconds": connect_seconds,
+        "mem_per_conn": mem_per_conn,
+    }
+
+
+def _flush_last_seen():
+    # the buffered last_login writes must land before the temp database goes
+    from core.last_seen import writer
+    writer.flush()
+
+
+def _worker(clients, opts, start_at, queue):
+    setup()
+    result = asyncio.run(_drive(clients, opts, start_at))
+    _flush_last_seen()
+    queue.put(result)
+
+
+def _run(opts):
+    setup()
+    assignments = [
+        (token, room_id, i % max(1, opts["clients"] // opts["senders"]) == 0)
+        for i, (token, room_id) in enumerate(_seed(opts["clients"], opts["rooms"]))
+    ]
+    # connect (and settle) before the common start time
+    start_at = time.time() + opts["warmup"] + opts["clients"] * 0.004 / opts["processes"]
+
+    if opts["processes"] == 1:
+        results = [asyncio.run(_drive(assignments, opts, start_at))]
+        _flush_last_seen()
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        queue = ctx.Queue()
+        workers = [
+            ctx.Process(target=_worker, args=(assignments[p::opts["processes"]], opts, start_at, queue))
+            for p in range(opts["processes"])
+        ]
+        for w in workers:
+            w.start()
+        results = [queue.get() for _ in workers]
+        for w in workers:
+            w.join()
+
+    latencies = sorted(x for r in results for x in r["latencies"])
+    sent = sum(r["sent"] for r in results)
+    return {
+        "sent": sent,
+        "delivered": len(latencies),
+        "msgs_per_s": sent / opts["duration"],
+        "deliveries_per_s": len(latencies) / opts["duration"],
+        "p50_ms": _percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p99_ms": _percentile(latencies, 0.99) * 1000 if latencies else None,
+        "connect_per_s": opts["clients"] / max(r["connect_seconds"] for r in results),
+        "mem_per_conn_kb": sum(r["mem_per_conn"] * r["clients"] for r in results) / opts["clients"] / 1024,
+    }
+
+
+def _print(results, baseline=None):
+    for key, value in results.items():
+        line = f"{key:<18} {value:>12.2f}" if isinstance(value, float) else f"{key:<18} {value!s:>12}"
+        old = (baseline or {}).get(key)
+        if isinstance(old, (int, float)) and isinstance(value, (int, float)) and old:
+            line += f"   (was {old:.2f}, {(value - old) / old * 100:+.1f}%)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--senders", type=int, default=25)
+    parser.add_argument("--rate", type=float, default=2.0, help="messages/s per sender")
+    parser.add_argument("--typing-rate", type=float, default=0.0, help="typing frames/s per sender")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for stragglers")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--redis", action="store_true", help="start a local redis-server for cache + layer")
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--json", help="write results (and config) to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --json run")
+    args = parser.parse_args()
+
+    if args.processes > 1 and not args.redis:
+        parser.error("--processes > 1 needs --redis (the in-memory layer is per process)")
+    if args.redis and not _redis.available():
+        print("redis-server not found on PATH; skipping")
+        return 0
+
+    opts = {k: v for k, v in vars(args).items() if k not in ("json", "compare")}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    # the load generator is not what's being rate limited
+    os.environ.setdefault("WS_MAX_EVENTS", "1000000")
+    for action in ("SEND_MESSAGE", "TYPING", "JOIN", "DEFAULT"):
+        os.environ.setdefault(f"WS_{action}_MAX", "1000000")
+    if args.write_behind:
+        os.environ["CHAT_WRITE_BEHIND"] = "true"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["BENCH_DB_PATH"] = os.path.join(tmp, "load.sqlite3")
+        if args.redis:
+            with _redis.redis_servers(1) as (url,):
+                os.environ["BENCH_REDIS_URL"] = url
+                results = _run(opts)
+        else:
+            results = _run(opts)
+
+    _print(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": opts, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
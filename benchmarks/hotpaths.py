@@ -0,0 +1,213 @@
+"""
+REST hot paths, shared by benchmarks/bench_rest.py (latency percentiles)
+and tests/test_query_budgets.py (query/cache-call budgets).
+
+Each path issues one real request through the URLconf with a Bearer
+token, so authentication, permissions, throttles and serializers are all
+on the clock. Requires Django to be set up before import.
+"""
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.cache import bump_room_version
+from chat.models import ChatParticipant, ChatRoom, Message
+from chat.pagination import encode_cursor
+from chat.throttling import RedisAnonRateThrottle, RedisScopedRateThrottle, RedisUserRateThrottle
+from core.models import Profile, User
+
+
+BUDGETS_FILE = Path(__file__).with_name("budgets.json")
+
+# Dataset the budgets are recorded against (big enough that an N+1 shows)
+DEFAULT_DATASET = {"messages": 120, "rooms": 12, "members": 8}
+
+CACHE_METHODS = (
+    "add", "get", "set", "touch", "delete", "get_many", "set_many",
+    "delete_many", "has_key", "incr", "decr", "get_or_set", "clear",
+)
+
+# Keep the throttles on the clock, but never let one answer 429
+_NO_LIMIT = "1000000/min"
+
+
+@dataclass
+class Dataset:
+    user: User
+    token: str
+    room: ChatRoom  # the room with the message history
+
+
+def seed(messages, rooms, members) -> Dataset:
+    """
+    One user in `rooms` rooms of `members` members each (drawn from one
+    shared pool, every user with a profile); the first room holds
+    `messages` messages.
+    """
+    users = User.objects.bulk_create(
+        [User(username=f"hot{i}", password="!") for i in range(members)]
+    )
+    Profile.objects.bulk_create([Profile(user=u) for u in users])
+    user = users[0]
+    room_objs = ChatRoom.objects.bulk_create(
+        [ChatRoom(name=f"hot room {r}", is_group=True) for r in range(rooms)]
+    )
+    ChatParticipant.objects.bulk_create(
+        [ChatParticipant(chat_room=room, user=u) for room in room_objs for u in users]
+    )
+    Message.objects.bulk_create(
+        [Message(chat_room=room_objs[0], sender=users[i % members], content=f"hot message {i}")
+         for i in range(messages)]
+    )
+    return Dataset(user=user, token=str(RefreshToken.for_user(user).access_token), room=room_objs[0])
+
+
+class CacheCalls:
+    """
+    Counts calls on the default cache backend, by method. Only outermost
+    calls count: LocMemCache.get_many is one call, not one get per key.
+    """
+
+    def __init__(self):
+        self.by_method = {}
+        self._depth = 0
+
+    @property
+    def total(self) -> int:
+        return sum(self.by_method.values())
+
+    @contextmanager
+    def capture(self):
+        backend = caches["default"]
+        originals = {}
+        for name in CACHE_METHODS:
+            original = getattr(backend, name)
+            originals[name] = original
+            setattr(backend, name, self._counted(name, original))
+        try:
+            yield self
+        finally:
+            for name in originals:
+                delattr(backend, name)
+
+    def _counted(self, name, original):
+        def counted(*args, **kwargs):
+            if not self._depth:
+                self.by_method[name] = self.by_method.get(name, 0) + 1
+            self._depth += 1
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self._depth -= 1
+        return counted
+
+
+def _messages_url(data):
+    return reverse("chat:message-list", kwargs={"room_id": data.room.id})
+
+
+def _deep_url(data):
+    # a page near the start of the history: costs the same as the newest one
+    oldest = Message.objects.filter(chat_room=data.room).order_by("timestamp", "id")[10]
+    return f"{_messages_url(data)}?before={encode_cursor(oldest.timestamp, oldest.id)}"
+
+
+def _bust_room(client, data):
+    bump_room_version(data.room.id)
+
+
+def _revalidate(client, data):
+    # poll with the current ETag: the request under test is a 304
+    tag = client.get(_messages_url(data))["ETag"]
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {data.token}", HTTP_IF_NONE_MATCH=tag)
+
+
+@dataclass
+class HotPath:
+    name: str
+    method: str
+    url: object               # data -> url
+    body: dict = None
+    prepare: object = None    # (client, data) -> None, off the clock, before every request
+    status: int = 200
+
+
+PATHS = [
+    HotPath("messages.list.cold", "get", _messages_url, prepare=_bust_room),
+    HotPath("messages.list.warm", "get", _messages_url),
+    HotPath("messages.list.deep", "get", _deep_url, prepare=_bust_room),
+    HotPath("messages.list.revalidate", "get", _messages_url, prepare=_revalidate, status=304),
+    HotPath("messages.create", "post", _messages_url, body={"content": "hot path"}, status=201),
+    HotPath("rooms.list", "get", lambda data: reverse("chat:chat-room-list")),
+    HotPath("core.me", "get", lambda data: "/api/core/me/"),
+]
+
+
+@contextmanager
+def unthrottled():
+    rates = {scope: _NO_LIMIT for scope in ("anon", "user", "chat-list", "chat-create")}
+    with mock.patch.object(RedisAnonRateThrottle, "THROTTLE_RATES", rates), \
+            mock.patch.object(RedisUserRateThrottle, "THROTTLE_RATES", rates), \
+            mock.patch.object(RedisScopedRateThrottle, "THROTTLE_RATES", rates):
+        yield
+
+
+def client_for(data) -> APIClient:
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {data.token}")
+    return client
+
+
+def measure(path: HotPath, data: Dataset, requests: int):
+    """
+    Run `path` `requests` times after one untimed request (which fills the
+    membership/message caches, so results don't depend on which path ran
+    first). Returns {"queries", "cache_calls"} (the worst request) and the
+    per-request latencies in seconds.
+    """
+    client = client_for(data)
+    url = path.url(data)
+    samples, queries, cache_calls = [], 0, 0
+    with unthrottled():
+        getattr(client, path.method)(url, path.body, format="json")
+        for _ in range(requests):
+            if path.prepare:
+                path.prepare(client, data)
+            calls = CacheCalls()
+            with CaptureQueriesContext(connection) as ctx, calls.capture():
+                t0 = time.perf_counter()
+                response = getattr(client, path.method)(url, path.body, format="json")
+                samples.append(time.perf_counter() - t0)
+            if response.status_code != path.status:
+                raise AssertionError(f"{path.name}: HTTP {response.status_code}: {response.content[:200]!r}")
+            queries = max(queries, len(ctx.captured_queries))
+            cache_calls = max(cache_calls, calls.total)
+    return {"queries": queries, "cache_calls": cache_calls}, samples
+
+
+def load_budgets() -> dict:
+    with open(BUDGETS_FILE) as f:
+        return json.load(f)
+
+
+def over_budget(name: str, counts: dict, budgets: dict) -> list:
+    """
+    Human-readable list of the counts of `name` that exceed its budget.
+    """
+    budget = budgets["paths"][name]
+    return [
+        f"{name}: {metric} {counts[metric]} > budget {budget[metric]}"
+        for metric in ("queries", "cache_calls")
+        if counts[metric] > budget[metric]
+    ]
@@ -0,0 +1,37 @@
+# Benchmark settings: the test settings (SQLite, locmem, in-memory layer),
+# switched to real Redis for the cache and channel layer when
+# BENCH_REDIS_URL is set, e.g. BENCH_REDIS_URL=redis://127.0.0.1:6379/0,
+# and to a file database shared by worker processes when BENCH_DB_PATH is set
+import os
+
+from config.settings_test import *  # noqa: F401,F403
+
+
+BENCH_REDIS_URL = os.environ.get("BENCH_REDIS_URL")
+
+if BENCH_REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": BENCH_REDIS_URL,
+            "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
+            "KEY_PREFIX": "chatbench",
+        }
+    }
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [BENCH_REDIS_URL]},
+        }
+    }
+
+BENCH_DB_PATH = os.environ.get("BENCH_DB_PATH")
+
+if BENCH_DB_PATH:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BENCH_DB_PATH,
+            "OPTIONS": {"timeout": 30},  # several processes write messages
+        }
+    }
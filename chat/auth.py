@@ -1,14 +1,77 @@
+import hashlib
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict
 
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from channels.auth import AuthMiddlewareStack
 
 from django.contrib.auth.models import AnonymousUser
-from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache
 from django.db import close_old_connections
 
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as sj_settings
+
+from core.principals import principals
+
+from . import tickets
+
+from .events import MSGPACK_SUBPROTOCOL
+
+
+
+# Protocol names a client may offer alongside (or instead of) a token
+_KNOWN_SUBPROTOCOLS = {"binary", MSGPACK_SUBPROTOCOL}
+
+# Verified JWT claims, keyed by sha256 of the raw token (the token itself is never stored)
+CLAIMS_CACHE_KEY = "chat:jwt:{digest}"
+
+DEFAULT_CLAIMS_LRU_SIZE = 10_000
+
+
+def token_digest(raw_token: str) -> str:
+    return hashlib.sha256(raw_token.encode()).hexdigest()
+
+
+class ClaimsLRU:
+    """
+    Bounded in-process map of token digest -> verified claims.
+    Entries die at the token's own `exp`, so a hit never outlives the token.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or getattr(settings, "JWT_CLAIMS_LRU_SIZE", DEFAULT_CLAIMS_LRU_SIZE)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            claims = self._data.get(digest)
+            if claims is None:
+                return None
+            if claims["exp"] <= time.time():
+                del self._data[digest]
+                return None
+            self._data.move_to_end(digest)
+            return claims
+
+    def put(self, digest, claims):
+        with self._lock:
+            self._data[digest] = claims
+            self._data.move_to_end(digest)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+claims_lru = ClaimsLRU()
 
 
 
@@ -44,42 +107,118 @@ def _get_token_from_scope(scope):
         # Some clients send just the token; others send comma-separated values
         parts = [p.strip() for p in val.split(",")]
         for p in parts:
-            if p and p.lower() != "binary":
+            if p and p.lower() not in _KNOWN_SUBPROTOCOLS:
                 return p
 
     return None
 
 
+_jwt_auth = JWTAuthentication()
+
+
+def verified_claims(raw_token, digest):
+    """
+    Claims of a valid token, from the shared cache or by verifying it
+    (and caching the result until the token expires). None if invalid.
+    """
+    key = CLAIMS_CACHE_KEY.format(digest=digest)
+    claims = cache.get(key)
+    if claims is None:
+        try:
+            claims = dict(_jwt_auth.get_validated_token(raw_token).payload)
+        except Exception:
+            return None
+        remaining = claims.get("exp", 0) - time.time()
+        if remaining <= 0:
+            return None
+        cache.set(key, claims, max(1, int(remaining)))
+    elif claims["exp"] <= time.time():
+        return None
+    claims_lru.put(digest, claims)
+    return claims
+
+
+@database_sync_to_async
+def _authenticate(raw_token, digest, claims=None):
+    try:
+        if claims is None:
+            claims = verified_claims(raw_token, digest)
+            if claims is None:
+                return AnonymousUser(), None
+        principal = principals.get(claims[sj_settings.USER_ID_CLAIM])
+        if principal is None:
+            return AnonymousUser(), None
+        return principal, claims
+    except Exception:
+        return AnonymousUser(), None
+
+
+async def authenticate_token(raw_token):
+    """
+    (principal, claims) for a raw access token, or (AnonymousUser, None).
+    A token and user already seen by this process resolve on the event loop.
+    """
+    digest = token_digest(raw_token)
+    claims = claims_lru.get(digest)
+    principal = principals.cached(claims[sj_settings.USER_ID_CLAIM]) if claims else None
+    if principal is not None:
+        return principal, claims
+    return await _authenticate(raw_token, digest, claims)
+
+
+async def active_principal(user_id):
+    """
+    Active principal for a user id, or None (deleted or deactivated user).
+    The local tier answers on the event loop; the shared cache (or, on a
+    miss, the DB) in a thread.
+    """
+    principal = principals.cached(user_id)
+    if principal is not None:
+        return principal
+    return await database_sync_to_async(principals.get)(user_id)
+
+
+def _get_ticket_from_scope(scope):
+    qs = scope.get("query_string", b"").decode()
+    return (urllib.parse.parse_qs(qs).get("ticket") or [None])[0] if qs else None
+
+
 class JwtAuthMiddleware(BaseMiddleware):
     """
     Channels middleware that sets scope['user'] using SimpleJWT.
-    Falls back to AnonymousUser if no/invalid token.
-    """
+    scope['user'] is a core.principals.Principal (id, is_active, username),
+    not a full User. Falls back to AnonymousUser if no/invalid token.
 
-    def __init__(self, inner):
-        super().__init__(inner)
-        self._auth = JWTAuthentication()
-        self._User = get_user_model()
+    A valid ?ticket= (chat.tickets) authenticates on its own, with no token
+    verification, and puts the session to restore in scope['resume']. The
+    ticket's user is still resolved through the principal cache, so
+    deactivated or deleted users can't resume.
+    """
 
     async def __call__(self, scope, receive, send):
         close_old_connections()
-        user = AnonymousUser()
+        user, token_exp = AnonymousUser(), None
         token = _get_token_from_scope(scope)
+        ticket = _get_ticket_from_scope(scope)
+        resume = tickets.load(ticket) if ticket else None
 
         if token:
-            user = await self._authenticate(token)
+            user, claims = await authenticate_token(token)
+            token_exp = claims["exp"] if claims else None
+            if resume is not None and resume["user_id"] != user.id:
+                resume = None
+        elif resume is not None:
+            principal = await active_principal(resume["user_id"])
+            if principal is None:
+                resume = None
+            else:
+                user, token_exp = principal, resume["token_exp"]
 
         scope["user"] = user
+        scope["token_exp"] = token_exp
+        scope["resume"] = resume
         return await super().__call__(scope, receive, send)
 
-    @database_sync_to_async
-    def _authenticate(self, raw_token):
-        try:
-            validated = self._auth.get_validated_token(raw_token)
-            return self._auth.get_user(validated)
-        except Exception:
-            return AnonymousUser()
-
 
 def JwtAuthMiddlewareStack(inner):
     """
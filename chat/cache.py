@@ -1,40 +1,89 @@
+import asyncio
 import logging
+import time
+import weakref
 
+import redis.asyncio as aioredis
+from django.conf import settings
 from django.core.cache import cache
+from prometheus_client import Counter
 
 
 
 logger = logging.getLogger(__name__)
 
 # Base key spaces
-ROOM_VERSION_KEY = "chat:room:{room_id}:v"              # int version per room
-ROOM_MESSAGES_KEY = "chat:room:{room_id}:messages:v{v}" # serialized list
+ROOM_VERSION_KEY = "chat:room:{room_id}:v"              # int version per room (message history: chat.history)
+ROOM_META_VERSION_KEY = "chat:room:{room_id}:meta:v"    # int version of the room itself and its participants
 
-# TTLs
-ROOM_MESSAGES_TTL = 300  # seconds; tune as needed
+# Single-flight rebuilds (single_flight)
+DEFAULT_LOCK_TTL = 5           # seconds; longest a rebuild may hold its key's lock
+DEFAULT_LOCK_WAIT_MS = 500     # how long other requests wait for the rebuild before doing it themselves
+DEFAULT_STALE_SECONDS = 0      # stale-while-revalidate window; 0 = off
+LOCK_POLL_SECONDS = 0.01
 
-
-def _room_version_key(room_id: int) -> str:
-    return ROOM_VERSION_KEY.format(room_id=room_id)
+REBUILDS = Counter(
+    "chat_cache_rebuilds_total",
+    "Cache misses by outcome: built (this request rebuilt), waited / stale (coalesced into "
+    "another request's rebuild), timeout (gave up waiting and rebuilt too)",
+    ["cache", "outcome"],
+)
 
 
-def get_room_version(room_id: int) -> int:
+def get_redis():
     """
-    Get current version for a room; initialize to 1 if absent.
+    Raw redis client behind the default cache, or None when the cache is not
+    django-redis (LocMemCache in tests/dev). Callers fall back to the plain
+    cache API in that case.
     """
-    v = cache.get(_room_version_key(room_id))
-    if v is None:
-        v = 1
-        cache.set(_room_version_key(room_id), v, None)
-    return int(v)
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
 
 
-def bump_room_version(room_id: int) -> int:
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> redis.asyncio client
+
+
+def get_async_redis():
     """
-    Atomically bump version so old list keys are bypassed.
-    Logs whenever the room version changes.
+    redis.asyncio client for the same server as get_redis(), one per event
+    loop (connections can't cross loops), or None when get_redis() is None.
     """
-    key = _room_version_key(room_id)
+    if get_redis() is None:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        location = settings.CACHES["default"]["LOCATION"]
+        if isinstance(location, (list, tuple)):
+            location = location[0]  # the primary
+        client = _async_clients[loop] = aioredis.Redis.from_url(location)
+    return client
+
+
+def raw_key(key: str) -> str:
+    """
+    Apply the cache KEY_PREFIX/version to a key used with the raw client,
+    so raw structures live in the same namespace as cache entries.
+    """
+    return cache.make_key(key)
+
+
+def _room_version_key(room_id: int) -> str:
+    return ROOM_VERSION_KEY.format(room_id=room_id)
+
+
+def _get_version(key: str) -> int:
+    # an absent version reads as 1 and is not written: reads take room ids
+    # straight from request paths, before any existence check; the first
+    # bump creates the key
+    v = cache.get(key)
+    return 1 if v is None else int(v)
+
+
+def _bump_version(key: str) -> int:
     try:
         # Works with django-redis (atomic)
         v = cache.incr(key)
@@ -45,20 +94,86 @@ def bump_room_version(room_id: int) -> int:
             v = 1
         v = int(v) + 1
         cache.set(key, v, None)
+    return v
+
+
+def get_room_version(room_id: int) -> int:
+    """
+    Get current version for a room; 1 if absent.
+    """
+    return _get_version(_room_version_key(room_id))
+
 
+def bump_room_version(room_id: int) -> int:
+    """
+    Atomically bump version so old list keys are bypassed.
+    Logs whenever the room version changes.
+    """
+    v = _bump_version(_room_version_key(room_id))
     logger.info("Room %s cache version bumped to %s", room_id, v)
     return v
 
 
-def room_messages_cache_key(room_id: int, version: int) -> str:
-    return ROOM_MESSAGES_KEY.format(room_id=room_id, v=version)
+def get_room_meta_version(room_id: int) -> int:
+    """
+    Version of the room record and its participant list (room detail ETags).
+    """
+    return _get_version(ROOM_META_VERSION_KEY.format(room_id=room_id))
+
 
+def bump_room_meta_version(room_id: int) -> int:
+    return _bump_version(ROOM_META_VERSION_KEY.format(room_id=room_id))
 
-def get_room_messages_cached(room_id: int):
-    v = get_room_version(room_id)
-    key = room_messages_cache_key(room_id, v)
-    return cache.get(key), key, v
 
+def stale_seconds() -> int:
+    return int(getattr(settings, "CHAT_CACHE_STALE_SECONDS", DEFAULT_STALE_SECONDS))
 
-def set_room_messages_cache(key: str, data):
-    cache.set(key, data, ROOM_MESSAGES_TTL)
+
+def single_flight(key: str, build, timeout, stale_key: str = None, label: str = "default"):
+    """
+    cache.get(key), rebuilding a miss with build() in one request at a time.
+
+    The first request to miss takes a short lock (cache.add, i.e. SET NX on
+    Redis) and rebuilds. The others wait up to CHAT_CACHE_LOCK_WAIT_MS for its
+    result, then rebuild themselves. With `stale_key` and a
+    CHAT_CACHE_STALE_SECONDS window they don't wait: they get the previous
+    value (e.g. the last room version's) if it was built within the window.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, int(getattr(settings, "CHAT_CACHE_LOCK_TTL", DEFAULT_LOCK_TTL))):
+        try:
+            value = _rebuild(key, build, timeout, stale_key)
+        finally:
+            cache.delete(lock_key)
+        REBUILDS.labels(label, "built").inc()
+        return value
+
+    if stale_key and stale_seconds() > 0:
+        value = cache.get(stale_key)
+        if value is not None:
+            REBUILDS.labels(label, "stale").inc()
+            return value
+
+    deadline = time.monotonic() + getattr(settings, "CHAT_CACHE_LOCK_WAIT_MS", DEFAULT_LOCK_WAIT_MS) / 1000
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SECONDS)
+        value = cache.get(key)
+        if value is not None:
+            REBUILDS.labels(label, "waited").inc()
+            return value
+
+    logger.warning("Rebuild of %s is taking longer than the lock wait; rebuilding here too", key)
+    REBUILDS.labels(label, "timeout").inc()
+    return _rebuild(key, build, timeout, stale_key)
+
+
+def _rebuild(key, build, timeout, stale_key):
+    value = build()
+    cache.set(key, value, timeout)
+    if stale_key and stale_seconds() > 0:
+        cache.set(stale_key, value, stale_seconds())
+    return value
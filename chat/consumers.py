@@ -1,5 +1,7 @@
-import json
+import asyncio
 import logging
+import time
+from urllib.parse import parse_qs
 
 from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
@@ -7,34 +9,73 @@ from channels.db import database_sync_to_async
 
 from django.contrib.auth.models import AnonymousUser
 
-from .models import ChatRoom, ChatParticipant, Message, Presence
+from core import last_seen
 
+from . import presence, tickets
+from .auth import authenticate_token
+from .events import MSGPACK_SUBPROTOCOL, pack_frame, unpack_frame, repack_frame, room_event, room_group_name, user_group_name
+from .fanout import inbox_fanout_enabled, node_fanout, room_broadcast
+from .membership import is_member
+from .ratelimit import ws_limiter
+from .models import Message
+from .serializers import message_payload
+from .streams import append_message, latest_id, replay
+from .typing_state import coalescer, typing_tick
+from .writebehind import batcher, write_behind_enabled
 
 
-logger = logging.getLogger(__name__)
 
-def room_group_name(room_id: int) -> str:
-    return f"room_{room_id}"
+logger = logging.getLogger(__name__)
 
 
 @sync_to_async
 def user_is_participant(room_id: int, user_id: int) -> bool:
-    return ChatParticipant.objects.filter(chat_room_id=room_id, user_id=user_id).exists()
+    return is_member(room_id, user_id)
 
 
 @sync_to_async
-def create_message(room_id: int, user_id: int, content: str) -> dict:
+def _insert_message(room_id: int, user_id: int, content: str) -> dict:
     msg = Message.objects.create(chat_room_id=room_id, sender_id=user_id, content=content)
-    return {
-        "id": msg.id,
-        "room_id": room_id,
-        "sender_id": user_id,
-        "content": msg.content,
-        "created_at": msg.created_at.isoformat() if hasattr(msg, "created_at") else None,
-    }
+    return message_payload(msg)
+
+
+async def create_message(room_id: int, user_id: int, content: str) -> dict:
+    """
+    Persist a message and return its wire payload.
+    With CHAT_WRITE_BEHIND on, the row goes through the process-wide batcher
+    and this resolves only after the batch holding it has been flushed.
+    """
+    if write_behind_enabled():
+        return await batcher.submit(room_id, user_id, content)
+    return await _insert_message(room_id, user_id, content)
 
 
 class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Speaks JSON text frames by default; clients that offer the
+    "chat.msgpack" subprotocol get binary MessagePack frames both ways.
+
+    Sockets opened with ?mode=inbox (when CHAT_INBOX_FANOUT is on) subscribe
+    to their user group only and receive events for all of the user's rooms
+    without per-room joins; `join` then just confirms membership.
+
+    JWT-authenticated sockets close with 4401 when their access token
+    expires; `auth.refresh` swaps in a new token for the same user.
+
+    Heartbeat replies (and the `ticket` action) carry a signed resumption
+    ticket; reconnecting with ?ticket= rejoins the ticket's rooms and
+    replays what was missed in each, skipping the usual handshake work.
+    """
+    binary = False
+    inbox = False
+    _expiry = None
+    _pulse = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # set before connect(): group events can reach a consumer built without a handshake
+        self.last_ids = {}  # room_id -> last message id delivered to this socket
+
     async def connect(self):
         self.rooms = set()
         self.room_group_name = None
@@ -45,10 +86,23 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             await self.close(code=4401)  # Unauthorized
             return
 
-        await self.accept()
+        if MSGPACK_SUBPROTOCOL in (self.scope.get("subprotocols") or []):
+            self.binary = True
+            await self.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+        else:
+            await self.accept()
+        self._expire_at(self.scope.get("token_exp"))
+
+        qs = parse_qs((self.scope.get("query_string") or b"").decode())
+        if inbox_fanout_enabled() and (qs.get("mode") or [None])[0] == "inbox":
+            self.inbox = True
+            await self.channel_layer.group_add(user_group_name(self.user.id), self.channel_name)
         await self._presence_up()
+        if self.scope.get("resume"):
+            await self._restore(self.scope["resume"]["last_ids"])
 
     async def disconnect(self, code):
+        self._expire_at(None)
         if code == 4408:
             logger.warning(
                 "WebSocket 4408 (policy violation / throttled) user=%s",
@@ -59,12 +113,38 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             for gid in list(self.rooms):
                 await self.channel_layer.group_discard(gid, self.channel_name)
                 self.rooms.discard(gid)
+        if self.inbox:
+            await self.channel_layer.group_discard(user_group_name(self.user.id), self.channel_name)
+        for room_id in list(self.last_ids):
+            await node_fanout.unregister(room_id, self)
 
         await self._presence_down()
 
+    # Wire format
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.binary:
+            try:
+                content = unpack_frame(bytes_data)
+            except Exception:
+                return await self.send_json({"type": "error", "detail": "bad_frame"})
+            if not isinstance(content, dict):
+                return await self.send_json({"type": "error", "detail": "bad_frame"})
+            return await self.receive_json(content, **kwargs)
+        return await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.binary:
+            return await self.send(bytes_data=pack_frame(content), close=close)
+        return await super().send_json(content, close=close)
+
     async def receive_json(self, content, **kwargs):
         action = content.get("action")
-        if action == "join":
+        if not await ws_limiter.aallow(self.user.id, action):
+            return await self.close(code=4408)  # throttled (per user + action, all sockets)
+        await self._heartbeat(force=action == "heartbeat")
+        if action == "heartbeat":
+            await self.send_json({"type": "heartbeat", "ticket": self._ticket()})
+        elif action == "join":
             await self._join(content)
         elif action == "leave":
             await self._leave(content)
@@ -72,6 +152,12 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             await self._send_message(content)
         elif action == "typing":
             await self._typing(content)
+        elif action == "resume":
+            await self._resume(content)
+        elif action == "auth.refresh":
+            await self._refresh_auth(content)
+        elif action == "ticket":
+            await self.send_json({"type": "session.ticket", "ticket": self._ticket(), "expires_in": tickets.ticket_ttl()})
         else:
             await self.send_json({"type": "error", "detail": "unknown_action"})
 
@@ -83,10 +169,16 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         if not await user_is_participant(room_id, user.id):
             return await self.send_json({"type": "error", "detail": "not_a_participant"})
 
-        gid = room_group_name(room_id)
-        await self.channel_layer.group_add(gid, self.channel_name)
-        self.rooms.add(gid)
+        if not self.inbox:  # inbox sockets already get this room through the user group
+            gid = room_group_name(room_id)
+            await self.channel_layer.group_add(gid, self.channel_name)
+            self.rooms.add(gid)
+            await node_fanout.register(room_id, self)  # large rooms fan out node-locally
+        # after subscribing: anything newer is delivered (and tracked) from here on
+        if room_id not in self.last_ids:
+            self.last_ids[room_id] = await database_sync_to_async(latest_id)(room_id)
         await self.send_json({"type": "joined", "room_id": room_id})
+        await self._presence_enter(room_id)
 
     async def _leave(self, payload):
         room_id = payload.get("room_id")
@@ -94,6 +186,9 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         if gid in self.rooms:
             await self.channel_layer.group_discard(gid, self.channel_name)
             self.rooms.discard(gid)
+        self.last_ids.pop(room_id, None)
+        await node_fanout.unregister(room_id, self)
+        await self._presence_exit(room_id)
         await self.send_json({"type": "left", "room_id": room_id})
 
     async def _send_message(self, payload):
@@ -107,14 +202,20 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
             return await self.send_json({"type": "error", "detail": "not_a_participant"})
 
         message = await create_message(room_id, user.id, content)
+        await sync_to_async(append_message)(message)
 
         # ACK creator (bind temp_id for optimistic UI)
         await self.send_json({"type": "message_created", "message": message, "temp_id": temp_id})
 
-        # Broadcast to everyone in the room
-        await self.channel_layer.group_send(
-            room_group_name(room_id),
-            {"type": "broadcast.message", "message": message, "sender_id": user.id},
+        # Broadcast to everyone in the room (frame encoded once, here)
+        await room_broadcast(
+            self.channel_layer,
+            room_id,
+            room_event(
+                "broadcast.message",
+                {"type": "message_created", "message": message},
+                sender_id=user.id, room_id=room_id, message_id=message["id"],
+            ),
         )
 
     async def _typing(self, payload):
@@ -123,29 +224,193 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         user = self.scope["user"]
         if not await user_is_participant(room_id, user.id):
             return
-        await self.channel_layer.group_send(
-            room_group_name(room_id),
-            {"type": "broadcast.typing", "room_id": room_id, "user_id": user.id, "is_typing": is_typing},
+        if typing_tick() > 0:
+            # Coalesced: one aggregated typing_state per room per tick
+            return await coalescer.note(self.channel_layer, room_id, user.id, is_typing)
+        await room_broadcast(
+            self.channel_layer,
+            room_id,
+            room_event("broadcast.typing", {"type": "typing", "room_id": room_id, "user_id": user.id, "is_typing": is_typing}),
         )
 
-    # Presence management
-    @database_sync_to_async
-    def _presence_up(self):
-        if self.user and self.user.is_authenticated:
-            Presence.objects.update_or_create(
-                user_id=self.user.id,
-                channel_name=self.channel_name,
-                defaults={"room_id": self.room_id},
-            )
+    async def _resume(self, payload):
+        """
+        Replay what a reconnecting client missed: {room_id, last_seen_id}.
+        Clients should join first, then resume, and de-duplicate by message id.
+        """
+        room_id = payload.get("room_id")
+        last_seen_id = payload.get("last_seen_id")
+        if not isinstance(room_id, int) or not isinstance(last_seen_id, int):
+            return await self.send_json({"type": "error", "detail": "room_id_and_last_seen_id_required"})
+        if not await user_is_participant(room_id, self.scope["user"].id):
+            return await self.send_json({"type": "error", "detail": "not_a_participant"})
+        await self._send_replay(room_id, last_seen_id)
+
+    async def _send_replay(self, room_id, last_seen_id):
+        messages, source, has_more = await database_sync_to_async(replay)(room_id, last_seen_id)
+        if messages:
+            self._delivered(room_id, messages[-1]["id"])
+        await self.send_json({
+            "type": "resumed",
+            "room_id": room_id,
+            "messages": messages,
+            "source": source,
+            "has_more": has_more,
+        })
+
+    # Session resumption (chat.tickets)
+    def _ticket(self):
+        return tickets.issue(self.user, self.last_ids, self.scope.get("token_exp"))
 
-    @database_sync_to_async
-    def _presence_down(self):
-        Presence.objects.filter(channel_name=self.channel_name).delete()
+    def _delivered(self, room_id, message_id):
+        if room_id in self.last_ids and message_id > self.last_ids[room_id]:
+            self.last_ids[room_id] = message_id
+
+    async def _restore(self, last_ids):
+        """
+        Rejoin the rooms of a resumption ticket (membership re-checked against
+        the index), then send each room's presence snapshot and missed messages.
+        """
+        room_ids = await sync_to_async(lambda: [rid for rid in last_ids if is_member(rid, self.user.id)])()
+        for room_id in room_ids:
+            if not self.inbox:
+                gid = room_group_name(room_id)
+                await self.channel_layer.group_add(gid, self.channel_name)
+                self.rooms.add(gid)
+            await node_fanout.register(room_id, self)
+            self.last_ids[room_id] = last_ids[room_id]
+        self.presence_rooms.update(room_ids)
+        came = await sync_to_async(presence.touch)(self.user.id, self.channel_name, room_ids)
+        await self._announce_presence(came, online=True)
+
+        await self.send_json({"type": "session.resumed", "room_ids": room_ids})
+        for room_id in room_ids:
+            version, user_ids = await sync_to_async(presence.online_snapshot)(room_id)
+            await self.send_json({"type": "presence", "room_id": room_id, "online_user_ids": user_ids, "version": version})
+            await self._send_replay(room_id, last_ids[room_id])
+
+    # Token lifetime: a socket lives as long as its access token. Clients
+    # send "auth.refresh" with a fresh token before it expires instead of
+    # reconnecting; otherwise the socket is closed with 4401 at expiry.
+    async def _refresh_auth(self, payload):
+        token = payload.get("token")
+        if not isinstance(token, str) or not token:
+            return await self.send_json({"type": "error", "detail": "token_required"})
+        principal, claims = await authenticate_token(token)
+        if claims is None:
+            return await self.send_json({"type": "error", "detail": "invalid_token"})
+        if principal.id != self.user.id:
+            return await self.send_json({"type": "error", "detail": "token_user_mismatch"})
+
+        self.user = self.scope["user"] = principal
+        self.scope["token_exp"] = claims["exp"]
+        self._expire_at(claims["exp"])
+        await self.send_json({"type": "auth.refreshed", "exp": claims["exp"]})
+
+    def _expire_at(self, exp):
+        if self._expiry is not None:
+            self._expiry.cancel()
+        self._expiry = asyncio.create_task(self._close_at(exp)) if exp is not None else None
+
+    async def _close_at(self, exp):
+        await asyncio.sleep(max(0, exp - time.time()))
+        await self.close(code=4401)
+
+    # Presence (chat.presence). Scope None = connected at all; heartbeats
+    # ride on incoming frames (or an explicit "heartbeat" action), and a
+    # timer keeps idle sockets alive. Rooms get a presence_changed delta
+    # when a user's first socket arrives or their last one goes, including
+    # users whose sockets stopped heartbeating (found by the timer's prune).
+    async def _presence_up(self):
+        self.presence_rooms = set()
+        if self.room_id:
+            self.presence_rooms.add(int(self.room_id))
+        self._last_heartbeat = time.monotonic()
+        came = await sync_to_async(presence.touch)(self.user.id, self.channel_name, [None, *self.presence_rooms])
+        await self._announce_presence(came, online=True)
+        last_seen.record(self.user.id)  # batched UPDATE, off the event loop
+        self._pulse = asyncio.create_task(self._pulse_loop())
+
+    async def _pulse_loop(self):
+        while True:
+            await asyncio.sleep(presence.presence_ttl() / 3)
+            try:
+                await self._heartbeat()
+                pruned = await sync_to_async(presence.prune)([None, *self.presence_rooms])
+                await self._announce_expired(pruned)
+            except Exception:
+                logger.exception("Presence heartbeat failed for user %s", self.user.id)
+
+    async def _presence_down(self):
+        if not hasattr(self, "presence_rooms"):
+            return  # rejected before accept
+        if self._pulse is not None:
+            self._pulse.cancel()
+            self._pulse = None
+        went = await sync_to_async(presence.drop)(self.user.id, self.channel_name, [None, *self.presence_rooms])
+        self.presence_rooms.clear()
+        await self._announce_presence(went, online=False)
+
+    async def _presence_enter(self, room_id):
+        self.presence_rooms.add(room_id)
+        came = await sync_to_async(presence.touch)(self.user.id, self.channel_name, [room_id])
+        await self._announce_presence(came, online=True)
+
+        # initial snapshot for the joining socket; deltas follow
+        version, user_ids = await sync_to_async(presence.online_snapshot)(room_id)
+        await self.send_json({"type": "presence", "room_id": room_id, "online_user_ids": user_ids, "version": version})
+
+    async def _presence_exit(self, room_id):
+        if room_id in self.presence_rooms:
+            self.presence_rooms.discard(room_id)
+            went = await sync_to_async(presence.drop)(self.user.id, self.channel_name, [room_id])
+            await self._announce_presence(went, online=False)
+
+    async def _heartbeat(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_heartbeat > presence.presence_ttl() / 3:
+            self._last_heartbeat = now
+            came = await sync_to_async(presence.touch)(self.user.id, self.channel_name, [None, *self.presence_rooms])
+            await self._announce_presence(came, online=True)
+
+    async def _announce_presence(self, versions, online):
+        for room_id, version in versions.items():
+            if room_id is None:
+                continue
+            await room_broadcast(self.channel_layer, room_id, presence.presence_changed(room_id, self.user.id, online, version))
+
+    async def _announce_expired(self, pruned):
+        # whoever prunes announces: expired sockets never send their own "left"
+        for room_id, (version, gone) in pruned.items():
+            if room_id is None:
+                continue
+            for user_id in gone:
+                await room_broadcast(self.channel_layer, room_id, presence.presence_changed(room_id, user_id, False, version))
 
     # Group event handlers
+    # Events carry a pre-encoded frame ("text"); the dict fallbacks cover
+    # events still in flight from workers running the previous release.
+    async def _forward(self, event):
+        if self.binary:
+            return await self.send(bytes_data=event.get("bytes") or repack_frame(event["text"]))
+        await self.send(text_data=event["text"])
+
     async def broadcast_message(self, event):
+        if "text" in event:
+            if "message_id" in event:
+                self._delivered(event["room_id"], event["message_id"])
+            return await self._forward(event)
+        self._delivered(event["message"]["room_id"], event["message"]["id"])
         await self.send_json({"type": "message_created", "message": event["message"]})
 
     async def broadcast_typing(self, event):
+        if "text" in event:
+            return await self._forward(event)
         await self.send_json({"type": "typing", **{k: event[k] for k in ("room_id", "user_id", "is_typing")}})
-
+
+    async def broadcast_typing_state(self, event):
+        await self._forward(event)
+
+    async def broadcast_presence(self, event):
+        await self._forward(event)
+
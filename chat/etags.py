@@ -0,0 +1,41 @@
+import hashlib
+
+from django.utils.http import parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+
+
+# Conditional GETs against the per-room cache versions. A tag is the version
+# plus a digest of everything else the body depends on (path and query
+# params, media type, encoding), so checking If-None-Match costs one version
+# read: no DB query, no cached body.
+
+
+def etag(kind: str, room_id, version: int, request) -> str:
+    """
+    Strong ETag for one representation of `kind` at `version`.
+    """
+    variant = "|".join((
+        request.get_full_path(),
+        getattr(request, "accepted_media_type", "") or "",
+        request.headers.get("Accept-Encoding", ""),  # a gzip body is another representation
+    ))
+    digest = hashlib.md5(variant.encode("utf8")).hexdigest()[:12]
+    return f'"{kind}-{room_id}-{version}-{digest}"'
+
+
+def matches(request, tag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    candidates = parse_etags(header)
+    return tag in candidates or "*" in candidates
+
+
+def not_modified(tag: str, vary: str = None) -> Response:
+    headers = {"ETag": tag}
+    if vary:
+        headers["Vary"] = vary
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
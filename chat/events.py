@@ -0,0 +1,49 @@
+import json
+from functools import lru_cache
+
+import msgpack
+
+
+
+# Binary wire protocol, negotiated via Sec-WebSocket-Protocol; JSON otherwise
+MSGPACK_SUBPROTOCOL = "chat.msgpack"
+
+
+def room_group_name(room_id: int) -> str:
+    return f"room_{room_id}"
+
+
+def user_group_name(user_id: int) -> str:
+    # Per-user inbox: every socket of the user that connected with ?mode=inbox
+    return f"user_{user_id}"
+
+
+def encode_frame(frame: dict) -> str:
+    # Same encoding AsyncJsonWebsocketConsumer.encode_json uses
+    return json.dumps(frame)
+
+
+def pack_frame(frame: dict) -> bytes:
+    return msgpack.packb(frame, use_bin_type=True)
+
+
+def unpack_frame(data: bytes):
+    return msgpack.unpackb(data, raw=False)
+
+
+@lru_cache(maxsize=256)
+def repack_frame(text: str) -> bytes:
+    """
+    MessagePack form of a JSON-encoded frame. Memoized, so all binary
+    sockets in this process that get the same event share one conversion.
+    """
+    return pack_frame(json.loads(text))
+
+
+def room_event(handler: str, frame: dict, **extra) -> dict:
+    """
+    Channel-layer event carrying the client frame already encoded as JSON
+    (the default wire format). Built once by the sender; JSON consumers
+    forward `text` as-is, MessagePack consumers send repack_frame(text).
+    """
+    return {"type": handler, "text": encode_frame(frame), **extra}
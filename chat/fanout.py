@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import time
+
+import redis.asyncio as aioredis
+from asgiref.sync import sync_to_async
+from channels.consumer import get_handler_name
+
+from django.conf import settings
+
+from .cache import get_redis, raw_key
+from .events import pack_frame, room_group_name, unpack_frame, user_group_name
+from .membership import room_members, room_size
+
+
+
+logger = logging.getLogger(__name__)
+
+# Large rooms: one Redis pub/sub message per event, fanned out by each node
+# to its own sockets, instead of one channel-layer push per member
+LARGE_ROOM_CHANNEL = "chat:room:{room_id}:fanout"
+
+DEFAULT_LARGE_ROOM_THRESHOLD = 0  # members; 0 = every room goes through the channel layer
+ROOM_SIZE_CACHE_SECONDS = 30      # how long a process trusts a room's size class
+SUBSCRIBE_AT = 0.8                # subscribe a bit below the threshold, ahead of publishers
+WATCH_SECONDS = 5                 # how often unsubscribed rooms with local sockets are re-measured
+CONSUMER_QUEUE_SIZE = 1000        # events buffered per socket before a slow one starts dropping
+
+
+def inbox_fanout_enabled() -> bool:
+    return bool(getattr(settings, "CHAT_INBOX_FANOUT", False))
+
+
+def large_room_threshold() -> int:
+    return int(getattr(settings, "CHAT_LARGE_ROOM_THRESHOLD", DEFAULT_LARGE_ROOM_THRESHOLD))
+
+
+class NodeFanout:
+    """
+    Per-process registry of the consumers that joined each room, plus one
+    Redis pub/sub subscription per large room with local consumers.
+
+    A large-room event is published once; every node subscribed to the
+    room receives it and queues it for each of its own consumers, so Redis
+    work per event is O(nodes) rather than O(members). Each consumer drains
+    its own queue in order, so a slow or failing socket holds up nobody
+    else. Without Redis (tests/dev) publishing dispatches locally.
+
+    Rooms below the threshold are only tracked in memory. Publishers keep
+    a room's size class for ROOM_SIZE_CACHE_SECONDS, so nodes subscribe
+    early: at SUBSCRIBE_AT of the threshold, re-measured every
+    WATCH_SECONDS while they have local consumers.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._rooms = {}     # room_id -> set of consumers
+        self._sizes = {}     # room_id -> (is_large, checked_at)
+        self._outbox = {}    # consumer -> (queue, drain task, room ids)
+        self._subscribed = set()
+        self._client = None
+        self._pubsub = None
+        self._listener = None
+        self._watcher = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # New event loop (worker restart, tests): drop state tied to the old one
+            self._loop = loop
+            self._rooms = {}
+            self._sizes = {}
+            self._outbox = {}
+            self._subscribed = set()
+            self._client = None
+            self._pubsub = None
+            self._listener = None
+            self._watcher = None
+        return loop
+
+    def _channel(self, room_id) -> str:
+        return raw_key(LARGE_ROOM_CHANNEL.format(room_id=room_id))
+
+    def _redis(self):
+        if self._client is None:
+            self._client = aioredis.Redis.from_url(settings.CHAT_LARGE_ROOM_REDIS_URL)
+        return self._client
+
+    async def is_large(self, room_id) -> bool:
+        self._bind_loop()
+        threshold = large_room_threshold()
+        if threshold <= 0:
+            return False
+        now = time.monotonic()
+        cached = self._sizes.get(room_id)
+        if cached is not None and now - cached[1] < ROOM_SIZE_CACHE_SECONDS:
+            return cached[0]
+        large = await sync_to_async(room_size)(room_id) >= threshold
+        self._sizes[room_id] = (large, now)
+        return large
+
+    async def _worth_subscribing(self, room_id) -> bool:
+        return await sync_to_async(room_size)(room_id) >= large_room_threshold() * SUBSCRIBE_AT
+
+    async def register(self, room_id, consumer):
+        if large_room_threshold() <= 0:
+            return
+        self._bind_loop()
+        self._rooms.setdefault(room_id, set()).add(consumer)
+        if consumer not in self._outbox:
+            queue = asyncio.Queue(CONSUMER_QUEUE_SIZE)
+            self._outbox[consumer] = (queue, self._loop.create_task(self._drain(consumer, queue)), set())
+        self._outbox[consumer][2].add(room_id)
+
+        if get_redis() is None or room_id in self._subscribed:
+            return
+        if await self._worth_subscribing(room_id):
+            await self._subscribe(room_id)
+        elif self._watcher is None:
+            self._watcher = self._loop.create_task(self._watch())
+
+    async def unregister(self, room_id, consumer):
+        consumers = self._rooms.get(room_id)
+        if not consumers or consumer not in consumers:
+            return
+        consumers.discard(consumer)
+        _, task, room_ids = self._outbox[consumer]
+        room_ids.discard(room_id)
+        if not room_ids:
+            task.cancel()
+            del self._outbox[consumer]
+        if not consumers:
+            del self._rooms[room_id]
+            if room_id in self._subscribed:
+                self._subscribed.discard(room_id)
+                await self._pubsub.unsubscribe(self._channel(room_id))
+
+    async def publish(self, room_id, event):
+        self._bind_loop()
+        if get_redis() is None:
+            return await self.dispatch(room_id, event)
+        await self._redis().publish(self._channel(room_id), pack_frame(event))
+
+    async def dispatch(self, room_id, event):
+        """
+        Queue an event for each of this process's consumers in the room.
+        """
+        for consumer in self._rooms.get(room_id, ()):
+            try:
+                self._outbox[consumer][0].put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning("Dropping %s for %s: its fan-out queue is full", event.get("type"), consumer)
+
+    async def _drain(self, consumer, queue):
+        while True:
+            event = await queue.get()
+            try:
+                await getattr(consumer, get_handler_name(event))(event)
+            except Exception:
+                logger.exception("Local fan-out of %s to %s failed", event.get("type"), consumer)
+
+    async def _subscribe(self, room_id):
+        if self._pubsub is None:
+            self._pubsub = self._redis().pubsub(ignore_subscribe_messages=True)
+        self._subscribed.add(room_id)
+        await self._pubsub.subscribe(self._channel(room_id))
+        if self._listener is None:
+            self._listener = self._loop.create_task(self._listen(self._pubsub))
+
+    async def _watch(self):
+        """
+        Subscribe rooms that grew into the large class while we had sockets in them.
+        """
+        while self._watcher is asyncio.current_task():
+            await asyncio.sleep(WATCH_SECONDS)
+            pending = [room_id for room_id in self._rooms if room_id not in self._subscribed]
+            if not pending:
+                self._watcher = None
+                return
+            for room_id in pending:
+                try:
+                    if room_id in self._rooms and await self._worth_subscribing(room_id):
+                        await self._subscribe(room_id)
+                except Exception:
+                    logger.exception("Could not re-measure room %s for node fan-out", room_id)
+
+    async def _listen(self, pubsub):
+        while pubsub is self._pubsub:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Large-room subscriber failed; retrying")
+                await asyncio.sleep(1)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            room_id = int(message["channel"].decode().rsplit(":", 2)[-2])
+            await self.dispatch(room_id, unpack_frame(message["data"]))
+
+
+node_fanout = NodeFanout()
+
+
+async def room_broadcast(channel_layer, room_id: int, event: dict):
+    """
+    Deliver a room event to every subscriber of the room.
+
+    Sockets that joined the room get it through the room group. With
+    CHAT_INBOX_FANOUT on, it is also sent to each member's user group,
+    resolved from the cached member list, for sockets in inbox mode.
+
+    Rooms with at least CHAT_LARGE_ROOM_THRESHOLD members reach joined
+    sockets through node_fanout instead of the room group. Inbox copies
+    are sent either way: inbox sockets never register with node_fanout.
+    """
+    if await node_fanout.is_large(room_id):
+        await node_fanout.publish(room_id, event)
+    else:
+        await channel_layer.group_send(room_group_name(room_id), event)
+    if not inbox_fanout_enabled():
+        return
+
+    members = await sync_to_async(room_members)(room_id)
+    await asyncio.gather(*(
+        channel_layer.group_send(user_group_name(user_id), event) for user_id in members
+    ))
@@ -0,0 +1,365 @@
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .cache import ROOM_VERSION_KEY, bump_room_version, get_room_version, single_flight
+from .models import Message
+from .serializers import MessageSerializer
+
+
+
+logger = logging.getLogger(__name__)
+
+# Room history cache for MessageViewSet.list. Older messages live in sealed
+# blocks bounded by the (timestamp, id) of their first and last message; new
+# messages never land in them, so they are kept for days and only patched
+# by edits and deletes. Everything after the last block is the head, cached
+# per room version and rebuilt (one small query) after any write. Rebuilds go
+# through chat.cache.single_flight: a bump in a busy room costs one query.
+# Changes patch/discard can't follow (renamed senders, bulk deletes) call
+# invalidate(), which moves the room to a new epoch: blocks and registry
+# are keyed by it, so the old ones are simply never read again.
+HISTORY_EPOCH_KEY = "chat:room:{room_id}:history:epoch"
+HISTORY_REGISTRY_KEY = "chat:room:{room_id}:history:e{epoch}"            # block bounds, oldest first
+HISTORY_BLOCK_KEY = "chat:room:{room_id}:history:e{epoch}:{lo}-{hi}"     # one sealed block
+HISTORY_HEAD_KEY = "chat:room:{room_id}:history:head:v{v}"              # messages after the last block
+HISTORY_STALE_HEAD_KEY = "chat:room:{room_id}:history:head"              # last head built, for stale-while-revalidate
+
+DEFAULT_BLOCK_SIZE = 100          # messages per sealed block; the head stays under two blocks
+DEFAULT_BLOCK_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BLOCKS = 50           # per room; older pages come from the DB
+HEAD_TTL = 300
+PATCH_LOCK_TTL = 2                # seconds; a block patch is one get + one set
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def block_size() -> int:
+    return int(getattr(settings, "CHAT_HISTORY_BLOCK_SIZE", DEFAULT_BLOCK_SIZE))
+
+
+def block_ttl() -> int:
+    return int(getattr(settings, "CHAT_HISTORY_BLOCK_TTL", DEFAULT_BLOCK_TTL))
+
+
+def max_blocks() -> int:
+    return int(getattr(settings, "CHAT_HISTORY_MAX_BLOCKS", DEFAULT_MAX_BLOCKS))
+
+
+def message_key(timestamp: datetime, pk: int) -> tuple:
+    """
+    Sort key of a message: (microseconds since the epoch, id).
+    """
+    return (timestamp - _EPOCH) // _MICROSECOND, pk
+
+
+def key_position(key: tuple) -> tuple:
+    """
+    (timestamp, id) for a sort key, as the paginator's cursors take them.
+    """
+    return _EPOCH + timedelta(microseconds=key[0]), key[1]
+
+
+@dataclass
+class HistoryPage:
+    items: list        # serialized messages, oldest first
+    first: tuple       # (timestamp, id) of items[0], or None
+    last: tuple        # (timestamp, id) of items[-1], or None
+    has_older: bool
+    has_newer: bool
+    version: int       # room version of the head it was assembled from
+
+
+def _q(op: str, key: tuple) -> Q:
+    """
+    Messages strictly before (op="lt") or after (op="gt") a sort key.
+    """
+    timestamp, pk = key_position(key)
+    return Q(**{f"timestamp__{op}": timestamp}) | Q(timestamp=timestamp, **{f"id__{op}": pk})
+
+
+def _rows(queryset) -> list:
+    messages = list(queryset.select_related("sender"))
+    items = MessageSerializer(messages, many=True).data
+    return [(message_key(m.timestamp, m.id), dict(item)) for m, item in zip(messages, items)]
+
+
+def _registry_key(room_id: int, epoch: int) -> str:
+    return HISTORY_REGISTRY_KEY.format(room_id=room_id, epoch=epoch)
+
+
+def _block_key(room_id: int, epoch: int, lo: tuple, hi: tuple) -> str:
+    return HISTORY_BLOCK_KEY.format(room_id=room_id, epoch=epoch, lo=f"{lo[0]}.{lo[1]}", hi=f"{hi[0]}.{hi[1]}")
+
+
+def _store_block(room_id: int, epoch: int, rows: list) -> tuple:
+    lo, hi = rows[0][0], rows[-1][0]
+    cache.set(_block_key(room_id, epoch, lo, hi), rows, block_ttl())
+    return lo, hi
+
+
+def _load_block(room_id: int, epoch: int, lo: tuple, hi: tuple) -> list:
+    # if evicted: the bounds are fixed, so rebuild exactly that range
+    return single_flight(
+        _block_key(room_id, epoch, lo, hi),
+        lambda: _rows(
+            Message.objects.filter(chat_room_id=room_id)
+            .exclude(_q("lt", lo)).exclude(_q("gt", hi))
+            .order_by("timestamp", "id")
+        ),
+        block_ttl(),
+        label="history_block",
+    )
+
+
+def _save_registry(room_id: int, registry: dict, expected_floor, expected_top):
+    """
+    Store `registry` unless another worker moved the chain's ends first
+    (their blocks are as good as ours; the next read picks them up).
+    """
+    key = _registry_key(room_id, registry["epoch"])
+    current = cache.get(key)
+    if current is not None and (_floor(current), _top(current)) != (expected_floor, expected_top):
+        return
+    cache.set(key, registry, block_ttl())
+
+
+def _floor(registry):
+    return registry["blocks"][0][0] if registry["blocks"] else None
+
+
+def _top(registry):
+    return registry["blocks"][-1][1] if registry["blocks"] else None
+
+
+def _build(room_id: int, version: int, epoch: int) -> dict:
+    """
+    First read of a room (in this epoch): the newest two blocks' worth of
+    messages become one sealed block plus the head (or just the head for a
+    short history). Returns the registry; the head is cached for `version`.
+    """
+    size = block_size()
+    rows = _rows(Message.objects.filter(chat_room_id=room_id).order_by("-timestamp", "-id")[:2 * size])[::-1]
+    registry = {"epoch": epoch, "blocks": [], "complete": len(rows) < 2 * size}
+    if not registry["complete"]:
+        registry["blocks"].append(_store_block(room_id, epoch, rows[:size]))
+        rows = rows[size:]
+    cache.set(HISTORY_HEAD_KEY.format(room_id=room_id, v=version),
+              {"v": version, "after": _top(registry), "rows": rows}, HEAD_TTL)
+    return registry
+
+
+def _head(room_id: int, registry: dict, version: int) -> dict:
+    entry = single_flight(
+        HISTORY_HEAD_KEY.format(room_id=room_id, v=version),
+        lambda: _build_head(room_id, registry, version),
+        HEAD_TTL,
+        stale_key=HISTORY_STALE_HEAD_KEY.format(room_id=room_id),
+        label="history_head",
+    )
+    if entry["after"] != _top(registry):
+        # built against a chain that has since been sealed further (or not as far)
+        entry = _build_head(room_id, registry, version)
+    return entry
+
+
+def _build_head(room_id: int, registry: dict, version: int) -> dict:
+    top = _top(registry)
+    queryset = Message.objects.filter(chat_room_id=room_id)
+    if top is not None:
+        queryset = queryset.filter(_q("gt", top))
+    rows = _rows(queryset.order_by("timestamp", "id"))
+
+    # seal full blocks off the bottom, keeping the head under two blocks
+    size = block_size()
+    sealed = dict(registry, blocks=list(registry["blocks"]))
+    while len(rows) >= 2 * size:
+        sealed["blocks"].append(_store_block(room_id, registry["epoch"], rows[:size]))
+        rows = rows[size:]
+    if len(sealed["blocks"]) > max_blocks():
+        # the oldest blocks fall out of the registry (and expire)
+        sealed["blocks"] = sealed["blocks"][-max_blocks():]
+        sealed["complete"] = False
+    if sealed["blocks"] != registry["blocks"]:
+        logger.debug("Room %s history: sealed %s blocks", room_id, len(sealed["blocks"]) - len(registry["blocks"]))
+        _save_registry(room_id, sealed, _floor(registry), top)
+        registry.update(sealed)
+    return {"v": version, "after": _top(registry), "rows": rows}
+
+
+def _extend(room_id: int, registry: dict) -> bool:
+    """
+    Seal the block just below the oldest one. False at the start of history.
+    """
+    floor = _floor(registry)
+    rows = _rows(
+        Message.objects.filter(chat_room_id=room_id).filter(_q("lt", floor))
+        .order_by("-timestamp", "-id")[:block_size()]
+    )[::-1]
+    extended = dict(registry, blocks=list(registry["blocks"]), complete=len(rows) < block_size())
+    if rows:
+        extended["blocks"].insert(0, _store_block(room_id, registry["epoch"], rows))
+    _save_registry(room_id, extended, floor, _top(registry))
+    registry.update(extended)
+    return bool(rows)
+
+
+def _versions(room_id: int):
+    """
+    (room version, history epoch) in one cache round trip.
+    """
+    version_key = ROOM_VERSION_KEY.format(room_id=room_id)
+    epoch_key = HISTORY_EPOCH_KEY.format(room_id=room_id)
+    found = cache.get_many([version_key, epoch_key])
+    version = found.get(version_key)
+    if version is None:
+        version = get_room_version(room_id)
+    return int(version), int(found.get(epoch_key) or 0)
+
+
+def _state(room_id: int):
+    # version first: a write racing the head query then lands under a newer version
+    version, epoch = _versions(room_id)
+    registry = single_flight(
+        _registry_key(room_id, epoch),
+        lambda: _build(room_id, version, epoch),
+        block_ttl(),
+        label="history_registry",
+    )
+    return registry, _head(room_id, registry, version)
+
+
+def _page(rows: list, head: dict, has_older, has_newer) -> HistoryPage:
+    return HistoryPage(
+        items=[item for _, item in rows],
+        first=key_position(rows[0][0]) if rows else None,
+        last=key_position(rows[-1][0]) if rows else None,
+        has_older=has_older,
+        has_newer=has_newer,
+        version=head["v"],
+    )
+
+
+def page(room_id: int, size: int, before=None, after=None):
+    """
+    One page of `room_id`'s history, oldest first: the newest `size`
+    messages, those just before `before` or just after `after` (cursors
+    as (timestamp, id)). Returns None if `after` points below the cached
+    part of a long history; the caller then reads the database.
+    """
+    registry, head = _state(room_id)
+    if after is not None:
+        return _page_after(room_id, registry, head, size, message_key(*after))
+    return _page_before(room_id, registry, head, size, before and message_key(*before))
+
+
+def _page_before(room_id, registry, head, size, before):
+    collected = []  # newest first
+
+    def take(rows):
+        for key, item in reversed(rows):
+            if before is None or key < before:
+                collected.append((key, item))
+                if len(collected) > size:
+                    return True
+        return False
+
+    done = take(head["rows"])
+    i = len(registry["blocks"]) - 1
+    while not done:
+        if i < 0:
+            if registry["complete"]:
+                break
+            if before is not None and before < _floor(registry):
+                return None  # cursor from below the chain
+            if len(registry["blocks"]) >= max_blocks():
+                return None  # the rest is older than the cache keeps
+            if not _extend(room_id, registry):
+                break
+            i = 0
+        lo, hi = registry["blocks"][i]
+        if before is None or lo < before:
+            done = take(_load_block(room_id, registry["epoch"], lo, hi))
+        i -= 1
+
+    rows = collected[:size][::-1]
+    return _page(rows, head, has_older=len(collected) > size, has_newer=before is not None)
+
+
+def _page_after(room_id, registry, head, size, after):
+    if not registry["complete"] and after < _floor(registry):
+        return None
+    collected = []  # oldest first
+    segments = [(lo, hi, None) for lo, hi in registry["blocks"] if hi > after] + [(None, None, head["rows"])]
+    for lo, hi, rows in segments:
+        if rows is None:
+            rows = _load_block(room_id, registry["epoch"], lo, hi)
+        collected.extend(row for row in rows if row[0] > after)
+        if len(collected) > size:
+            break
+    return _page(collected[:size], head, has_older=True, has_newer=len(collected) > size)
+
+
+def _patch(room_id: int, key: tuple, change):
+    epoch = int(cache.get(HISTORY_EPOCH_KEY.format(room_id=room_id)) or 0)
+    registry = cache.get(_registry_key(room_id, epoch))
+    if registry is None:
+        return
+    block = next(((lo, hi) for lo, hi in registry["blocks"] if lo <= key <= hi), None)
+    if block is None:
+        return  # in the head: rebuilt with the next room version
+
+    block_key = _block_key(room_id, epoch, *block)
+    lock_key = f"{block_key}:lock"
+    deadline = time.monotonic() + PATCH_LOCK_TTL
+    while not cache.add(lock_key, 1, PATCH_LOCK_TTL):
+        if time.monotonic() > deadline:
+            break  # holder died; its lock is about to expire anyway
+        time.sleep(0.005)
+    try:
+        rows = cache.get(block_key)
+        if rows is None:
+            return
+        for i, (row_key, _) in enumerate(rows):
+            if row_key == key:
+                change(rows, i)
+                cache.set(block_key, rows, block_ttl())
+                break
+    finally:
+        cache.delete(lock_key)
+
+
+def patch(message: Message):
+    """
+    Update an edited message in its cached block (call after saving).
+    """
+    item = dict(MessageSerializer(message).data)
+    _patch(message.chat_room_id, message_key(message.timestamp, message.id),
+           lambda rows, i: rows.__setitem__(i, (rows[i][0], item)))
+
+
+def discard(room_id: int, position: tuple):
+    """
+    Drop a deleted message, given as (timestamp, id), from its cached block.
+    """
+    _patch(room_id, message_key(*position), lambda rows, i: rows.pop(i))
+
+
+def invalidate(room_id: int):
+    """
+    Forget a room's sealed blocks, for changes patch/discard don't follow:
+    renamed senders, deleted users' messages, archiving. The room moves to
+    a new epoch (old blocks expire unread) and a new version (new head).
+    """
+    epoch_key = HISTORY_EPOCH_KEY.format(room_id=room_id)
+    old = int(cache.get(epoch_key) or 0)
+    # time-based, so an evicted epoch key can't bring back an old epoch's blocks
+    cache.set(epoch_key, max(time.time_ns() // 1000, old + 1), None)
+    cache.delete(_registry_key(room_id, old))
+    bump_room_version(room_id)
@@ -4,8 +4,8 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 
-from chat.models import Message
-from chat.models.archive import ArchivedMessage
+from chat import history
+from chat.models import ArchivedMessage, Message
 
 
 
@@ -18,7 +18,7 @@ class Command(BaseCommand):
     def handle(self, *args, **opts):
         cutoff = timezone.now() - timedelta(days=opts["days"])
         qs = Message.objects.filter(timestamp__lt=cutoff)[:5000]  # batch
-        count = 0
+        count, rooms = 0, set()
         for m in qs:
             ArchivedMessage.objects.get_or_create(
                 orig_id=m.id,
@@ -30,5 +30,8 @@ class Command(BaseCommand):
                 },
             )
             m.delete()
+            rooms.add(m.chat_room_id)
             count += 1
+        for room_id in rooms:
+            history.invalidate(room_id)  # archived rows may sit in sealed blocks
         self.stdout.write(self.style.SUCCESS(f"Archived {count} messages"))
@@ -0,0 +1,66 @@
+import redis
+from channels_redis.utils import decode_hosts
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.layers import DEFAULT_VNODES, HashRing, host_name
+
+
+
+def _client(host: dict):
+    host = dict(host)
+    if "address" in host:
+        return redis.Redis.from_url(host.pop("address"), **host)
+    if "master_name" in host:
+        raise CommandError("Sentinel hosts are not supported; reshard against the masters directly")
+    return redis.Redis(**host)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move channel-layer group memberships to the shard that owns them under the "
+        "configured CHANNEL_LAYERS hosts (run after adding/removing hosts)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from-hosts", default="",
+            help="Comma-separated redis:// URLs of the previous layout (hosts no longer configured)",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **opts):
+        config = settings.CHANNEL_LAYERS["default"].get("CONFIG", {})
+        prefix = config.get("prefix", "asgi")
+        group_expiry = config.get("group_expiry", 86400)
+        hosts = decode_hosts(config.get("hosts"))
+        ring = HashRing([host_name(h) for h in hosts], config.get("vnodes", DEFAULT_VNODES))
+        targets = {host_name(h): _client(h) for h in hosts}
+
+        sources = dict(targets)
+        for address in filter(None, (a.strip() for a in opts["from_hosts"].split(","))):
+            sources.setdefault(address, redis.Redis.from_url(address))
+
+        group_prefix = f"{prefix}:group:"
+        moved = 0
+        for name, source in sources.items():
+            for key in source.scan_iter(match=f"{group_prefix}*", count=1000):
+                group = key.decode("utf8")[len(group_prefix):]
+                owner = ring.nodes[ring.index(group)]
+                if owner == name:
+                    continue
+                moved += 1
+                if opts["dry_run"]:
+                    self.stdout.write(f"{group}: {name} -> {owner}")
+                    continue
+                members = source.zrange(key, 0, -1, withscores=True)
+                if members:
+                    pipe = targets[owner].pipeline()
+                    pipe.zadd(key, dict(members))
+                    pipe.expire(key, group_expiry)
+                    pipe.execute()
+                source.delete(key)
+
+        verb = "Would move" if opts["dry_run"] else "Moved"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} groups across {len(targets)} shards"))
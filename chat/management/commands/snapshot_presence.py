@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import ChatRoom, Presence
+from chat.presence import online_user_ids
+
+
+
+class Command(BaseCommand):
+    help = "Snapshot live presence (Redis) into the Presence table for history/reporting"
+
+    def handle(self, *args, **opts):
+        rows = [Presence(user_id=uid, room=None, channel_name="snapshot") for uid in online_user_ids(None)]
+        for room_id in ChatRoom.objects.values_list("id", flat=True).iterator():
+            rows.extend(
+                Presence(user_id=uid, room_id=room_id, channel_name="snapshot")
+                for uid in online_user_ids(room_id)
+            )
+
+        with transaction.atomic():
+            Presence.objects.all().delete()
+            Presence.objects.bulk_create(rows, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"Snapshotted {len(rows)} presence rows"))
@@ -0,0 +1,216 @@
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_redis, raw_key
+from .models import ChatParticipant
+
+
+
+logger = logging.getLogger(__name__)
+
+# One set of user ids per room (Redis SET, or a frozenset via the cache API)
+ROOM_MEMBERS_KEY = "chat:room:{room_id}:members"
+# Bumped by every change that finds the set unbuilt: a rebuild whose DB read
+# started before the bump would otherwise store a member list without it
+ROOM_MEMBERS_GEN_KEY = "chat:room:{room_id}:members:gen"
+
+# Marker kept in every Redis set so an empty room is still "built"
+_SENTINEL = "-"
+
+# TTL bounds drift if a change ever slips past the signals
+DEFAULT_MEMBERSHIP_TTL = 3600
+
+# Outlives any rebuild's DB read
+GEN_TTL = 300
+
+# Values per SADD/SREM: Lua's unpack() fails somewhere past 8k arguments
+MEMBER_CHUNK = 1000
+
+# Apply SADD/SREM only to sets that are already built; absent sets rebuild
+# lazily, and any rebuild already reading the DB is told to discard its result
+_UPDATE_IF_BUILT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call(ARGV[1], KEYS[1], unpack(ARGV, 3))
+end
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 0
+"""
+
+# Swap a rebuilt set (filled under KEYS[3]) in only if no change raced the
+# DB read (generation unchanged)
+_STORE_IF_CURRENT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    redis.call('DEL', KEYS[3])
+    return 0
+end
+redis.call('RENAME', KEYS[3], KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Drop the set and invalidate rebuilds in flight
+_INVALIDATE = """
+redis.call('DEL', KEYS[1])
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+
+def _members_key(room_id: int) -> str:
+    return ROOM_MEMBERS_KEY.format(room_id=room_id)
+
+
+def _gen_key(room_id: int) -> str:
+    return ROOM_MEMBERS_GEN_KEY.format(room_id=room_id)
+
+
+def _bump_gen(room_id: int):
+    # cache API fallback (not atomic with the set, like the rest of it)
+    key = _gen_key(room_id)
+    if not cache.add(key, 1, GEN_TTL):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, GEN_TTL)
+
+
+def _chunks(values: list):
+    for i in range(0, len(values), MEMBER_CHUNK):
+        yield values[i:i + MEMBER_CHUNK]
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_MEMBERSHIP_TTL", DEFAULT_MEMBERSHIP_TTL))
+
+
+def _load_members(room_id: int) -> frozenset:
+    return frozenset(
+        ChatParticipant.objects.filter(chat_room_id=room_id).values_list("user_id", flat=True)
+    )
+
+
+def _rebuild(room_id: int) -> frozenset:
+    """
+    Rebuild a room's index from ChatParticipant. The result is only stored
+    if no membership change landed while the DB was being read; otherwise
+    the set stays unbuilt and the next read rebuilds it again.
+    """
+    r = get_redis()
+    if r is None:
+        gen = cache.get(_gen_key(room_id))
+        members = _load_members(room_id)
+        stored = cache.get(_gen_key(room_id)) == gen
+        if stored:
+            cache.set(_members_key(room_id), members, _ttl())
+    else:
+        key, gen_key = raw_key(_members_key(room_id)), raw_key(_gen_key(room_id))
+        gen = r.get(gen_key) or b""
+        members = _load_members(room_id)
+        # fill a private key in chunks; the script only renames it into place
+        build_key = f"{key}:build:{uuid.uuid4().hex}"
+        pipe = r.pipeline(transaction=False)
+        pipe.sadd(build_key, _SENTINEL)
+        for chunk in _chunks(list(members)):
+            pipe.sadd(build_key, *chunk)
+        pipe.expire(build_key, GEN_TTL)
+        pipe.execute()
+        stored = r.eval(_STORE_IF_CURRENT, 3, key, gen_key, build_key, gen, _ttl())
+    if stored:
+        logger.debug("Membership index for room %s rebuilt (%s members)", room_id, len(members))
+    else:
+        logger.debug("Membership index for room %s changed during rebuild; not stored", room_id)
+    return members
+
+
+def is_member(room_id, user_id) -> bool:
+    """
+    Membership check in one cache round trip; rebuilds the room lazily on a miss.
+    """
+    try:
+        room_id, user_id = int(room_id), int(user_id)
+    except (TypeError, ValueError):
+        return False
+
+    r = get_redis()
+    if r is None:
+        members = cache.get(_members_key(room_id))
+        if members is None:
+            members = _rebuild(room_id)
+        return user_id in members
+
+    pipe = r.pipeline(transaction=False)
+    key = raw_key(_members_key(room_id))
+    pipe.sismember(key, user_id)
+    pipe.exists(key)
+    found, built = pipe.execute()
+    if built:
+        return bool(found)
+    return user_id in _rebuild(room_id)
+
+
+def room_members(room_id: int) -> frozenset:
+    """
+    All member ids of a room, read through the same index.
+    """
+    r = get_redis()
+    if r is None:
+        members = cache.get(_members_key(room_id))
+        return _rebuild(room_id) if members is None else members
+
+    raw = r.smembers(raw_key(_members_key(room_id)))
+    if not raw:
+        return _rebuild(room_id)
+    return frozenset(int(m) for m in raw if m not in (_SENTINEL, _SENTINEL.encode()))
+
+
+def room_size(room_id: int) -> int:
+    """
+    Member count of a room from the index (SCARD, no member transfer).
+    """
+    r = get_redis()
+    if r is None:
+        return len(room_members(room_id))
+    size = r.scard(raw_key(_members_key(room_id)))
+    return size - 1 if size else len(_rebuild(room_id))
+
+
+def _update(room_id: int, op: str, user_ids):
+    user_ids = [int(u) for u in user_ids]
+    if not user_ids:
+        return
+    r = get_redis()
+    if r is None:
+        members = cache.get(_members_key(room_id))
+        if members is None:
+            _bump_gen(room_id)
+            return
+        members = members | set(user_ids) if op == "SADD" else members - set(user_ids)
+        cache.set(_members_key(room_id), frozenset(members), _ttl())
+        return
+    pipe = r.pipeline(transaction=False)
+    for chunk in _chunks(user_ids):
+        pipe.eval(_UPDATE_IF_BUILT, 2, raw_key(_members_key(room_id)), raw_key(_gen_key(room_id)),
+                  op, GEN_TTL, *chunk)
+    pipe.execute()
+
+
+def add_members(room_id: int, user_ids):
+    _update(room_id, "SADD", user_ids)
+
+
+def remove_members(room_id: int, user_ids):
+    _update(room_id, "SREM", user_ids)
+
+
+def invalidate_room(room_id: int):
+    r = get_redis()
+    if r is None:
+        cache.delete(_members_key(room_id))
+        _bump_gen(room_id)
+    else:
+        r.eval(_INVALIDATE, 2, raw_key(_members_key(room_id)), raw_key(_gen_key(room_id)), GEN_TTL)
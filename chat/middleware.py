@@ -1,6 +1,6 @@
-# naive per-connection limiter using in-memory counters (swap to Redis later)
+# coarse per-connection flood guard (O(1) token bucket); per-user, per-action
+# budgets across sockets and nodes are enforced in Redis by chat.ratelimit
 import time
-from collections import deque
 from channels.middleware import BaseMiddleware
 
 
@@ -12,18 +12,17 @@ class SimpleWsRateLimiter(BaseMiddleware):
         self.per_seconds = per_seconds
 
     async def __call__(self, scope, receive, send):
-        scope["__rates__"] = deque()
+        rate = self.max_events / self.per_seconds
+        bucket = [float(self.max_events), time.monotonic()]  # tokens, last refill
         async def limited_receive():
             now = time.monotonic()
-            dq = scope["__rates__"]
-            while dq and now - dq[0] > self.per_seconds:
-                dq.popleft()
-            if len(dq) >= self.max_events:
+            bucket[0] = min(self.max_events, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
                 await send({"type": "websocket.close", "code": 4408})  # policy violation
                 return {"type": "websocket.disconnect"}
             msg = await receive()
             if msg.get("type", "").startswith("websocket"):
-                dq.append(time.monotonic())
+                bucket[0] -= 1
             return msg
         return await super().__call__(scope, limited_receive, send)
-        
@@ -23,6 +23,10 @@ class Message(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # keyset pagination of a room's history (chat.pagination)
+        indexes = [models.Index(fields=["chat_room", "timestamp", "id"], name="chat_msg_room_ts_id")]
+
     def __str__(self):
         return f"Message {self.id} in {self.chat_room.name}"
 
@@ -43,6 +47,7 @@ class ChatParticipant(models.Model):
 
 
 
+# Periodic snapshot of live presence (manage.py snapshot_presence); live state is in chat.presence
 class Presence(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     channel_name = models.CharField(max_length=255, db_index=True)
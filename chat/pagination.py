@@ -0,0 +1,132 @@
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+
+def encode_cursor(timestamp: datetime, pk: int) -> str:
+    raw = f"{timestamp.isoformat()}|{pk}".encode("utf8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    (timestamp, id) from a cursor; raises NotFound if it is malformed.
+    Cursors we issue always carry an offset, so a naive timestamp is one too.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf8")
+        timestamp, pk = raw.rsplit("|", 1)
+        timestamp = datetime.fromisoformat(timestamp)
+        if timestamp.tzinfo is None:
+            raise ValueError("naive cursor timestamp")
+        return timestamp, int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise NotFound("Invalid cursor.")
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over (timestamp, id), for room message history.
+
+    No cursor: the newest page. ?before=<cursor>: the page of older
+    messages, ?after=<cursor>: the page of newer ones. Results are always
+    oldest-first. Every page is one indexed range scan (chat_room,
+    timestamp, id) fetching page_size + 1 rows, with no COUNT and no
+    OFFSET, so any scroll depth costs the same.
+
+    Links are path-absolute, so a cached body is valid whatever host served it.
+    """
+    before_query_param = "before"
+    after_query_param = "after"
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+    def get_page_size(self, request):
+        default = getattr(settings, "REST_FRAMEWORK", {}).get("PAGE_SIZE") or 50
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            size = default
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        before, after = self.get_cursors(request)
+
+        if after:
+            timestamp, pk = after
+            rows = list(
+                queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk))
+                .order_by("timestamp", "id")[:size + 1]
+            )
+            self.has_older, self.has_newer = True, len(rows) > size
+            self.page = rows[:size]
+        else:
+            if before:
+                timestamp, pk = before
+                queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+            rows = list(queryset.order_by("-timestamp", "-id")[:size + 1])
+            self.has_older, self.has_newer = len(rows) > size, bool(before)
+            self.page = rows[:size][::-1]
+        self.first = (self.page[0].timestamp, self.page[0].id) if self.page else None
+        self.last = (self.page[-1].timestamp, self.page[-1].id) if self.page else None
+        return self.page
+
+    def get_cursors(self, request):
+        """
+        The request's (before, after) cursors as (timestamp, id), or None.
+        """
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+        return before and decode_cursor(before), after and decode_cursor(after)
+
+    def use_page(self, page, request):
+        """
+        Adopt a page assembled elsewhere (chat.history.HistoryPage) for the links.
+        """
+        self.request = request
+        self.first, self.last = page.first, page.last
+        self.has_older, self.has_newer = page.has_older, page.has_newer
+
+    def _link(self, param, position):
+        url = self.request.get_full_path()
+        for name in (self.before_query_param, self.after_query_param):
+            url = remove_query_param(url, name)
+        return replace_query_param(url, param, encode_cursor(*position))
+
+    def get_previous_link(self):
+        if not (self.first and self.has_older):
+            return None
+        return self._link(self.before_query_param, self.first)
+
+    def get_next_link(self):
+        if not (self.last and self.has_newer):
+            return None
+        return self._link(self.after_query_param, self.last)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
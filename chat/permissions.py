@@ -1,5 +1,7 @@
 from rest_framework.permissions import BasePermission
 
+from .membership import is_member
+
 
 
 class IsRoomParticipant(BasePermission):
@@ -8,9 +10,9 @@ class IsRoomParticipant(BasePermission):
     def has_object_permission(self, request, view, obj):
         # obj can be ChatRoom, Message, ChatParticipant
         if hasattr(obj, "participants"):          
-            room = obj
-        elif hasattr(obj, "chat_room"):           
-            room = obj.chat_room
+            room_id = obj.pk
+        elif hasattr(obj, "chat_room_id"):        # no extra query for the FK target
+            room_id = obj.chat_room_id
         else:
             return False
-        return room.participants.filter(id=request.user.id).exists()
+        return is_member(room_id, request.user.id)
@@ -0,0 +1,258 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_redis, raw_key
+from .events import room_event
+
+
+
+logger = logging.getLogger(__name__)
+
+# Per scope (a room, or "all" for connected-at-all):
+#   online:  ZSET user_id -> expires_at (latest expiry over the user's sockets)
+#   conns:   ZSET channel_name -> expires_at, one per user
+#   version: INCR'd whenever the online set changes (join/leave/expiry)
+# Crashed workers leave nothing behind: entries simply age out of the scores.
+# Reads skip expired entries without writing; only prune() (run by consumers'
+# heartbeat timers, which announce the users it drops) removes them.
+ONLINE_KEY = "chat:presence:{scope}:online"
+CONNS_KEY = "chat:presence:{scope}:user:{user_id}"
+VERSION_KEY = "chat:presence:{scope}:v"
+ONLINE_CACHE_KEY = "chat:presence:{scope}:online:v{v}"  # cached snapshot per presence_tag
+
+DEFAULT_PRESENCE_TTL = 60  # seconds without a heartbeat before a socket counts as gone
+
+# KEYS: online, conns, version   ARGV: user_id, channel, now, expires_at, key_ttl
+# Returns the new version when the user just came online in this scope, else 0
+_UP = """
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+local had = redis.call('ZCARD', KEYS[2])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+local cur = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if (not cur) or tonumber(cur) < tonumber(ARGV[4]) then
+    redis.call('ZADD', KEYS[1], ARGV[4], ARGV[1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+if had == 0 then return redis.call('INCR', KEYS[3]) end
+return 0
+"""
+
+# KEYS: online, conns, version   ARGV: user_id, channel, now
+# Returns the new version when the user's last socket in this scope went away, else 0
+_DOWN = """
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+local latest = redis.call('ZRANGE', KEYS[2], -1, -1, 'WITHSCORES')
+if #latest == 0 then
+    if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then return redis.call('INCR', KEYS[3]) end
+    return 0
+end
+redis.call('ZADD', KEYS[1], latest[2], ARGV[1])
+return 0
+"""
+
+# KEYS: online, version   ARGV: now
+# Drop expired users (bumping the version if any went); returns {version, expired user ids...}
+_PRUNE = """
+local gone = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #gone > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    local out = {redis.call('INCR', KEYS[2])}
+    for i, uid in ipairs(gone) do out[i + 1] = uid end
+    return out
+end
+return {tonumber(redis.call('GET', KEYS[2]) or '0')}
+"""
+
+
+def presence_ttl() -> int:
+    return int(getattr(settings, "CHAT_PRESENCE_TTL", DEFAULT_PRESENCE_TTL))
+
+
+def _scope(room_id) -> str:
+    return "all" if room_id is None else f"room:{room_id}"
+
+
+def _keys(room_id, user_id):
+    scope = _scope(room_id)
+    return (
+        ONLINE_KEY.format(scope=scope),
+        CONNS_KEY.format(scope=scope, user_id=user_id),
+        VERSION_KEY.format(scope=scope),
+    )
+
+
+def _bump_fallback(version_key) -> int:
+    cache.add(version_key, 0, None)
+    return cache.incr(version_key)
+
+
+def _prune_fallback(online_key, version_key, now) -> list:
+    """
+    Cache-API twin of _PRUNE: [version, expired user ids...].
+    """
+    online = cache.get(online_key) or {}
+    live = {uid: exp for uid, exp in online.items() if exp > now}
+    if len(live) == len(online):
+        return [int(cache.get(version_key) or 0)]
+    cache.set(online_key, live, presence_ttl() * 2)
+    return [_bump_fallback(version_key), *(uid for uid in online if uid not in live)]
+
+
+def presence_changed(room_id, user_id, online, version) -> dict:
+    """
+    Room event for a user's first socket arriving or last one going.
+    """
+    frame = {"type": "presence_changed", "room_id": room_id, "user_id": user_id, "online": online, "version": version}
+    return room_event("broadcast.presence", frame)
+
+
+def prune(room_ids) -> dict:
+    """
+    Drop expired users from each scope. Returns {room_id: (presence
+    version, [expired user ids])}; the caller announces them, since
+    sockets that stopped heartbeating never send their own "left".
+    """
+    now = time.time()
+    room_ids = list(room_ids)
+    r = get_redis()
+    pipe = r.pipeline(transaction=False) if r is not None else None
+    results = []
+    for rid in room_ids:
+        online_key, _, version_key = _keys(rid, None)
+        if pipe is None:
+            results.append(_prune_fallback(online_key, version_key, now))
+        else:
+            pipe.eval(_PRUNE, 2, raw_key(online_key), raw_key(version_key), now)
+    if pipe is not None:
+        results = pipe.execute()
+    pruned = {rid: (int(result[0]), [int(uid) for uid in result[1:]]) for rid, result in zip(room_ids, results)}
+    for rid, (_, gone) in pruned.items():
+        if gone:
+            logger.debug("Presence in %s: %s expired", _scope(rid), gone)
+    return pruned
+
+
+def _up_fallback(online_key, conns_key, version_key, user_id, channel_name, now, expires_at, ttl) -> int:
+    conns = {c: exp for c, exp in (cache.get(conns_key) or {}).items() if exp > now}
+    had = bool(conns)
+    conns[channel_name] = expires_at
+    cache.set(conns_key, conns, ttl)
+    online = cache.get(online_key) or {}
+    online[user_id] = max(online.get(user_id, 0), expires_at)
+    cache.set(online_key, online, ttl)
+    return 0 if had else _bump_fallback(version_key)
+
+
+def _down_fallback(online_key, conns_key, version_key, user_id, channel_name, now) -> int:
+    conns = {c: exp for c, exp in (cache.get(conns_key) or {}).items() if exp > now and c != channel_name}
+    cache.set(conns_key, conns, presence_ttl() * 2)
+    online = cache.get(online_key) or {}
+    if conns:
+        online[user_id] = max(conns.values())
+        cache.set(online_key, online, presence_ttl() * 2)
+        return 0
+    was_online = online.pop(user_id, None) is not None
+    cache.set(online_key, online, presence_ttl() * 2)
+    return _bump_fallback(version_key) if was_online else 0
+
+
+def touch(user_id: int, channel_name: str, room_ids) -> dict:
+    """
+    Mark a socket present (or refresh its heartbeat) in each scope.
+    `None` in room_ids is the connection-wide scope.
+    Returns {room_id: new presence version} for scopes the user just came online in.
+    """
+    ttl = presence_ttl()
+    now = time.time()
+    room_ids = list(room_ids)
+    r = get_redis()
+    if r is None:
+        versions = [
+            _up_fallback(*_keys(rid, user_id), user_id, channel_name, now, now + ttl, ttl * 2)
+            for rid in room_ids
+        ]
+    else:
+        script = r.register_script(_UP)
+        pipe = r.pipeline(transaction=False)
+        for rid in room_ids:
+            script(keys=[raw_key(k) for k in _keys(rid, user_id)],
+                   args=[user_id, channel_name, now, now + ttl, ttl * 2], client=pipe)
+        versions = pipe.execute()
+    return {rid: v for rid, v in zip(room_ids, versions) if v}
+
+
+def drop(user_id: int, channel_name: str, room_ids) -> dict:
+    """
+    Remove a socket from each scope.
+    Returns {room_id: new presence version} for scopes the user left entirely.
+    """
+    now = time.time()
+    room_ids = list(room_ids)
+    r = get_redis()
+    if r is None:
+        versions = [_down_fallback(*_keys(rid, user_id), user_id, channel_name, now) for rid in room_ids]
+    else:
+        script = r.register_script(_DOWN)
+        pipe = r.pipeline(transaction=False)
+        for rid in room_ids:
+            script(keys=[raw_key(k) for k in _keys(rid, user_id)], args=[user_id, channel_name, now], client=pipe)
+        versions = pipe.execute()
+    return {rid: v for rid, v in zip(room_ids, versions) if v}
+
+
+def presence_state(room_id=None) -> tuple:
+    """
+    (version, expired) for a room's online set, in one round trip and
+    without writing. `expired` counts users past their heartbeat that no
+    prune has dropped yet: it only grows until the next prune bumps the
+    version, so the pair changes whenever the visible online set does.
+    """
+    now = time.time()
+    scope = _scope(room_id)
+    online_key, version_key = ONLINE_KEY.format(scope=scope), VERSION_KEY.format(scope=scope)
+    r = get_redis()
+    if r is None:
+        online = cache.get(online_key) or {}
+        return int(cache.get(version_key) or 0), sum(1 for exp in online.values() if exp <= now)
+
+    pipe = r.pipeline(transaction=False)
+    pipe.get(raw_key(version_key))
+    pipe.zcount(raw_key(online_key), "-inf", now)
+    version, expired = pipe.execute()
+    return int(version or 0), expired
+
+
+def presence_tag(state) -> str:
+    return "{}.{}".format(*state)
+
+
+def online_user_ids(room_id=None) -> list:
+    """
+    Users with at least one live socket in the room, in O(users online).
+    """
+    now = time.time()
+    online_key = ONLINE_KEY.format(scope=_scope(room_id))
+    r = get_redis()
+    if r is None:
+        return sorted(uid for uid, exp in (cache.get(online_key) or {}).items() if exp > now)
+    return sorted(int(uid) for uid in r.zrangebyscore(raw_key(online_key), f"({now}", "+inf"))
+
+
+def online_snapshot(room_id, state=None):
+    """
+    (version, user ids) for a room; the list is cached per presence state,
+    so unchanged rooms cost only the state lookup.
+    """
+    if state is None:
+        state = presence_state(room_id)
+    key = ONLINE_CACHE_KEY.format(scope=_scope(room_id), v=presence_tag(state))
+    user_ids = cache.get(key)
+    if user_ids is None:
+        user_ids = online_user_ids(room_id)
+        cache.set(key, user_ids, presence_ttl())
+    return state[0], user_ids
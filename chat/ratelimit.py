@@ -0,0 +1,118 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_async_redis, get_redis, raw_key
+
+
+
+logger = logging.getLogger(__name__)
+
+
+# GCRA (generic cell rate algorithm): one key per bucket holding the
+# "theoretical arrival time". Allows `limit` events per `period` with bursts
+# up to `limit`, in a single atomic call and O(1) state.
+#
+# KEYS: bucket   ARGV: emission interval (period / limit), period
+# Returns {allowed, retry_after_seconds}; numbers go back as strings so Lua
+# doesn't truncate them to integers.
+_GCRA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - period
+if allow_at > now then
+    return {0, tostring(allow_at - now)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+return {1, '0'}
+"""
+
+RATE_KEY = "chat:rl:{bucket}"
+
+
+def _gcra_fallback(bucket: str, interval: float, period: float):
+    # cache-API fallback (single process/dev): same math, not atomic
+    key = RATE_KEY.format(bucket=bucket)
+    now = time.time()
+    tat = max(cache.get(key) or 0.0, now)
+    allow_at = tat + interval - period
+    if allow_at > now:
+        return False, allow_at - now
+    cache.set(key, tat + interval, max(1, int(tat + interval - now) + 1))
+    return True, 0.0
+
+
+def gcra_hit(bucket: str, limit: int, period: float):
+    """
+    Count one event against `bucket`. Returns (allowed, retry_after_seconds).
+    """
+    interval = period / limit
+    r = get_redis()
+    if r is None:
+        return _gcra_fallback(bucket, interval, period)
+    allowed, retry_after = r.eval(_GCRA, 1, raw_key(RATE_KEY.format(bucket=bucket)), interval, period)
+    return bool(allowed), float(retry_after)
+
+
+async def agcra_hit(bucket: str, limit: int, period: float):
+    """
+    gcra_hit on the event loop (redis.asyncio): no thread hop per event.
+    """
+    interval = period / limit
+    r = get_async_redis()
+    if r is None:
+        return _gcra_fallback(bucket, interval, period)  # in-process cache, doesn't block
+    allowed, retry_after = await r.eval(_GCRA, 1, raw_key(RATE_KEY.format(bucket=bucket)), interval, period)
+    return bool(allowed), float(retry_after)
+
+
+# Per-action WebSocket budgets: action -> (max events, per seconds), per user across all sockets/nodes
+DEFAULT_WS_RATE_LIMITS = {
+    "send_message": (30, 10),
+    "typing": (60, 10),
+    "join": (20, 10),
+    "default": (60, 10),
+}
+
+
+class WsRateLimiter:
+    """
+    Cluster-wide limiter for WebSocket actions, keyed per user and action.
+    Unknown actions share the "default" budget (so clients can't mint keys).
+    Fails open: if Redis is unreachable the event is allowed (and logged)
+    rather than the socket closed.
+    """
+
+    def limits(self) -> dict:
+        return {**DEFAULT_WS_RATE_LIMITS, **getattr(settings, "CHAT_WS_RATE_LIMITS", {})}
+
+    def _bucket(self, user_id: int, action):
+        limits = self.limits()
+        name = action if action in limits else "default"
+        return (f"ws:{name}:{user_id}", *limits[name])
+
+    def allow(self, user_id: int, action) -> bool:
+        try:
+            allowed, _ = gcra_hit(*self._bucket(user_id, action))
+        except Exception:
+            logger.warning("Rate limiter unavailable; allowing %r for user %s", action, user_id, exc_info=True)
+            return True
+        return allowed
+
+    async def aallow(self, user_id: int, action) -> bool:
+        try:
+            allowed, _ = await agcra_hit(*self._bucket(user_id, action))
+        except Exception:
+            logger.warning("Rate limiter unavailable; allowing %r for user %s", action, user_id, exc_info=True)
+            return True
+        return allowed
+
+
+ws_limiter = WsRateLimiter()
@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+
+# Final response bodies of MessageViewSet.list pages, as rendered bytes plus
+# pre-compressed variants, per room version and request path. A hit is one
+# cache get and a write to the socket: no serializer, renderer or compressor.
+RENDERED_PAGE_KEY = "chat:room:{room_id}:page:v{v}:{digest}"
+
+RENDERED_TTL = 300
+DEFAULT_MIN_COMPRESS_BYTES = 512  # smaller bodies go out as-is
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def page_key(room_id: int, version: int, request) -> str:
+    # the full path: pagination links echo every query param
+    digest = hashlib.md5(f"{request.accepted_media_type}|{request.get_full_path()}".encode("utf8")).hexdigest()
+    return RENDERED_PAGE_KEY.format(room_id=room_id, v=version, digest=digest)
+
+
+def encodings() -> tuple:
+    """
+    Compressed variants to keep, best first (br only if brotli is installed).
+    """
+    wanted = getattr(settings, "CHAT_RENDERED_ENCODINGS", ("br", "gzip"))
+    return tuple(e for e in wanted if e == "gzip" or (e == "br" and brotli is not None))
+
+
+def render(request, data) -> dict:
+    """
+    {"identity": bytes, "gzip": bytes, ...} for `data`, via the request's renderer.
+    """
+    body = request.accepted_renderer.render(data, request.accepted_media_type, {"request": request})
+    variants = {"identity": body, "content_type": request.accepted_media_type}
+    if len(body) >= getattr(settings, "CHAT_RENDERED_MIN_COMPRESS_BYTES", DEFAULT_MIN_COMPRESS_BYTES):
+        for encoding in encodings():
+            if encoding == "gzip":
+                variants["gzip"] = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            elif encoding == "br":
+                variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return variants
+
+
+def store(key: str, variants: dict):
+    cache.set(key, variants, RENDERED_TTL)
+
+
+def fetch(key: str):
+    return cache.get(key)
+
+
+def accepted_encodings(header: str) -> set:
+    """
+    Codings an Accept-Encoding header allows (q > 0).
+    """
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def response(request, variants: dict, status=200) -> HttpResponse:
+    """
+    The best variant the client accepts, with Content-Encoding and Vary set.
+    """
+    accepted = accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    encoding = next((e for e in ("br", "gzip") if e in variants and (e in accepted or "*" in accepted)), None)
+    resp = HttpResponse(variants[encoding or "identity"], status=status, content_type=variants["content_type"])
+    if encoding:
+        resp["Content-Encoding"] = encoding
+    resp["Vary"] = "Accept-Encoding"
+    return resp
@@ -39,6 +39,20 @@ class MessageSerializer(serializers.ModelSerializer):
 
 
 
+def message_payload(msg: Message) -> dict:
+    """
+    Compact WebSocket representation of a Message (ids instead of usernames).
+    """
+    return {
+        "id": msg.id,
+        "room_id": msg.chat_room_id,
+        "sender_id": msg.sender_id,
+        "content": msg.content,
+        "created_at": msg.timestamp.isoformat() if msg.timestamp else None,
+    }
+
+
+
 # Serializer for ChatParticipant model
 class ChatParticipantSerializer(serializers.ModelSerializer):
     user = serializers.SlugRelatedField(slug_field='username', queryset=User.objects.all())
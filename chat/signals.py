@@ -0,0 +1,119 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+
+from core.models import User
+from .models import ChatRoom, ChatParticipant, Message
+from .cache import bump_room_meta_version, bump_room_version
+from . import history, membership
+
+
+
+# Keep the membership index in step with ChatParticipant rows.
+# room.participants.add() bulk-creates through rows (no post_save), hence m2m_changed too.
+
+@receiver(post_save, sender=ChatParticipant)
+def participant_saved(sender, instance, created, **kwargs):
+    if created:
+        membership.add_members(instance.chat_room_id, [instance.user_id])
+    bump_room_meta_version(instance.chat_room_id)
+
+
+@receiver(post_delete, sender=ChatParticipant)
+def participant_deleted(sender, instance, **kwargs):
+    membership.remove_members(instance.chat_room_id, [instance.user_id])
+    bump_room_meta_version(instance.chat_room_id)
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "post_clear":
+        if not reverse:
+            membership.invalidate_room(instance.pk)
+            bump_room_meta_version(instance.pk)
+        return
+    if action not in ("post_add", "post_remove") or not pk_set:
+        return
+
+    update = membership.add_members if action == "post_add" else membership.remove_members
+    if reverse:
+        # user.chatroom_set.add(...): instance is the user, pk_set holds room ids
+        for room_id in pk_set:
+            update(room_id, [instance.pk])
+            bump_room_meta_version(room_id)
+    else:
+        update(instance.pk, pk_set)
+        bump_room_meta_version(instance.pk)
+
+
+# Message history (chat.history) follows every write path here, REST,
+# sockets, admin or shell alike: sealed blocks are patched in place and the
+# room version moves on once the row is committed.
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    def sync():
+        if not created:
+            history.patch(instance)  # in place, if it sits in a sealed block
+        bump_room_version(instance.chat_room_id)
+
+    transaction.on_commit(sync)
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    room_id, position = instance.chat_room_id, (instance.timestamp, instance.id)
+
+    def sync():
+        history.discard(room_id, position)
+        bump_room_version(room_id)
+
+    transaction.on_commit(sync)
+
+
+# Room detail ETags (chat.etags) hang off the meta version: bump it whenever
+# the room row or anything its serializer shows changes.
+
+@receiver(post_save, sender=ChatRoom)
+def room_saved(sender, instance, created, **kwargs):
+    if not created:
+        bump_room_meta_version(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def user_renaming(sender, instance, update_fields=None, **kwargs):
+    instance._renamed = False
+    if instance.pk is None or (update_fields is not None and "username" not in update_fields):
+        return
+    old = User.objects.filter(pk=instance.pk).values_list("username", flat=True).first()
+    instance._renamed = old is not None and old != instance.username
+
+
+@receiver(post_save, sender=User)
+def user_renamed(sender, instance, created, **kwargs):
+    # rooms list participants by username, and history shows senders by username
+    if created or not getattr(instance, "_renamed", False):
+        return
+    for room_id in ChatParticipant.objects.filter(user=instance).values_list("chat_room_id", flat=True):
+        bump_room_meta_version(room_id)
+    _invalidate_history(_sent_to(instance))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # their messages go in the cascade, which history.discard never sees
+    _invalidate_history(_sent_to(instance))
+
+
+def _sent_to(user) -> list:
+    return list(Message.objects.filter(sender=user).values_list("chat_room_id", flat=True).distinct())
+
+
+def _invalidate_history(room_ids):
+    # after commit, so a rebuild can't pick the old rows back up into the new epoch
+    def invalidate():
+        for room_id in room_ids:
+            history.invalidate(room_id)
+
+    if room_ids:
+        transaction.on_commit(invalidate)
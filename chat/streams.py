@@ -0,0 +1,167 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_redis, raw_key
+from .models import Message
+from .serializers import message_payload
+
+
+
+logger = logging.getLogger(__name__)
+
+# Capped per-room ring buffer of recent message events (Redis Stream, or a
+# list via the cache API): creates, edits and deletes, as wire payloads.
+#
+# Entry ids derive from message ids so a resume can seek: a create of
+# message N goes in at N-0, or right after the tail if N commits late; edits
+# and deletes go in right after the tail. Everything that happened after a
+# client saw message N therefore sits at or after N-1.
+ROOM_STREAM_KEY = "chat:room:{room_id}:events"
+
+DEFAULT_STREAM_MAXLEN = 500
+DEFAULT_STREAM_TTL = 24 * 3600  # idle rooms drop their buffer
+DEFAULT_RESUME_MAX_MESSAGES = 500
+
+CREATED, EDITED, DELETED = "c", "e", "d"
+
+_APPEND = """
+local ms, seq = tonumber(ARGV[1]), 0
+local tail = redis.call('XREVRANGE', KEYS[1], '+', '-', 'COUNT', 1)[1]
+if tail then
+    local tms, tseq = string.match(tail[1], '(%d+)-(%d+)')
+    tms, tseq = tonumber(tms), tonumber(tseq)
+    if ARGV[2] ~= 'c' or tms >= ms then
+        ms, seq = tms, tseq + 1
+    end
+end
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[4], string.format('%d-%d', ms, seq), 'op', ARGV[2], 'm', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+
+def _stream_key(room_id: int) -> str:
+    return ROOM_STREAM_KEY.format(room_id=room_id)
+
+
+def _maxlen() -> int:
+    return int(getattr(settings, "CHAT_ROOM_STREAM_MAXLEN", DEFAULT_STREAM_MAXLEN))
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "CHAT_ROOM_STREAM_TTL", DEFAULT_STREAM_TTL))
+
+
+def _append(op: str, payload: dict):
+    """
+    Best effort: the DB stays the source of truth, so failures are only logged.
+    """
+    room_id = payload["room_id"]
+    try:
+        r = get_redis()
+        if r is None:
+            entries = cache.get(_stream_key(room_id)) or []
+            pos = (payload["id"], 0)
+            if entries and (op != CREATED or entries[-1]["pos"][0] >= payload["id"]):
+                pos = (entries[-1]["pos"][0], entries[-1]["pos"][1] + 1)
+            entries.append({"pos": pos, "op": op, "m": payload})
+            cache.set(_stream_key(room_id), entries[-_maxlen():], _ttl())
+            return
+        r.eval(_APPEND, 1, raw_key(_stream_key(room_id)), payload["id"], op, json.dumps(payload), _maxlen(), _ttl())
+    except Exception:
+        logger.exception("Could not append message %s to room %s stream", payload.get("id"), room_id)
+
+
+def append_message(payload: dict):
+    """
+    Append a created message (wire payload, see message_payload) to its room's buffer.
+    """
+    _append(CREATED, payload)
+
+
+def append_edit(payload: dict):
+    _append(EDITED, payload)
+
+
+def append_delete(room_id: int, message_id: int):
+    _append(DELETED, {"id": message_id, "room_id": room_id})
+
+
+def _buffered(room_id: int, last_seen_id: int):
+    """
+    (reaches_back, entries): whether the buffer still holds everything after
+    `last_seen_id`, and the (op, payload) entries from that point on.
+    """
+    r = get_redis()
+    if r is None:
+        entries = cache.get(_stream_key(room_id)) or []
+        start = (last_seen_id, 1)
+        reaches_back = bool(entries) and tuple(entries[0]["pos"]) < start
+        return reaches_back, [(e["op"], e["m"]) for e in entries if tuple(e["pos"]) >= start]
+
+    key = raw_key(_stream_key(room_id))
+    pipe = r.pipeline(transaction=False)
+    pipe.xrange(key, count=1)
+    pipe.xrange(key, min=f"{last_seen_id}-1")
+    head, tail = pipe.execute()
+    if not head or tuple(int(n) for n in head[0][0].split(b"-")) >= (last_seen_id, 1):
+        return False, []
+    return True, [(fields[b"op"].decode(), json.loads(fields[b"m"])) for _, fields in tail]
+
+
+def latest_id(room_id: int) -> int:
+    """
+    Id of the newest message in a room (0 if none): the stream tail's entry
+    id when the room has a buffer, else one indexed DB lookup.
+    """
+    try:
+        r = get_redis()
+        if r is None:
+            entries = cache.get(_stream_key(room_id))
+            if entries:
+                return entries[-1]["pos"][0]
+        else:
+            tail = r.xrevrange(raw_key(_stream_key(room_id)), count=1)
+            if tail:
+                return int(tail[0][0].split(b"-")[0])
+    except Exception:
+        logger.exception("Could not read room %s stream; falling back to DB", room_id)
+    return Message.objects.filter(chat_room_id=room_id).order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def replay(room_id: int, last_seen_id: int):
+    """
+    Messages in a room newer than `last_seen_id`, oldest first.
+
+    Served from the stream when the buffer still reaches back to
+    `last_seen_id` (only the entries after it are read), with edits and
+    deletes applied; otherwise (gap older than the buffer, or buffer gone)
+    from the DB. Returns (messages, source, has_more).
+    """
+    limit = int(getattr(settings, "CHAT_RESUME_MAX_MESSAGES", DEFAULT_RESUME_MAX_MESSAGES))
+
+    try:
+        reaches_back, entries = _buffered(room_id, last_seen_id)
+    except Exception:
+        logger.exception("Could not read room %s stream; falling back to DB", room_id)
+        reaches_back = False
+
+    if reaches_back:
+        missed = {}
+        for op, m in entries:
+            if op == DELETED:
+                missed.pop(m["id"], None)
+            elif m["id"] > last_seen_id and (op == CREATED or m["id"] in missed):
+                missed[m["id"]] = m
+        missed = sorted(missed.values(), key=lambda m: m["id"])
+        return missed[:limit], "stream", len(missed) > limit
+
+    rows = list(
+        Message.objects
+        .filter(chat_room_id=room_id, id__gt=last_seen_id)
+        .order_by("id")[:limit + 1]
+    )
+    return [message_payload(m) for m in rows[:limit]], "db", len(rows) > limit
@@ -0,0 +1,50 @@
+from rest_framework.throttling import (
+    AnonRateThrottle,
+    ScopedRateThrottle,
+    SimpleRateThrottle,
+    UserRateThrottle,
+)
+
+from .ratelimit import gcra_hit
+
+
+
+class GcraRateThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle with the pickled timestamp history replaced by an
+    atomic GCRA check in Redis (chat.ratelimit): one round trip, O(1) state
+    per key, and an exact Retry-After.
+
+    Mixed in *after* the stock classes, so their scope/key logic is kept:
+    e.g. ScopedRateThrottle.allow_request resolves the view's scope, then
+    its super() call lands here.
+    """
+    retry_after = None
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        allowed, retry_after = gcra_hit(self.key, self.num_requests, self.duration)
+        self.retry_after = None if allowed else retry_after
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+
+class RedisAnonRateThrottle(AnonRateThrottle, GcraRateThrottle):
+    pass
+
+
+class RedisUserRateThrottle(UserRateThrottle, GcraRateThrottle):
+    pass
+
+
+class RedisScopedRateThrottle(ScopedRateThrottle, GcraRateThrottle):
+    pass
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core import signing
+
+
+
+# Signed, short-lived session resumption tickets. A ticket carries what a
+# socket needs to come back without the usual handshake work: the user,
+# the rooms it was in and the last message id it saw in each.
+TICKET_SALT = "chat.resume-ticket"
+
+DEFAULT_TICKET_TTL = 120  # seconds; clients get a fresh one with every heartbeat
+
+
+def ticket_ttl() -> int:
+    return int(getattr(settings, "CHAT_RESUME_TICKET_TTL", DEFAULT_TICKET_TTL))
+
+
+def issue(user, last_ids: dict, token_exp=None) -> str:
+    """
+    Ticket for `user` subscribed to `last_ids` ({room_id: last delivered message id}).
+    A ticket never outlives the access token the socket was opened with.
+    """
+    return signing.dumps(
+        {"u": user.id, "n": user.username, "r": [[rid, mid] for rid, mid in last_ids.items()], "e": token_exp},
+        salt=TICKET_SALT,
+        compress=True,
+    )
+
+
+def load(ticket: str):
+    """
+    Ticket contents as {"user_id", "username", "last_ids", "token_exp"}, or
+    None if it is forged, older than CHAT_RESUME_TICKET_TTL or past the token's expiry.
+    """
+    try:
+        data = signing.loads(ticket, salt=TICKET_SALT, max_age=ticket_ttl())
+    except signing.BadSignature:  # includes SignatureExpired
+        return None
+    if data["e"] is not None and data["e"] <= time.time():
+        return None
+    return {
+        "user_id": data["u"],
+        "username": data["n"],
+        "last_ids": {rid: mid for rid, mid in data["r"]},
+        "token_exp": data["e"],
+    }
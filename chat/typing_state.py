@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import get_redis, raw_key
+from .events import room_event
+from .fanout import room_broadcast
+
+
+
+logger = logging.getLogger(__name__)
+
+# Who is typing in a room: Redis ZSET user_id -> expires_at (or a dict via the cache API)
+ROOM_TYPING_KEY = "chat:room:{room_id}:typing"
+# Last aggregated state broadcast for a room (shared so nodes don't repeat each other)
+ROOM_TYPING_LAST_KEY = "chat:room:{room_id}:typing:last"
+
+DEFAULT_TICK_MS = 500
+DEFAULT_TTL_SECONDS = 6
+
+
+def typing_tick() -> float:
+    """
+    Broadcast interval in seconds; 0 disables coalescing (one broadcast per frame).
+    """
+    return float(getattr(settings, "CHAT_TYPING_TICK_MS", DEFAULT_TICK_MS)) / 1000.0
+
+
+def typing_ttl() -> float:
+    return float(getattr(settings, "CHAT_TYPING_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+
+
+def _typing_key(room_id: int) -> str:
+    return ROOM_TYPING_KEY.format(room_id=room_id)
+
+
+def _last_key(room_id: int) -> str:
+    return ROOM_TYPING_LAST_KEY.format(room_id=room_id)
+
+
+def set_typing(room_id: int, user_id: int, is_typing: bool):
+    ttl = typing_ttl()
+    r = get_redis()
+    if r is None:
+        state = cache.get(_typing_key(room_id)) or {}
+        if is_typing:
+            state[user_id] = time.time() + ttl
+        else:
+            state.pop(user_id, None)
+        cache.set(_typing_key(room_id), state, ttl * 2)
+        return
+
+    key = raw_key(_typing_key(room_id))
+    pipe = r.pipeline(transaction=False)
+    if is_typing:
+        pipe.zadd(key, {user_id: time.time() + ttl})
+    else:
+        pipe.zrem(key, user_id)
+    pipe.expire(key, int(ttl * 2))
+    pipe.execute()
+
+
+def current_typers(room_ids) -> dict:
+    """
+    Expire stale typers and return {room_id: sorted user ids} in one round trip.
+    """
+    now = time.time()
+    r = get_redis()
+    if r is None:
+        out = {}
+        for room_id in room_ids:
+            state = cache.get(_typing_key(room_id)) or {}
+            out[room_id] = sorted(uid for uid, exp in state.items() if exp > now)
+        return out
+
+    pipe = r.pipeline(transaction=False)
+    for room_id in room_ids:
+        key = raw_key(_typing_key(room_id))
+        pipe.zremrangebyscore(key, "-inf", now)
+        pipe.zrange(key, 0, -1)
+    results = pipe.execute()
+    return {
+        room_id: sorted(int(uid) for uid in results[i * 2 + 1])
+        for i, room_id in enumerate(room_ids)
+    }
+
+
+def changed_states(room_ids):
+    """
+    Current typers per room, plus the subset whose state differs from the
+    last broadcast (recorded as the new last state).
+    """
+    states = current_typers(room_ids)
+    last = cache.get_many([_last_key(room_id) for room_id in room_ids])
+    changed = {
+        room_id: user_ids for room_id, user_ids in states.items()
+        if last.get(_last_key(room_id), []) != user_ids
+    }
+    if changed:
+        cache.set_many({_last_key(room_id): user_ids for room_id, user_ids in changed.items()}, typing_ttl() * 2)
+    return states, changed
+
+
+class TypingCoalescer:
+    """
+    Per-process typing aggregator.
+
+    Typing frames only update the room's shared state; a single loop per
+    worker wakes every CHAT_TYPING_TICK_MS and sends one "who is typing"
+    event per room whose state actually changed. Rooms are tracked until
+    their typers have expired and the empty state has gone out.
+    """
+
+    def __init__(self):
+        self._rooms = set()
+        self._seen = {}
+        self._task = None
+        self._loop = None
+
+    async def note(self, channel_layer, room_id: int, user_id: int, is_typing: bool):
+        # Repeated "still typing" frames don't need to touch the store every time
+        now = time.monotonic()
+        prev = self._seen.get((room_id, user_id))
+        if not (prev and prev[0] == is_typing and now - prev[1] < typing_ttl() / 2):
+            await sync_to_async(set_typing)(room_id, user_id, is_typing)
+            self._seen[(room_id, user_id)] = (is_typing, now)
+
+        self._rooms.add(room_id)
+        self._ensure_running(channel_layer)
+
+    def _ensure_running(self, channel_layer):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._task = loop.create_task(self._run(channel_layer))
+
+    async def _run(self, channel_layer):
+        while self._rooms:
+            await asyncio.sleep(typing_tick())
+            try:
+                await self.tick(channel_layer)
+            except Exception:
+                logger.exception("Typing tick failed")
+
+    async def tick(self, channel_layer):
+        rooms = list(self._rooms)
+        if not rooms:
+            return
+        states, changed = await sync_to_async(changed_states)(rooms)
+
+        for room_id, user_ids in changed.items():
+            await room_broadcast(
+                channel_layer,
+                room_id,
+                room_event("broadcast.typing_state", {"type": "typing_state", "room_id": room_id, "user_ids": user_ids}),
+            )
+
+        # Stop tracking rooms that have gone quiet (and whose empty state went out)
+        for room_id, user_ids in states.items():
+            if not user_ids and room_id not in changed:
+                self._rooms.discard(room_id)
+                for k in [k for k in self._seen if k[0] == room_id]:
+                    del self._seen[k]
+
+
+coalescer = TypingCoalescer()
@@ -4,19 +4,21 @@ from rest_framework import viewsets, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from rest_framework.exceptions import PermissionDenied, ValidationError
-from rest_framework.throttling import ScopedRateThrottle
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 
 from core.models import User
-from .models import ChatRoom, Message, ChatParticipant, Presence
-from .serializers import ChatRoomSerializer, MessageSerializer, ChatParticipantSerializer
+from .models import ChatRoom, Message, ChatParticipant
+from .presence import online_snapshot, presence_state, presence_tag
+from .serializers import ChatRoomSerializer, MessageSerializer, ChatParticipantSerializer, message_payload
+from .streams import append_delete, append_edit, append_message
 from .permissions import IsRoomParticipant
-from .cache import (
-    get_room_messages_cached,
-    set_room_messages_cache,
-    bump_room_version,
-)
+from .throttling import RedisScopedRateThrottle
+from .membership import is_member
+from .pagination import MessageCursorPagination
+from . import etags, history, rendered
+from .cache import get_room_version, get_room_meta_version
 
 
 
@@ -36,6 +38,18 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
             .prefetch_related("participants")
         )
 
+    def retrieve(self, request, *args, **kwargs):
+        # revalidation costs a version read and the membership check, no room query
+        room_id = kwargs.get("pk")
+        if not str(room_id).isdigit():
+            return super().retrieve(request, *args, **kwargs)
+        tag = etags.etag("room", room_id, get_room_meta_version(room_id), request)
+        if etags.matches(request, tag) and is_member(room_id, request.user.id):
+            return etags.not_modified(tag)
+        response = super().retrieve(request, *args, **kwargs)
+        response["ETag"] = tag
+        return response
+
     def perform_create(self, serializer):
         room = serializer.save()
         room.participants.add(self.request.user)
@@ -52,7 +66,7 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         except User.DoesNotExist:
             raise ValidationError({"username": "User not found."})
 
-        if room.participants.filter(id=user.id).exists():
+        if is_member(room.id, user.id):
             return Response({"detail": "User already in room."}, status=status.HTTP_200_OK)
 
         room.participants.add(user)
@@ -70,7 +84,7 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         except User.DoesNotExist:
             raise ValidationError({"username": "User not found."})
 
-        if not room.participants.filter(id=user.id).exists():
+        if not is_member(room.id, user.id):
             return Response({"detail": "User not in room."}, status=status.HTTP_200_OK)
 
         # prevent removing the creator if you consider first participant the owner
@@ -83,25 +97,22 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
 
 
 
-def _qp(request, name, default=""):
-    return request.query_params.get(name, default)
-
-
-
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated, IsRoomParticipant]
-    throttle_classes = [ScopedRateThrottle]  # enable scoped throttling
+    throttle_classes = [RedisScopedRateThrottle]  # enable scoped throttling
+    pagination_class = MessageCursorPagination  # keyset on (timestamp, id): no COUNT, no OFFSET
 
     # ---- helpers ----
     def _room_from_request(self):
         """
         Accept either nested /api/rooms/<room_id>/messages/ or /messages/?room=<id>
+        (memoized: list() and get_queryset() both need it)
         """
-        room_id = self.kwargs.get("room_id") or self.request.query_params.get("room")
-        if not room_id:
-            return None
-        return get_object_or_404(ChatRoom.objects.prefetch_related("participants"), pk=room_id)
+        if not hasattr(self, "_room"):
+            room_id = self.kwargs.get("room_id") or self.request.query_params.get("room")
+            self._room = get_object_or_404(ChatRoom, pk=room_id) if room_id else None
+        return self._room
 
     def get_queryset(self):
         room = self._room_from_request()
@@ -110,80 +121,90 @@ class MessageViewSet(viewsets.ModelViewSet):
             return Message.objects.none()
 
         # Ensure requester is a participant (defense-in-depth; your permission also enforces)
-        if not room.participants.filter(id=self.request.user.id).exists():
+        if not is_member(room.id, self.request.user.id):
             return Message.objects.none()
 
         return (
             Message.objects
             .filter(chat_room=room)
             .select_related("chat_room", "sender")
-            .order_by("timestamp")  # change to "created_at" if that's your field
+            .order_by("timestamp", "id")
         )
 
     # ---- cached list ----
     def list(self, request, *args, **kwargs):
-        room = self._room_from_request()
-        if not room:
+        room_id = self.kwargs.get("room_id") or request.query_params.get("room")
+        if not room_id:
             return Response([], status=200)
+        if not str(room_id).isdigit():
+            raise NotFound()
+
+        # If-None-Match: one version read and the membership check, before
+        # the room lookup and any cached page
+        version = get_room_version(room_id)
+        tag = etags.etag("messages", room_id, version, request)
+        if etags.matches(request, tag) and is_member(room_id, request.user.id):
+            return etags.not_modified(tag, vary="Accept-Encoding")
+
+        room = self._room_from_request()
 
         # deny if not participant
-        if not room.participants.filter(id=request.user.id).exists():
+        if not is_member(room.id, request.user.id):
             raise PermissionDenied("You are not a participant of this room.")
 
-        # Build a cache key that is stable per room-version AND list params
-        cached_base, base_key, _v = get_room_messages_cached(room.id)
-        # include common query params to avoid collisions across pages/sizes
-        page = _qp(request, "page")
-        page_size = _qp(request, "page_size")
-        ordering = _qp(request, "ordering")  # if you expose it; else stays ''
-        key = f"{base_key}:p={page}:ps={page_size}:o={ordering}"
-
-        # Try the param-specific key first
-        from django.core.cache import cache  # use same backend as your helpers
-        data = cache.get(key)
-        if data is not None:
-            return Response(data, status=200)
-
-        # If nothing at param key but the base key holds the *full* list you previously cached,
-        # you could paginate/slice from it here. Simpler: regenerate fresh data now:
+        # JSON clients get the page's cached bytes (pre-compressed); other
+        # renderers (browsable API) go through the normal response path
+        is_json = isinstance(request.accepted_renderer, JSONRenderer)
+        if is_json:
+            variants = rendered.fetch(rendered.page_key(room.id, version, request))
+            if variants is not None:
+                return self._tagged(rendered.response(request, variants), room.id, version)
+
+        # Pages come from the room's history cache: sealed blocks survive new
+        # messages, only the small head is rebuilt per room version
+        before, after = self.paginator.get_cursors(request)
+        page = history.page(room.id, self.paginator.get_page_size(request), before=before, after=after)
+        if page is not None:
+            # tag the version actually served: a stale head is older than `version`
+            self.paginator.use_page(page, request)
+            response = self.get_paginated_response(page.items)
+            if is_json:
+                variants = rendered.render(request, response.data)
+                rendered.store(rendered.page_key(room.id, page.version, request), variants)
+                response = rendered.response(request, variants)
+            return self._tagged(response, room.id, page.version)
+
+        # cursor below the cached history: straight from the DB (read after
+        # `version`, so a racing write only makes the tag too old, never too new)
         queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer(self.paginate_queryset(queryset), many=True)
+        return self._tagged(self.get_paginated_response(serializer.data), room.id, version)
+
+    def _tagged(self, response, room_id, version):
+        response["ETag"] = etags.etag("messages", room_id, version, self.request)
+        return response
 
-        # Respect DRF pagination if configured
-        page_obj = self.paginate_queryset(queryset)
-        if page_obj is not None:
-            serializer = self.get_serializer(page_obj, many=True)
-            payload = serializer.data
-            # Cache the *paginated page* under the param key
-            set_room_messages_cache(key, payload)
-            return self.get_paginated_response(payload)
-
-        # No pagination -> cache whole list
-        serializer = self.get_serializer(queryset, many=True)
-        payload = serializer.data
-        set_room_messages_cache(key, payload)
-        return Response(payload, status=200)
-
-    # ---- mutations (bump cache version) ----
+    # ---- mutations (history cache and room version: chat.signals) ----
     def perform_create(self, serializer):
         # allow room from body OR from nested URL
         room = serializer.validated_data.get("chat_room") or self._room_from_request()
         if room is None:
             raise ValidationError({"chat_room": "This field is required."})
 
-        if not room.participants.filter(id=self.request.user.id).exists():
+        if not is_member(room.id, self.request.user.id):
             raise PermissionDenied("You are not a participant of this room.")
 
         serializer.save(chat_room=room, sender=self.request.user)
-        bump_room_version(room.id)
+        append_message(message_payload(serializer.instance))
 
     def perform_update(self, serializer):
         instance = serializer.save()
-        bump_room_version(instance.chat_room_id)
+        append_edit(message_payload(instance))
 
     def perform_destroy(self, instance):
-        room_id = instance.chat_room_id
+        room_id, message_id = instance.chat_room_id, instance.id
         super().perform_destroy(instance)
-        bump_room_version(room_id)
+        append_delete(room_id, message_id)
 
     def get_throttles(self):
         # tighter write limit for create; more generous for reads
@@ -224,7 +245,7 @@ class ChatParticipantViewSet(viewsets.ModelViewSet):
         if payload_user != self.request.user:
             raise PermissionDenied("You can only create participation for yourself.")
 
-        if not room.participants.filter(id=self.request.user.id).exists():
+        if not is_member(room.id, self.request.user.id):
             # Joining a room you don't belong to is allowed, but we must allow if user isn't yet a participant.
             # If you want invite-only rooms, flip this check to forbid unless invited.
             pass
@@ -287,9 +308,19 @@ class ChatParticipantViewSet(viewsets.ModelViewSet):
 
 
 class RoomOnlineView(APIView):
+    """
+    Users with a live socket in the room (Redis presence, no DB).
+    Versioned: clients revalidate with If-None-Match and get 304 until
+    someone comes or goes; live updates arrive as presence_changed events.
+    Read-only: expiry is pruned and announced by sockets' heartbeat timers.
+    """
     permission_classes = [IsAuthenticated]
     def get(self, request, room_id):
-        # unique users with a presence row in room
-        user_ids = Presence.objects.filter(room_id=room_id).values_list("user_id", flat=True).distinct()
-        return Response({"online_user_ids": list(user_ids)})
+        state = presence_state(room_id)
+        tag = etags.etag("presence", room_id, presence_tag(state), request)
+        if etags.matches(request, tag):
+            return etags.not_modified(tag)
+
+        version, user_ids = online_snapshot(room_id, state)
+        return Response({"online_user_ids": user_ids, "version": version}, headers={"ETag": tag})
         
\ No newline at end of file
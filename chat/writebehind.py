@@ -0,0 +1,158 @@
+import asyncio
+import atexit
+import logging
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .cache import bump_room_version
+from .models import Message
+from .serializers import message_payload
+
+
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override in settings)
+DEFAULT_MAX_BATCH = 200
+DEFAULT_MAX_LATENCY_MS = 20
+
+
+def write_behind_enabled() -> bool:
+    return bool(getattr(settings, "CHAT_WRITE_BEHIND", False))
+
+
+def _insert(rows):
+    """
+    One INSERT for the whole batch. Rows keep submission order, so ids
+    (and auto_now_add timestamps) are monotonic per room.
+    """
+    objs = [Message(chat_room_id=room_id, sender_id=user_id, content=content) for room_id, user_id, content in rows]
+    payloads = [message_payload(m) for m in Message.objects.bulk_create(objs)]
+    for room_id in {room_id for room_id, _, _ in rows}:
+        bump_room_version(room_id)  # once per room per batch
+    return payloads
+
+
+_bulk_insert = sync_to_async(_insert)
+
+
+class MessageBatcher:
+    """
+    Process-wide write-behind buffer for WebSocket messages.
+
+    Consumers `await submit(...)`; the call resolves with the persisted
+    payload (real id + timestamp) once the batch holding it is flushed.
+    A batch is flushed when it reaches `max_batch` rows or when its oldest
+    row has waited `max_latency_ms`, whichever comes first. Rows still
+    pending when the process exits are written by an atexit hook.
+    """
+
+    def __init__(self, max_batch=None, max_latency_ms=None):
+        self._max_batch = max_batch
+        self._max_latency_ms = max_latency_ms
+        self._pending = []
+        self._timer = None
+        self._loop = None
+        self._lock = None
+        self._flushes = set()
+        self._exit_hook = False
+
+    @property
+    def max_batch(self) -> int:
+        if self._max_batch is not None:
+            return self._max_batch
+        return int(getattr(settings, "CHAT_WRITE_BEHIND_MAX_BATCH", DEFAULT_MAX_BATCH))
+
+    @property
+    def max_latency(self) -> float:
+        ms = self._max_latency_ms
+        if ms is None:
+            ms = getattr(settings, "CHAT_WRITE_BEHIND_MAX_LATENCY_MS", DEFAULT_MAX_LATENCY_MS)
+        return float(ms) / 1000.0
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # New event loop (worker restart, tests): drop state tied to the old one
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._pending = []
+            self._timer = None
+            self._flushes = set()
+        if not self._exit_hook:
+            atexit.register(self._flush_at_exit)
+            self._exit_hook = True
+        return loop
+
+    async def submit(self, room_id: int, user_id: int, content: str) -> dict:
+        loop = self._bind_loop()
+        fut = loop.create_future()
+        self._pending.append(((room_id, user_id, content), fut))
+
+        if len(self._pending) >= self.max_batch:
+            self._kick()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_latency, self._kick)
+        return await fut
+
+    async def drain(self):
+        """
+        Flush whatever is pending right now and wait for it, from the
+        running loop (tests, servers with a shutdown hook). Plain process
+        exit is covered by _flush_at_exit.
+        """
+        if self._loop is None:
+            return
+        self._kick()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def _flush_at_exit(self):
+        # The event loop has stopped (and the executors behind sync_to_async
+        # with it), so drain() can't run: write what is still pending here.
+        # Submitters went with the loop; their rows shouldn't.
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        close_old_connections()
+        try:
+            _insert([row for row, _ in batch])
+            logger.info("Write-behind flushed %s messages at exit", len(batch))
+        except Exception:
+            logger.exception("Write-behind flush of %s messages at exit failed", len(batch))
+        finally:
+            close_old_connections()
+
+    def _kick(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = self._loop.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        # Serialize flushes so an early size-triggered batch never overtakes
+        # the one before it (keeps per-room ordering across batches).
+        async with self._lock:
+            try:
+                payloads = await _bulk_insert([row for row, _ in batch])
+            except Exception as exc:
+                logger.exception("Write-behind flush of %s messages failed", len(batch))
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                return
+
+            for payload, (_, fut) in zip(payloads, batch):
+                if not fut.done():
+                    fut.set_result(payload)
+            logger.debug("Write-behind flushed %s messages", len(batch))
+
+
+batcher = MessageBatcher()
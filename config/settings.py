@@ -122,11 +122,11 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.IsAuthenticated",
     ),
 
-    # --- Throttling ---
+    # --- Throttling --- (GCRA in Redis; drop-in for DRF's Anon/User/ScopedRateThrottle)
     "DEFAULT_THROTTLE_CLASSES": [
-        "rest_framework.throttling.AnonRateThrottle",
-        "rest_framework.throttling.UserRateThrottle",
-        "rest_framework.throttling.ScopedRateThrottle",
+        "chat.throttling.RedisAnonRateThrottle",
+        "chat.throttling.RedisUserRateThrottle",
+        "chat.throttling.RedisScopedRateThrottle",
     ],
     "DEFAULT_THROTTLE_RATES": {
         "anon": "30/min",
@@ -163,10 +163,16 @@ ASGI_APPLICATION = "config.asgi.application"
 
 # redis channel layer using REDIS_URL
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Several hosts (CHANNEL_REDIS_HOSTS=redis://a:6379,redis://b:6379) shard groups and channels on a
+# consistent-hash ring (chat.layers); run `manage.py reshard_channel_layer` after changing the list
+CHANNEL_REDIS_HOSTS = env.list("CHANNEL_REDIS_HOSTS", default=[])
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {"hosts": [("redis", 6379)]},  # docker-compose service name
+        "BACKEND": (
+            "chat.layers.ShardedRedisChannelLayer" if len(CHANNEL_REDIS_HOSTS) > 1
+            else "channels_redis.core.RedisChannelLayer"
+        ),
+        "CONFIG": {"hosts": CHANNEL_REDIS_HOSTS or [("redis", 6379)]},  # docker-compose service name
     }
 }
 
@@ -204,3 +210,76 @@ CACHES = {
 
 # CORS for frontend later
 # CORS_ALLOWED_ORIGINS = env.list("CORS_ALLOWED_ORIGINS", default=[])
+
+# WebSocket write-behind (chat.writebehind): batch send_message INSERTs per worker
+CHAT_WRITE_BEHIND = env.bool("CHAT_WRITE_BEHIND", default=False)
+CHAT_WRITE_BEHIND_MAX_BATCH = env.int("CHAT_WRITE_BEHIND_MAX_BATCH", default=200)
+CHAT_WRITE_BEHIND_MAX_LATENCY_MS = env.int("CHAT_WRITE_BEHIND_MAX_LATENCY_MS", default=20)  # max added latency per message
+
+# Room membership index (chat.membership): one Redis set per room, rebuilt lazily
+CHAT_MEMBERSHIP_TTL = env.int("CHAT_MEMBERSHIP_TTL", default=3600)
+
+# Typing indicators (chat.typing_state): one aggregated "typing_state" per room per tick
+CHAT_TYPING_TICK_MS = env.int("CHAT_TYPING_TICK_MS", default=500)  # 0 = broadcast every frame
+CHAT_TYPING_TTL_SECONDS = env.float("CHAT_TYPING_TTL_SECONDS", default=6.0)  # typers expire without a refresh
+
+# Per-user inbox groups (chat.fanout): room events also go to each member's user_<id> group,
+# so sockets opened with ?mode=inbox need no per-room joins
+CHAT_INBOX_FANOUT = env.bool("CHAT_INBOX_FANOUT", default=False)
+
+# REST message history cache (chat.history): sealed blocks of older messages survive new ones;
+# only the head (everything after the last block) is rebuilt per room version
+CHAT_HISTORY_BLOCK_SIZE = env.int("CHAT_HISTORY_BLOCK_SIZE", default=100)
+CHAT_HISTORY_BLOCK_TTL = env.int("CHAT_HISTORY_BLOCK_TTL", default=7 * 24 * 3600)
+CHAT_HISTORY_MAX_BLOCKS = env.int("CHAT_HISTORY_MAX_BLOCKS", default=50)  # per room; older pages come from the DB
+
+# Cache rebuilds (chat.cache.single_flight): one request rebuilds a missed key under a short lock,
+# the rest wait for it or, within the stale window, get the previous value (0 = never stale)
+CHAT_CACHE_LOCK_TTL = env.int("CHAT_CACHE_LOCK_TTL", default=5)
+CHAT_CACHE_LOCK_WAIT_MS = env.int("CHAT_CACHE_LOCK_WAIT_MS", default=500)
+CHAT_CACHE_STALE_SECONDS = env.int("CHAT_CACHE_STALE_SECONDS", default=0)
+
+# Rendered message list pages (chat.rendered): cached response bytes plus pre-compressed variants
+# ("br" needs the optional brotli package); bodies under the minimum are never compressed
+CHAT_RENDERED_ENCODINGS = tuple(env.list("CHAT_RENDERED_ENCODINGS", default=["br", "gzip"]))
+CHAT_RENDERED_MIN_COMPRESS_BYTES = env.int("CHAT_RENDERED_MIN_COMPRESS_BYTES", default=512)
+
+# Reconnect catch-up (chat.streams): capped per-room stream replayed by the "resume" action
+CHAT_ROOM_STREAM_MAXLEN = env.int("CHAT_ROOM_STREAM_MAXLEN", default=500)
+CHAT_ROOM_STREAM_TTL = env.int("CHAT_ROOM_STREAM_TTL", default=24 * 3600)
+CHAT_RESUME_MAX_MESSAGES = env.int("CHAT_RESUME_MAX_MESSAGES", default=500)
+
+# Live presence (chat.presence): per-room sorted sets with heartbeat expiry
+CHAT_PRESENCE_TTL = env.int("CHAT_PRESENCE_TTL", default=60)  # seconds; sockets heartbeat (server-driven) every TTL/3
+
+# Coalesced last-seen writer (core.last_seen): one batched last_login UPDATE per interval
+LAST_SEEN_FLUSH_SECONDS = env.float("LAST_SEEN_FLUSH_SECONDS", default=10.0)
+LAST_SEEN_MAX_BATCH = env.int("LAST_SEEN_MAX_BATCH", default=500)
+LAST_SEEN_MAX_PENDING = env.int("LAST_SEEN_MAX_PENDING", default=10_000)
+
+# Cluster-wide WebSocket limits (chat.ratelimit, GCRA in Redis): action -> (max events, per seconds), per user
+CHAT_WS_RATE_LIMITS = {
+    "send_message": (env.int("WS_SEND_MESSAGE_MAX", default=30), 10),
+    "typing": (env.int("WS_TYPING_MAX", default=60), 10),
+    "join": (env.int("WS_JOIN_MAX", default=20), 10),
+    "default": (env.int("WS_DEFAULT_MAX", default=60), 10),
+}
+
+# Verified JWT claims for WebSocket handshakes (chat.auth): per-process LRU in front of the
+# shared cache, entries expire with the token
+JWT_CLAIMS_LRU_SIZE = env.int("JWT_CLAIMS_LRU_SIZE", default=10_000)
+
+# Socket principals (core.principals): compact (id, is_active, username) per user, per-process LRU in
+# front of the shared cache; User saves invalidate every process over Redis pub/sub
+PRINCIPAL_LRU_SIZE = env.int("PRINCIPAL_LRU_SIZE", default=10_000)
+PRINCIPAL_LOCAL_TTL = env.int("PRINCIPAL_LOCAL_TTL", default=300)  # bounds staleness if an invalidation is missed
+PRINCIPAL_CACHE_TTL = env.int("PRINCIPAL_CACHE_TTL", default=3600)
+
+# Session resumption tickets (chat.tickets): signed, handed out with heartbeats; ?ticket= on
+# connect restores rooms and replays gaps without re-running auth
+CHAT_RESUME_TICKET_TTL = env.int("CHAT_RESUME_TICKET_TTL", default=120)
+
+# Node-local fan-out (chat.fanout.NodeFanout): rooms with at least this many members publish each
+# event once over Redis pub/sub and every node delivers it to its own sockets; 0 = off
+CHAT_LARGE_ROOM_THRESHOLD = env.int("CHAT_LARGE_ROOM_THRESHOLD", default=0)
+CHAT_LARGE_ROOM_REDIS_URL = env("CHAT_LARGE_ROOM_REDIS_URL", default=CACHES["default"]["LOCATION"])
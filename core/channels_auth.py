@@ -3,10 +3,9 @@ from urllib.parse import parse_qs
 
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
-from core.models import User
+from core.principals import principals
 
 from django.contrib.auth.models import AnonymousUser
-from django.core.cache import cache
 from django.db import close_old_connections
 
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -22,27 +21,15 @@ BEARER_RE = re.compile(r"^Bearer (?P<token>.+)$", re.I)
 @database_sync_to_async
 def _user_from_validated_token_cached(validated_token):
     """
-    Resolve user from SimpleJWT validated token with a tiny cache.
-    Caches the User instance for 60s to avoid repeated DB hits on reconnects.
+    Resolve a compact principal from a SimpleJWT validated token through the
+    two-tier principal cache (core.principals); saves invalidate it everywhere.
     """
     # respect custom USER_ID_CLAIM if you changed it in SIMPLE_JWT
     user_id_claim = getattr(sj_settings, "USER_ID_CLAIM", "user_id")
     user_id = validated_token.get(user_id_claim)
     if not user_id:
         return None
-
-    key = f"user:{user_id}"
-    user = cache.get(key)
-    if user is not None:
-        return user
-
-    try:
-        # keep it lightweight; only what you need for auth
-        user = User.objects.only("id", "is_active").get(pk=user_id, is_active=True)
-        cache.set(key, user, 60)  # tiny TTL; safe if user deactivations are rare
-        return user
-    except User.DoesNotExist:
-        return None
+    return principals.get(user_id)
 
 
 
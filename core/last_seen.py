@@ -0,0 +1,108 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from .models import User
+
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_SECONDS = 10
+DEFAULT_MAX_BATCH = 500       # rows per UPDATE
+DEFAULT_MAX_PENDING = 10_000  # flush early past this many buffered users
+
+
+class LastSeenWriter:
+    """
+    Coalesces "user was seen" events in process memory and writes them as
+    one batched UPDATE of User.last_login every LAST_SEEN_FLUSH_SECONDS.
+
+    record() is cheap and non-blocking (safe on the event loop); a daemon
+    thread does the DB work, and whatever is still buffered is flushed at
+    interpreter exit.
+    """
+
+    def __init__(self, interval=None, max_batch=None, autostart=True):
+        self.interval = interval or getattr(settings, "LAST_SEEN_FLUSH_SECONDS", DEFAULT_FLUSH_SECONDS)
+        self.max_batch = max_batch or getattr(settings, "LAST_SEEN_MAX_BATCH", DEFAULT_MAX_BATCH)
+        self.max_pending = getattr(settings, "LAST_SEEN_MAX_PENDING", DEFAULT_MAX_PENDING)
+        self.autostart = autostart
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, user_id: int, when=None):
+        with self._lock:
+            self._pending[user_id] = when or timezone.now()
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            self._wake.set()
+        if self.autostart:
+            self._ensure_started()
+
+    def flush(self) -> int:
+        """
+        Write everything buffered so far; returns the number of users updated.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        items = list(batch.items())
+        for i in range(0, len(items), self.max_batch):
+            chunk = items[i:i + self.max_batch]
+            try:
+                User.objects.filter(id__in=[uid for uid, _ in chunk]).update(
+                    last_login=Case(
+                        *[When(id=uid, then=Value(ts)) for uid, ts in chunk],
+                        output_field=DateTimeField(),
+                    )
+                )
+            except Exception:
+                # keep unwritten entries for the next flush (newer records win)
+                with self._lock:
+                    for uid, ts in items[i:]:
+                        self._pending.setdefault(uid, ts)
+                raise
+        logger.debug("last_login flushed for %s users", len(items))
+        return len(items)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="last-seen-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self._safe_flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._safe_flush()
+
+    def _safe_flush(self):
+        close_old_connections()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("last_login flush failed")
+        finally:
+            close_old_connections()
+
+
+writer = LastSeenWriter()
+
+
+def record(user_id: int, when=None):
+    writer.record(user_id, when)
@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from prometheus_client import Counter, Histogram
+
+from chat.cache import get_redis, raw_key
+
+from .models import User
+
+
+
+logger = logging.getLogger(__name__)
+
+# Shared tier: compact (id, is_active, username) tuple per user, stamped
+# with the user's generation when the lookup started
+PRINCIPAL_KEY = "principal:{user_id}"
+# Bumped by every invalidation: an entry from a lookup that raced one is ignored
+PRINCIPAL_GEN_KEY = "principal:{user_id}:gen"
+# Redis pub/sub channel carrying user ids whose cached principal must be dropped
+INVALIDATE_CHANNEL = "principal:invalidate"
+
+DEFAULT_LRU_SIZE = 10_000
+DEFAULT_LOCAL_TTL = 300     # safety net for missed invalidations
+DEFAULT_SHARED_TTL = 3600
+
+LOOKUPS = Counter(
+    "chat_principal_lookups_total",
+    "Principal cache lookups by the tier that answered (local, shared, db, missing)",
+    ["tier"],
+)
+LOOKUP_SECONDS = Histogram(
+    "chat_principal_lookup_seconds",
+    "Principal lookup latency by the tier that answered",
+    ["tier"],
+    buckets=(.00001, .00005, .0001, .0005, .001, .005, .01, .05, .1),
+)
+
+
+class Principal:
+    """
+    Just enough of a User to authorize a socket: consumers only need the
+    id and the auth flags. Cheap to cache and to (un)pickle.
+    """
+
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, id, is_active, username):
+        self.id = id
+        self.is_active = is_active
+        self.username = username
+
+    @property
+    def pk(self):
+        return self.id
+
+    def as_tuple(self):
+        return (self.id, self.is_active, self.username)
+
+    def __eq__(self, other):
+        return isinstance(other, Principal) and self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f"<Principal {self.id} {self.username!r}>"
+
+
+class PrincipalCache:
+    """
+    Two tiers in front of the users table: a bounded per-process LRU and the
+    shared cache. User saves delete the shared entry and are broadcast over
+    Redis pub/sub so every process drops its local copy. Shared entries
+    carry the user's invalidation generation, so a lookup that read the
+    old row just before an invalidation can't cache it past that.
+    """
+
+    def __init__(self, maxsize=None, local_ttl=None, shared_ttl=None):
+        self.maxsize = maxsize or getattr(settings, "PRINCIPAL_LRU_SIZE", DEFAULT_LRU_SIZE)
+        self.local_ttl = local_ttl or getattr(settings, "PRINCIPAL_LOCAL_TTL", DEFAULT_LOCAL_TTL)
+        self.shared_ttl = shared_ttl or getattr(settings, "PRINCIPAL_CACHE_TTL", DEFAULT_SHARED_TTL)
+        self._local = OrderedDict()  # user_id -> (principal, expires_at)
+        self._forgets = 0  # local invalidations so far; a lookup spanning one isn't remembered
+        self._lock = threading.Lock()
+        self._subscriber = None
+
+    def cached(self, user_id):
+        """
+        Local tier only: no I/O, safe to call on the event loop.
+        Returns the active principal, or None on a miss (or inactive user).
+        """
+        principal = self._local_get(user_id)
+        return principal if principal is not None and principal.is_active else None
+
+    def get(self, user_id):
+        """
+        Active principal for a user id, or None (unknown or inactive user).
+        """
+        principal = self._local_get(user_id)
+        if principal is not None:
+            return principal if principal.is_active else None
+
+        self._ensure_subscribed()
+        forgets = self._forgets
+        start = time.perf_counter()
+        key, gen_key = PRINCIPAL_KEY.format(user_id=user_id), PRINCIPAL_GEN_KEY.format(user_id=user_id)
+        found = cache.get_many([key, gen_key])
+        gen = found.get(gen_key, 0)
+        stamped = found.get(key)
+        if stamped is not None and stamped[0] == gen:
+            principal = Principal(*stamped[1])
+            self._observe("shared", start)
+        else:
+            row = self._load(user_id)
+            if row is None:
+                self._observe("missing", start)
+                return None
+            principal = Principal(*row)
+            cache.set(key, (gen, principal.as_tuple()), self.shared_ttl)
+            self._observe("db", start)
+
+        self._remember(principal, forgets)
+        return principal if principal.is_active else None
+
+    def _load(self, user_id):
+        return User.objects.filter(pk=user_id).values_list("id", "is_active", "username").first()
+
+    def invalidate(self, user_id):
+        """
+        Drop a user's principal everywhere (call after the change is committed).
+        """
+        self._bump_gen(user_id)
+        cache.delete(PRINCIPAL_KEY.format(user_id=user_id))
+        self.forget(user_id)
+        r = get_redis()
+        if r is not None:
+            try:
+                r.publish(raw_key(INVALIDATE_CHANNEL), str(user_id))
+            except Exception:
+                logger.exception("Could not publish principal invalidation for user %s", user_id)
+
+    def _bump_gen(self, user_id):
+        # outlives every entry stamped before the bump
+        key = PRINCIPAL_GEN_KEY.format(user_id=user_id)
+        if cache.add(key, 1, self.shared_ttl):
+            return
+        try:
+            cache.incr(key)
+            cache.touch(key, self.shared_ttl)
+        except ValueError:
+            cache.set(key, 1, self.shared_ttl)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._local.pop(user_id, None)
+            self._forgets += 1
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._forgets += 1
+
+    def _local_get(self, user_id):
+        start = time.perf_counter()
+        with self._lock:
+            entry = self._local.get(user_id)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._local[user_id]
+                return None
+            self._local.move_to_end(user_id)
+        self._observe("local", start)
+        return principal
+
+    def _remember(self, principal, forgets):
+        with self._lock:
+            if self._forgets != forgets:
+                return  # an invalidation landed during the lookup: it may be for this row
+            self._local[principal.id] = (principal, time.monotonic() + self.local_ttl)
+            self._local.move_to_end(principal.id)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def _observe(self, tier, start):
+        LOOKUPS.labels(tier).inc()
+        LOOKUP_SECONDS.labels(tier).observe(time.perf_counter() - start)
+
+    def _ensure_subscribed(self):
+        if self._subscriber is not None or get_redis() is None:
+            return
+        with self._lock:
+            if self._subscriber is not None:
+                return
+            self._subscriber = threading.Thread(target=self._listen, name="principal-invalidations", daemon=True)
+            self._subscriber.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(raw_key(INVALIDATE_CHANNEL))
+                for message in pubsub.listen():
+                    self.forget(int(message["data"]))
+            except Exception:
+                logger.exception("Principal invalidation subscriber failed; resubscribing")
+            # invalidations may have been missed while disconnected
+            self.clear()
+            time.sleep(1)
+
+
+principals = PrincipalCache()
@@ -1,9 +1,11 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.utils import timezone
 from django.conf import settings
 
+from . import last_seen
 from .models import Profile, User
+from .principals import principals
 
 
 
@@ -21,8 +23,20 @@ def save_user_profile(sender, instance, **kwargs):
 
 
 
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_principal(sender, instance, update_fields=None, **kwargs):
+    # last_login bumps don't change what a principal carries
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    # after commit, or a concurrent lookup could re-cache the old row
+    transaction.on_commit(lambda: principals.invalidate(instance.pk))
+
+
+
 from chat.models import Presence
 @receiver(post_save, sender=Presence)
 def touch_user_last_seen(sender, instance, **kwargs):
-    User.objects.filter(id=instance.user_id).update(last_login=timezone.now())
+    # buffered; written in batches by core.last_seen
+    last_seen.record(instance.user_id)
     
\ No newline at end of file
@@ -0,0 +1,42 @@
+import sys
+
+import pytest
+
+from django.core.cache import cache
+
+from chat import cache as chat_cache
+from chat.auth import claims_lru
+from core import last_seen
+from core.principals import principals
+
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    # LocMemCache outlives the per-test DB rollback; row ids get reused
+    cache.clear()
+    principals.clear()
+    claims_lru.clear()
+    yield
+    cache.clear()
+    principals.clear()
+    # buffered last_login writes would point at rolled-back users
+    last_seen.writer._pending.clear()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Put a fakeredis server behind chat.cache.get_redis, for the raw Redis
+    paths (Lua scripts, pipelines) LocMemCache never reaches. Skipped
+    unless fakeredis (with lupa, for EVAL) is installed.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    client = fakeredis.FakeStrictRedis()
+    real = chat_cache.get_redis
+    for name, module in list(sys.modules.items()):
+        if name.startswith(("chat.", "core.")) and getattr(module, "get_redis", None) is real:
+            monkeypatch.setattr(module, "get_redis", lambda: client)
+    yield client
+    client.flushall()
@@ -0,0 +1,103 @@
+from unittest import mock
+
+import pytest
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from chat import history, rendered
+from chat.cache import ROOM_META_VERSION_KEY, ROOM_VERSION_KEY, get_room_version
+from chat.history import HISTORY_HEAD_KEY
+from chat.models import ChatRoom, ChatParticipant, Message
+from core.models import User
+
+
+
+@pytest.fixture
+def member():
+    u = User.objects.create_user(username="poller", password="x")
+    room = ChatRoom.objects.create(name="polled")
+    ChatParticipant.objects.create(chat_room=room, user=u)
+    Message.objects.create(chat_room=room, sender=u, content="hello")
+    client = APIClient()
+    client.force_authenticate(user=u)
+    return client, room
+
+
+@pytest.mark.django_db(transaction=True)
+def test_unchanged_message_list_revalidates_without_db_or_page_fetch(member):
+    client, room = member
+    url = reverse("chat:message-list", kwargs={"room_id": room.id})
+    tag = client.get(url)["ETag"]
+    assert client.get(url, {"page_size": 5})["ETag"] != tag  # query params are part of the tag
+
+    with CaptureQueriesContext(connection) as ctx, \
+            mock.patch.object(rendered, "fetch", side_effect=AssertionError("page fetched")), \
+            mock.patch.object(history, "page", side_effect=AssertionError("history read")):
+        r = client.get(url, HTTP_IF_NONE_MATCH=tag)
+    assert r.status_code == 304 and r["ETag"] == tag
+    assert ctx.captured_queries == []
+
+    assert client.post(url, {"content": "news"}, format="json").status_code == 201
+    r = client.get(url, HTTP_IF_NONE_MATCH=tag)
+    assert r.status_code == 200 and r["ETag"] != tag
+    assert [m["content"] for m in r.json()["results"]] == ["hello", "news"]
+
+    # a tag is no pass for someone outside the room
+    outsider = APIClient()
+    outsider.force_authenticate(user=User.objects.create_user(username="outsider", password="x"))
+    assert outsider.get(url, HTTP_IF_NONE_MATCH=r["ETag"]).status_code == 403
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CHAT_CACHE_STALE_SECONDS=30)
+def test_stale_page_is_tagged_with_the_version_it_came_from(member):
+    client, room = member
+    url = reverse("chat:message-list", kwargs={"room_id": room.id})
+    client.get(url)
+    assert client.post(url, {"content": "seen"}, format="json").status_code == 201
+    old = client.get(url)["ETag"]
+
+    assert client.post(url, {"content": "unseen"}, format="json").status_code == 201
+    lock = HISTORY_HEAD_KEY.format(room_id=room.id, v=get_room_version(room.id)) + ":lock"
+    cache.add(lock, 1, 5)  # another request is rebuilding the new head
+
+    r = client.get(url)
+    assert [m["content"] for m in r.json()["results"]] == ["hello", "seen"]
+    assert r["ETag"] == old  # the client revalidates against the old version next time
+
+
+@pytest.mark.django_db
+def test_room_detail_revalidates_until_participants_change(member):
+    client, room = member
+    User.objects.create_user(username="guest", password="x")
+    url = f"/api/chat/chat-rooms/{room.id}/"
+    tag = client.get(url)["ETag"]
+
+    with CaptureQueriesContext(connection) as ctx:
+        assert client.get(url, HTTP_IF_NONE_MATCH=tag).status_code == 304
+    assert ctx.captured_queries == []
+
+    assert client.post(f"{url}add_participant/", {"username": "guest"}, format="json").status_code == 200
+    r = client.get(url, HTTP_IF_NONE_MATCH=tag)
+    assert r.status_code == 200 and "guest" in r.json()["participants"]
+
+    tag = r["ETag"]
+    room.name = "renamed"
+    room.save()
+    assert client.get(url, HTTP_IF_NONE_MATCH=tag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_requests_for_missing_rooms_leave_no_version_keys(member):
+    client, room = member
+    assert client.get(reverse("chat:message-list", kwargs={"room_id": 987654})).status_code == 404
+    assert client.get("/api/chat/chat-rooms/987655/").status_code == 404
+    for room_id in (987654, 987655):
+        assert cache.get(ROOM_VERSION_KEY.format(room_id=room_id)) is None
+        assert cache.get(ROOM_META_VERSION_KEY.format(room_id=room_id)) is None
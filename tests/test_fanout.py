@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from chat import fanout
+from chat.fanout import NodeFanout
+
+
+
+class _Consumer:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay, self.fail, self.seen = delay, fail, []
+
+    async def broadcast_message(self, event):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("socket gone")
+        self.seen.append(event["n"])
+
+
+@pytest.mark.asyncio
+async def test_only_rooms_near_the_threshold_get_a_subscription(settings, monkeypatch):
+    settings.CHAT_LARGE_ROOM_THRESHOLD = 10
+    sizes = {1: 2, 2: 9}
+    monkeypatch.setattr(fanout, "room_size", lambda room_id: sizes[room_id])
+    monkeypatch.setattr(fanout, "get_redis", lambda: object())
+    monkeypatch.setattr(fanout, "WATCH_SECONDS", 0.01)
+    node, subscribed = NodeFanout(), []
+
+    async def subscribe(room_id):
+        subscribed.append(room_id)
+        node._subscribed.add(room_id)
+
+    monkeypatch.setattr(node, "_subscribe", subscribe)
+    consumer = _Consumer()
+    await node.register(1, consumer)
+    await node.register(2, consumer)
+    assert subscribed == [2]
+
+    sizes[1] = 8  # grew while we had a socket in it
+    await asyncio.sleep(0.1)
+    assert subscribed == [2, 1]
+    for room_id in (1, 2):
+        node._subscribed.discard(room_id)
+        await node.unregister(room_id, consumer)
+    assert node._outbox == {}
+
+
+@pytest.mark.asyncio
+async def test_each_consumer_drains_its_own_queue_in_order(settings, monkeypatch):
+    settings.CHAT_LARGE_ROOM_THRESHOLD = 2
+    monkeypatch.setattr(fanout, "get_redis", lambda: None)  # local dispatch only
+    node = NodeFanout()
+    slow, broken, fast = _Consumer(delay=60), _Consumer(fail=True), _Consumer()
+    for consumer in (slow, broken, fast):
+        await node.register(7, consumer)
+
+    for n in range(3):
+        await node.dispatch(7, {"type": "broadcast.message", "n": n})
+    await asyncio.sleep(0.05)
+    assert fast.seen == [0, 1, 2] and slow.seen == []
+
+    for consumer in (slow, broken, fast):
+        await node.unregister(7, consumer)
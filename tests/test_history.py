@@ -0,0 +1,145 @@
+from datetime import timedelta
+
+import pytest
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from chat.models import ChatRoom, ChatParticipant, Message
+from core.models import User
+
+
+
+def _contents(r):
+    return [m["content"] for m in r.json()["results"]]
+
+
+def _message_selects(ctx):
+    return [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("SELECT") and '"chat_message"' in q["sql"]]
+
+
+@pytest.fixture
+def history_room():
+    u = User.objects.create_user(username="historian", password="x")
+    room = ChatRoom.objects.create(name="archive")
+    ChatParticipant.objects.create(chat_room=room, user=u)
+    for i in range(20):
+        Message.objects.create(chat_room=room, sender=u, content=f"m{i}")
+    client = APIClient()
+    client.force_authenticate(user=u)
+    return client, reverse("chat:message-list", kwargs={"room_id": room.id})
+
+
+@pytest.mark.django_db
+@override_settings(CHAT_HISTORY_BLOCK_SIZE=3)
+def test_history_pages_span_blocks_and_head(history_room):
+    client, url = history_room
+
+    pages, r = [], client.get(url, {"page_size": 4})
+    while True:
+        pages.append(_contents(r))
+        if not r.json()["previous"]:
+            break
+        r = client.get(r.json()["previous"])
+    assert sum(reversed(pages), []) == [f"m{i}" for i in range(20)]
+
+    # and forward from the oldest page to the newest
+    forward = []
+    while True:
+        forward.extend(_contents(r))
+        if not r.json()["next"]:
+            break
+        r = client.get(r.json()["next"])
+    assert forward == [f"m{i}" for i in range(20)]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CHAT_HISTORY_BLOCK_SIZE=3)
+def test_sealed_blocks_survive_writes_and_are_patched_in_place(history_room):
+    client, url = history_room
+    old_page_url = client.get(url, {"page_size": 4}).json()["previous"]
+    r = client.get(old_page_url)
+    assert _contents(r) == ["m12", "m13", "m14", "m15"]
+    while r.json()["previous"]:  # scroll to the top once: every block is sealed and cached
+        r = client.get(r.json()["previous"])
+
+    # a new message only rebuilds the head
+    assert client.post(url, {"content": "fresh"}, format="json").status_code == 201
+    with CaptureQueriesContext(connection) as ctx:
+        assert _contents(client.get(old_page_url)) == ["m12", "m13", "m14", "m15"]
+    assert len(_message_selects(ctx)) == 1  # the head, nothing older
+
+    # edits and deletes patch the sealed block
+    edited = Message.objects.get(content="m13")
+    deleted = Message.objects.get(content="m14")
+    assert client.patch(f"/api/chat/messages/{edited.id}/?room={edited.chat_room_id}",
+                        {"content": "m13 (edited)"}, format="json").status_code == 200
+    assert client.delete(f"/api/chat/messages/{deleted.id}/?room={deleted.chat_room_id}").status_code == 204
+    with CaptureQueriesContext(connection) as ctx:
+        assert _contents(client.get(old_page_url)) == ["m11", "m12", "m13 (edited)", "m15"]
+    assert len(_message_selects(ctx)) == 1
+
+
+def _scroll_up(client, r):
+    pages = [r.json()["results"]]
+    while r.json()["previous"]:
+        r = client.get(r.json()["previous"])
+        pages.append(r.json()["results"])
+    return sum(reversed(pages), [])
+
+
+@pytest.mark.django_db
+@override_settings(CHAT_HISTORY_BLOCK_SIZE=3)
+def test_sealed_blocks_are_dropped_on_rename_user_delete_and_archive(history_room, django_capture_on_commit_callbacks):
+    client, url = history_room
+    ghost = User.objects.create_user(username="ghost", password="x")
+    Message.objects.filter(content="m7").update(sender=ghost)
+    assert "m7" in [m["content"] for m in _scroll_up(client, client.get(url, {"page_size": 4}))]
+
+    historian = User.objects.get(username="historian")
+    historian.username = "chronicler"
+    with django_capture_on_commit_callbacks(execute=True):
+        historian.save()
+        ghost.delete()
+    rows = _scroll_up(client, client.get(url, {"page_size": 4}))
+    assert {m["sender"] for m in rows} == {"chronicler"}
+    assert "m7" not in [m["content"] for m in rows]
+
+    Message.objects.filter(content__in=["m0", "m1", "m2"]).update(timestamp=timezone.now() - timedelta(days=40))
+    call_command("archive_messages", stdout=open("/dev/null", "w"))
+    rows = _scroll_up(client, client.get(url, {"page_size": 4}))
+    assert [m["content"] for m in rows] == [f"m{i}" for i in range(3, 20) if i != 7]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CHAT_HISTORY_BLOCK_SIZE=3, CHAT_HISTORY_MAX_BLOCKS=2)
+def test_history_older_than_the_block_cap_comes_from_the_db(history_room):
+    client, url = history_room
+    rows = _scroll_up(client, client.get(url, {"page_size": 4}))
+    assert [m["content"] for m in rows] == [f"m{i}" for i in range(20)]
+
+    for i in range(6):  # seals two more blocks; the oldest fall off
+        assert client.post(url, {"content": f"n{i}"}, format="json").status_code == 201
+    rows = _scroll_up(client, client.get(url, {"page_size": 4}))
+    assert [m["content"] for m in rows] == [f"m{i}" for i in range(20)] + [f"n{i}" for i in range(6)]
+
+
+@pytest.mark.django_db(transaction=True)
+@override_settings(CHAT_HISTORY_BLOCK_SIZE=3)
+def test_edits_and_deletes_outside_the_api_reach_sealed_blocks(history_room):
+    client, url = history_room
+    old_page_url = client.get(url, {"page_size": 4}).json()["previous"]
+    assert _contents(client.get(old_page_url)) == ["m12", "m13", "m14", "m15"]
+
+    # what MessageAdmin or a shell session does
+    edited = Message.objects.get(content="m13")
+    edited.content = "m13 (moderated)"
+    edited.save()
+    Message.objects.get(content="m14").delete()
+    assert _contents(client.get(old_page_url)) == ["m11", "m12", "m13 (moderated)", "m15"]
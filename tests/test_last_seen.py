@@ -0,0 +1,20 @@
+import pytest
+
+from core.last_seen import LastSeenWriter
+from core.models import User
+
+
+
+@pytest.mark.django_db
+def test_last_seen_writer_flushes_in_bounded_batches(django_assert_num_queries):
+    users = [User.objects.create_user(username=f"ls{i}", password="x") for i in range(5)]
+    writer = LastSeenWriter(max_batch=2, autostart=False)
+
+    for u in users:
+        writer.record(u.id)
+        writer.record(u.id)  # repeats coalesce
+
+    with django_assert_num_queries(3):  # 5 users, at most 2 per UPDATE
+        assert writer.flush() == 5
+    assert all(u.last_login for u in User.objects.filter(id__in=[u.id for u in users]))
+    assert writer.flush() == 0
@@ -0,0 +1,23 @@
+from collections import Counter
+
+from chat.layers import HashRing, ShardedRedisChannelLayer
+
+
+
+def test_ring_spreads_keys_and_moves_few_on_growth():
+    keys = [f"room_{i}" for i in range(10_000)]
+    three = HashRing(["redis://a", "redis://b", "redis://c"])
+    owners = {k: three.nodes[three.index(k)] for k in keys}
+    assert min(Counter(owners.values()).values()) > 2500
+
+    four = HashRing(["redis://d", "redis://c", "redis://a", "redis://b"])  # order doesn't matter
+    moved = [k for k in keys if four.nodes[four.index(k)] != owners[k]]
+    assert 1500 < len(moved) < 3500  # ~1/4, all onto the new host
+    assert {four.nodes[four.index(k)] for k in moved} == {"redis://d"}
+
+
+def test_specific_channels_hash_to_their_receive_shard():
+    layer = ShardedRedisChannelLayer(hosts=["redis://a", "redis://b", "redis://c"])
+    prefix = "specific.0123456789abcdef!"
+    assert {layer.consistent_hash(prefix + f"{i:032x}") for i in range(50)} == {layer.consistent_hash(prefix)}
+    assert len({layer.consistent_hash(f"room_{i}") for i in range(50)}) == 3
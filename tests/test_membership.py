@@ -0,0 +1,84 @@
+from unittest import mock
+
+import pytest
+
+from chat import membership
+from chat.membership import is_member, room_members, room_size
+from chat.models import ChatRoom, ChatParticipant
+from core.models import User
+
+
+
+@pytest.mark.django_db
+def test_membership_index_tracks_participant_changes(django_assert_num_queries):
+    alice = User.objects.create_user(username="alice", password="x")
+    bob = User.objects.create_user(username="bob", password="x")
+    room = ChatRoom.objects.create(name="lobby")
+    ChatParticipant.objects.create(chat_room=room, user=alice)
+
+    # first check rebuilds from ChatParticipant, later ones are cache-only
+    assert is_member(room.id, alice.id)
+    with django_assert_num_queries(0):
+        assert is_member(room.id, alice.id)
+        assert not is_member(room.id, bob.id)
+
+    room.participants.add(bob)
+    with django_assert_num_queries(0):
+        assert is_member(room.id, bob.id)
+        assert room_members(room.id) == {alice.id, bob.id}
+
+    room.participants.remove(bob)
+    with django_assert_num_queries(0):
+        assert not is_member(room.id, bob.id)
+
+
+@pytest.mark.django_db
+def test_membership_rejects_bad_ids():
+    assert not is_member(None, 1)
+    assert not is_member("abc", 1)
+
+
+@pytest.mark.django_db
+def test_rebuild_does_not_store_a_list_that_missed_a_concurrent_join():
+    alice = User.objects.create_user(username="alice", password="x")
+    bob = User.objects.create_user(username="bob", password="x")
+    room = ChatRoom.objects.create(name="lobby")
+    ChatParticipant.objects.create(chat_room=room, user=alice)
+
+    load = membership._load_members
+
+    def join_during_read(room_id):
+        members = load(room_id)
+        room.participants.add(bob)  # lands after the read, before the store
+        return members
+
+    with mock.patch.object(membership, "_load_members", side_effect=join_during_read):
+        assert not is_member(room.id, bob.id)
+    assert is_member(room.id, bob.id)
+
+
+def test_large_rooms_load_into_redis_in_chunks(fake_redis, monkeypatch):
+    monkeypatch.setattr(membership, "_load_members", lambda room_id: frozenset(range(1, 9001)))
+    assert room_size(1) == 9000 and is_member(1, 9000)
+
+    membership.add_members(1, range(9001, 18001))
+    membership.remove_members(1, range(1, 4001))
+    assert room_size(1) == 14000
+    assert is_member(1, 18000) and not is_member(1, 4000)
+    assert fake_redis.keys("*:build:*") == []
+
+
+def test_redis_rebuild_is_not_stored_when_a_join_races_it(fake_redis, monkeypatch):
+    reads = []
+
+    def join_during_first_read(room_id):
+        if not reads:
+            membership.add_members(room_id, [2])
+        reads.append(room_id)
+        return frozenset({1, 2}) if len(reads) > 1 else frozenset({1})
+
+    monkeypatch.setattr(membership, "_load_members", join_during_first_read)
+    assert not is_member(1, 2)
+    assert is_member(1, 2) and len(reads) == 2
+    assert room_members(1) == {1, 2} and len(reads) == 2
+    assert fake_redis.keys("*:build:*") == []
@@ -0,0 +1,64 @@
+import base64
+
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from chat.models import ChatRoom, ChatParticipant, Message
+from core.models import User
+
+
+
+def _contents(r):
+    return [m["content"] for m in r.json()["results"]]
+
+
+@pytest.mark.django_db
+def test_cursor_pages_walk_history_both_ways_without_count():
+    u = User.objects.create_user(username="pager", password="x")
+    room = ChatRoom.objects.create(name="history")
+    ChatParticipant.objects.create(chat_room=room, user=u)
+    for i in range(7):
+        Message.objects.create(chat_room=room, sender=u, content=f"m{i}")
+    client = APIClient()
+    client.force_authenticate(user=u)
+    url = reverse("chat:message-list", kwargs={"room_id": room.id})
+
+    # newest page first, oldest-first within the page
+    with CaptureQueriesContext(connection) as ctx:
+        head = client.get(url, {"page_size": 3})
+    assert _contents(head) == ["m4", "m5", "m6"]
+    assert head.json()["next"] is None
+    assert not any("COUNT(" in q["sql"].upper() for q in ctx.captured_queries)
+
+    older = client.get(head.json()["previous"])
+    assert _contents(older) == ["m1", "m2", "m3"]
+    oldest = client.get(older.json()["previous"])
+    assert _contents(oldest) == ["m0"]
+    assert oldest.json()["previous"] is None
+
+    # and forward again from the start
+    newer = client.get(oldest.json()["next"])
+    assert _contents(newer) == ["m1", "m2", "m3"]
+    assert _contents(client.get(newer.json()["next"])) == ["m4", "m5", "m6"]
+
+    assert client.get(url, {"before": "not-a-cursor"}).status_code == 404
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("param", ["before", "after"])
+def test_cursor_without_a_utc_offset_is_not_found(param):
+    u = User.objects.create_user(username="pager", password="x")
+    room = ChatRoom.objects.create(name="history")
+    ChatParticipant.objects.create(chat_room=room, user=u)
+    Message.objects.create(chat_room=room, sender=u, content="m0")
+    client = APIClient()
+    client.force_authenticate(user=u)
+    url = reverse("chat:message-list", kwargs={"room_id": room.id})
+
+    naive = base64.urlsafe_b64encode(b"2030-01-01T00:00:00|5").decode("ascii").rstrip("=")
+    assert client.get(url, {param: naive}).status_code == 404
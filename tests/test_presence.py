@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from chat import presence
+from chat.events import room_group_name
+from core.models import User
+
+
+
+def test_presence_transitions_count_sockets_per_user():
+    # first socket brings the user online, last one takes them offline;
+    # each transition bumps the room's presence version
+    assert presence.touch(1, "chan-a", [None, 5]) == {None: 1, 5: 1}
+    assert presence.touch(1, "chan-b", [5]) == {}
+    assert presence.touch(2, "chan-c", [5]) == {5: 2}
+    assert presence.online_user_ids(5) == [1, 2]
+
+    assert presence.drop(1, "chan-a", [5]) == {}
+    assert presence.online_user_ids(5) == [1, 2]
+    assert presence.drop(1, "chan-b", [5]) == {5: 3}
+    assert presence.online_user_ids(5) == [2]
+    assert presence.presence_state(5) == (3, 0)
+
+
+def test_presence_expires_without_heartbeat(monkeypatch):
+    presence.touch(1, "chan-a", [9])
+    later = presence.time.time() + presence.presence_ttl() + 1
+    monkeypatch.setattr(presence.time, "time", lambda: later)
+    assert presence.online_user_ids(9) == []
+    assert presence.presence_state(9) == (1, 1)  # expiry counts as a change
+    assert presence.prune([9]) == {9: (2, [1])}
+    assert presence.presence_state(9) == (2, 0)
+
+
+
+@pytest.mark.asyncio
+async def test_reads_leave_expired_users_for_the_pruner(monkeypatch):
+    layer = get_channel_layer()
+    listener = await layer.new_channel()
+    await layer.group_add(room_group_name(11), listener)
+    presence.touch(1, "chan-a", [11])
+
+    later = presence.time.time() + presence.presence_ttl() + 1
+    monkeypatch.setattr(presence.time, "time", lambda: later)
+    assert await sync_to_async(presence.online_snapshot)(11) == (1, [])
+    # still there for a consumer's prune to find and announce
+    assert await sync_to_async(presence.prune)([11]) == {11: (2, [1])}
+    assert await sync_to_async(presence.prune)([11]) == {11: (2, [])}
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(layer.receive(listener), 0.1)
+
+
+@pytest.mark.django_db
+def test_room_online_view_reads_presence_store(django_assert_num_queries, monkeypatch):
+    u = User.objects.create_user(username="p", password="x")
+    presence.touch(u.id, "chan-a", [3])
+    client = APIClient()
+    client.force_authenticate(user=u)
+
+    url = reverse("chat:room-online", kwargs={"room_id": 3})
+    with django_assert_num_queries(0):
+        r = client.get(url)
+    assert r.status_code == 200
+    assert r.data == {"online_user_ids": [u.id], "version": 1}
+
+    # unchanged -> 304; a new arrival changes the ETag
+    assert client.get(url, HTTP_IF_NONE_MATCH=r["ETag"]).status_code == 304
+    presence.touch(u.id + 1, "chan-b", [3])
+    r2 = client.get(url, HTTP_IF_NONE_MATCH=r["ETag"])
+    assert r2.status_code == 200 and r2.data["online_user_ids"] == [u.id, u.id + 1]
+
+    # expiry changes the ETag before any prune does
+    later = presence.time.time() + presence.presence_ttl() + 1
+    monkeypatch.setattr(presence.time, "time", lambda: later)
+    r3 = client.get(url, HTTP_IF_NONE_MATCH=r2["ETag"])
+    assert r3.status_code == 200 and r3.data == {"online_user_ids": [], "version": 2}
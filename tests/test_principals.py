@@ -0,0 +1,55 @@
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+
+from core.models import User
+from core.principals import LOOKUPS, PRINCIPAL_KEY, principals
+
+
+
+def _count(tier):
+    return LOOKUPS.labels(tier)._value.get()
+
+
+@pytest.mark.django_db
+def test_principal_tiers_and_invalidation_on_save(django_capture_on_commit_callbacks, django_assert_num_queries):
+    u = User.objects.create_user(username="pr_carol", password="x")
+
+    with django_assert_num_queries(1):
+        p = principals.get(u.id)
+    assert (p.id, p.username, p.is_authenticated) == (u.id, "pr_carol", True)
+
+    local = _count("local")
+    with django_assert_num_queries(0):
+        assert principals.cached(u.id) == p
+        principals.clear()  # another process: shared tier only
+        assert principals.get(u.id) == p
+    assert _count("local") == local + 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        u.is_active = False
+        u.save()
+    assert cache.get(PRINCIPAL_KEY.format(user_id=u.id)) is None
+    assert principals.cached(u.id) is None
+    assert principals.get(u.id) is None  # inactive users never authenticate
+
+    assert principals.get(10**9) is None
+
+
+@pytest.mark.django_db
+def test_lookup_racing_an_invalidation_does_not_cache_the_old_row():
+    u = User.objects.create_user(username="pr_dave", password="x")
+    load = principals._load
+
+    def deactivated_during_read(user_id):
+        row = load(user_id)
+        User.objects.filter(pk=user_id).update(is_active=False)
+        principals.invalidate(user_id)  # the commit hook lands mid-lookup
+        return row
+
+    with mock.patch.object(principals, "_load", side_effect=deactivated_during_read):
+        assert principals.get(u.id) is not None  # this lookup saw the old row
+    assert principals.cached(u.id) is None
+    principals.clear()
+    assert principals.get(u.id) is None
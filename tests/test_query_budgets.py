@@ -0,0 +1,14 @@
+import pytest
+
+from benchmarks.hotpaths import PATHS, load_budgets, measure, over_budget, seed
+
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("path", PATHS, ids=lambda p: p.name)
+def test_hot_path_stays_within_budget(path):
+    # Over budget? Fix the regression, or if the extra work is intended,
+    # re-record with `python benchmarks/bench_rest.py --record`.
+    budgets = load_budgets()
+    counts, _ = measure(path, seed(**budgets["dataset"]), requests=3)
+    assert not over_budget(path.name, counts, budgets)
@@ -0,0 +1,42 @@
+from unittest import mock
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from chat import ratelimit
+from chat.ratelimit import WsRateLimiter, gcra_hit
+
+
+
+def test_gcra_allows_burst_then_reports_retry_after():
+    for _ in range(3):
+        assert gcra_hit("t:burst", 3, 10) == (True, 0.0)
+    allowed, retry_after = gcra_hit("t:burst", 3, 10)
+    assert not allowed
+    assert 0 < retry_after <= 10 / 3
+
+
+def test_ws_limits_are_per_action_and_unknown_actions_share_default(settings):
+    settings.CHAT_WS_RATE_LIMITS = {"typing": (2, 10), "default": (1, 10)}
+    limiter = WsRateLimiter()
+
+    assert limiter.allow(1, "typing") and limiter.allow(1, "typing")
+    assert not limiter.allow(1, "typing")
+    assert limiter.allow(2, "typing")  # other user, own bucket
+
+    assert limiter.allow(1, "made-up-1")
+    assert not limiter.allow(1, "made-up-2")
+
+
+@pytest.mark.asyncio
+async def test_async_check_shares_buckets_and_fails_open(settings):
+    settings.CHAT_WS_RATE_LIMITS = {"send_message": (2, 10)}
+    limiter = WsRateLimiter()
+
+    assert await limiter.aallow(3, "send_message")
+    assert limiter.allow(3, "send_message")
+    assert not await limiter.aallow(3, "send_message")
+
+    # Redis down: the frame goes through instead of the socket closing
+    with mock.patch.object(ratelimit, "agcra_hit", side_effect=ConnectionError("down")):
+        assert await limiter.aallow(3, "send_message")
@@ -0,0 +1,46 @@
+import gzip
+import json
+from unittest import mock
+
+import pytest
+
+from django.urls import reverse
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from chat.models import ChatRoom, ChatParticipant, Message
+from chat.rendered import accepted_encodings
+from core.models import User
+
+
+
+@pytest.mark.django_db
+def test_list_hits_are_served_from_cached_compressed_bytes():
+    u = User.objects.create_user(username="bytes", password="x")
+    room = ChatRoom.objects.create(name="bytes")
+    ChatParticipant.objects.create(chat_room=room, user=u)
+    for i in range(30):
+        Message.objects.create(chat_room=room, sender=u, content=f"message number {i}")
+    client = APIClient()
+    client.force_authenticate(user=u)
+    url = reverse("chat:message-list", kwargs={"room_id": room.id})
+
+    plain = client.get(url)
+    assert plain.status_code == 200 and "Content-Encoding" not in plain
+    assert "Accept-Encoding" in plain["Vary"]
+
+    # the hit does no rendering and picks the encoding the client asked for
+    with mock.patch.object(JSONRenderer, "render", side_effect=AssertionError("rendered on a hit")):
+        zipped = client.get(url, HTTP_ACCEPT_ENCODING="br;q=0, gzip")
+        refused = client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+    assert zipped["Content-Encoding"] == "gzip"
+    assert gzip.decompress(zipped.content) == plain.content
+    assert "Content-Encoding" not in refused
+    assert len(json.loads(plain.content)["results"]) == 30
+
+
+def test_accept_encoding_parsing():
+    assert accepted_encodings("gzip, deflate, br;q=0.5") == {"gzip", "deflate", "br"}
+    assert accepted_encodings("br;q=0, GZIP;q=0.1") == {"gzip"}
+    assert accepted_encodings("") == set()
@@ -0,0 +1,51 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from chat.cache import REBUILDS, single_flight
+
+
+
+def _count(label, outcome):
+    return REBUILDS.labels(label, outcome)._value.get()
+
+
+def test_concurrent_misses_rebuild_once():
+    calls, results = [], []
+
+    def build():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"page": 1}
+
+    def reader():
+        results.append(single_flight("sf:page", build, 60, label="test-coalesce"))
+
+    waited = _count("test-coalesce", "waited")
+    threads = [threading.Thread(target=reader) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [{"page": 1}] * 8
+    assert _count("test-coalesce", "waited") - waited == 7
+    assert cache.get("sf:page:lock") is None
+
+
+@override_settings(CHAT_CACHE_STALE_SECONDS=30)
+def test_stale_value_served_while_another_request_rebuilds():
+    assert single_flight("sf:v1", lambda: ["old"], 60, stale_key="sf:stale", label="test-stale") == ["old"]
+
+    # someone else is rebuilding v2: don't wait, serve v1
+    cache.add("sf:v2:lock", 1, 5)
+    stale = _count("test-stale", "stale")
+    assert single_flight("sf:v2", lambda: ["new"], 60, stale_key="sf:stale", label="test-stale") == ["old"]
+    assert _count("test-stale", "stale") - stale == 1
+
+    # without a stale window the same request waits, then rebuilds itself
+    with override_settings(CHAT_CACHE_STALE_SECONDS=0, CHAT_CACHE_LOCK_WAIT_MS=20):
+        assert single_flight("sf:v2", lambda: ["new"], 60, stale_key="sf:stale", label="test-stale") == ["new"]
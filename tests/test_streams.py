@@ -0,0 +1,62 @@
+import pytest
+
+from chat.models import ChatRoom, Message
+from chat.serializers import message_payload
+from chat.streams import append_delete, append_edit, append_message, latest_id, replay
+from core.models import User
+
+
+
+def _post(room, user, n):
+    out = []
+    for i in range(n):
+        msg = Message.objects.create(chat_room=room, sender=user, content=f"m{i}")
+        append_message(message_payload(msg))
+        out.append(msg)
+    return out
+
+
+@pytest.mark.django_db
+def test_resume_replays_gap_from_stream(settings, django_assert_num_queries):
+    settings.CHAT_ROOM_STREAM_MAXLEN = 3
+    u = User.objects.create_user(username="s", password="x")
+    room = ChatRoom.objects.create(name="lobby")
+    msgs = _post(room, u, 5)
+
+    # last seen is still inside the buffer -> no DB work
+    with django_assert_num_queries(0):
+        messages, source, has_more = replay(room.id, msgs[2].id)
+    assert source == "stream" and not has_more
+    assert [m["content"] for m in messages] == ["m3", "m4"]
+
+
+@pytest.mark.django_db
+def test_resume_falls_back_to_db_when_gap_is_older_than_buffer(settings):
+    settings.CHAT_ROOM_STREAM_MAXLEN = 3
+    u = User.objects.create_user(username="s", password="x")
+    room = ChatRoom.objects.create(name="lobby")
+    msgs = _post(room, u, 5)
+
+    messages, source, _ = replay(room.id, msgs[0].id)
+    assert source == "db"
+    assert [m["content"] for m in messages] == ["m1", "m2", "m3", "m4"]
+
+
+@pytest.mark.django_db
+def test_resume_applies_edits_and_deletes(settings, django_assert_num_queries):
+    u = User.objects.create_user(username="s", password="x")
+    room = ChatRoom.objects.create(name="lobby")
+    msgs = _post(room, u, 4)
+
+    msgs[2].content = "m2 (edited)"
+    msgs[2].save()
+    append_edit(message_payload(msgs[2]))
+    append_delete(room.id, msgs[3].id)
+    msgs[0].content = "m0 (edited)"  # seen already: not replayed
+    append_edit(message_payload(msgs[0]))
+
+    with django_assert_num_queries(0):
+        messages, source, _ = replay(room.id, msgs[1].id)
+        assert latest_id(room.id) == msgs[3].id
+    assert source == "stream"
+    assert [m["content"] for m in messages] == ["m2 (edited)"]
@@ -0,0 +1,30 @@
+import pytest
+
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from chat.models import ChatRoom, ChatParticipant
+from chat.throttling import RedisScopedRateThrottle
+from core.models import User
+
+
+
+@pytest.mark.django_db
+def test_scoped_gcra_throttle_returns_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(RedisScopedRateThrottle, "THROTTLE_RATES", {"chat-create": "2/min", "chat-list": "240/min"})
+    u = User.objects.create_user(username="t", password="x")
+    room = ChatRoom.objects.create(name="lobby")
+    ChatParticipant.objects.create(chat_room=room, user=u)
+    client = APIClient()
+    client.force_authenticate(user=u)
+    url = reverse("chat:message-list", kwargs={"room_id": room.id})
+
+    for i in range(2):
+        assert client.post(url, {"content": f"m{i}"}, format="json").status_code == 201
+    r = client.post(url, {"content": "one too many"}, format="json")
+    assert r.status_code == 429
+    assert 1 <= int(r["Retry-After"]) <= 30  # next slot: 60s / 2 requests
+
+    # reads use their own scope
+    assert client.get(url).status_code == 200
@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+import pytest
+from channels.layers import get_channel_layer
+
+from chat.events import room_group_name
+from chat.typing_state import TypingCoalescer
+
+
+
+@pytest.mark.asyncio
+async def test_typing_frames_coalesce_into_one_state_per_tick(settings):
+    settings.CHAT_TYPING_TICK_MS = 60_000  # drive ticks by hand
+    layer = get_channel_layer()
+    listener = await layer.new_channel()
+    await layer.group_add(room_group_name(7), listener)
+
+    coalescer = TypingCoalescer()
+    for _ in range(5):
+        await coalescer.note(layer, 7, 1, True)
+        await coalescer.note(layer, 7, 2, True)
+
+    await coalescer.tick(layer)
+    event = await layer.receive(listener)
+    assert event["type"] == "broadcast.typing_state"
+    assert json.loads(event["text"]) == {"type": "typing_state", "room_id": 7, "user_ids": [1, 2]}
+
+    # unchanged state -> nothing goes out
+    await coalescer.tick(layer)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(layer.receive(listener), 0.05)
+
+    await coalescer.note(layer, 7, 1, False)
+    await coalescer.tick(layer)
+    assert json.loads((await layer.receive(listener))["text"])["user_ids"] == [2]
+    coalescer._task.cancel()
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from channels.db import database_sync_to_async
+
+from chat import writebehind
+from chat.models import ChatRoom, Message
+from chat.writebehind import MessageBatcher
+from core.models import User
+
+
+
+@database_sync_to_async
+def _room_and_user():
+    u = User.objects.create_user(username="wb", password="x")
+    room = ChatRoom.objects.create(name="busy")
+    return room, u
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_batcher_flushes_in_order_with_real_ids():
+    room, u = await _room_and_user()
+    batcher = MessageBatcher(max_batch=3, max_latency_ms=50)
+
+    # 3 hits the size threshold, the last 2 wait for the latency timer
+    results = await asyncio.gather(*[batcher.submit(room.id, u.id, f"m{i}") for i in range(5)])
+
+    assert [r["content"] for r in results] == [f"m{i}" for i in range(5)]
+    ids = [r["id"] for r in results]
+    assert all(ids) and ids == sorted(ids)
+    assert all(r["created_at"] for r in results)
+
+    contents = await database_sync_to_async(
+        lambda: list(Message.objects.filter(chat_room=room).order_by("id").values_list("content", flat=True))
+    )()
+    assert contents == [f"m{i}" for i in range(5)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_rows_still_pending_at_exit_are_written(monkeypatch):
+    hooks = []
+    monkeypatch.setattr(writebehind.atexit, "register", hooks.append)
+    room, u = await _room_and_user()
+    batcher = MessageBatcher(max_batch=100, max_latency_ms=60_000)
+
+    waiting = [asyncio.ensure_future(batcher.submit(room.id, u.id, f"m{i}")) for i in range(3)]
+    await asyncio.sleep(0)
+    assert hooks == [batcher._flush_at_exit]
+
+    # the worker stops with the batch still open
+    await database_sync_to_async(hooks[0])()
+    contents = await database_sync_to_async(
+        lambda: list(Message.objects.filter(chat_room=room).order_by("id").values_list("content", flat=True))
+    )()
+    assert contents == ["m0", "m1", "m2"]
+    for task in waiting:
+        task.cancel()
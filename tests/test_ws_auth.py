@@ -1,9 +1,13 @@
+import time
+
 import pytest
 from channels.testing import WebsocketCommunicator
 from channels.db import database_sync_to_async
 from config.asgi import application
+from chat.auth import ClaimsLRU, claims_lru
 from core.models import User
 
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 
 
@@ -39,5 +43,74 @@ async def test_ws_accept_with_token():
     )
     connected, _ = await comm.connect()
     assert connected is True
-    await comm.disconnect()
-    
+    await comm.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_reconnect_skips_signature_verification(monkeypatch):
+    claims_lru.clear()
+    calls = []
+    verify = JWTAuthentication.get_validated_token
+
+    def counting(self, raw_token):
+        calls.append(raw_token)
+        return verify(self, raw_token)
+
+    monkeypatch.setattr(JWTAuthentication, "get_validated_token", counting)
+    user = await _create_user("jwt_reuse")
+    token = await _access_for(user)
+
+    for _ in range(3):
+        comm = WebsocketCommunicator(application, f"/ws/chat/?token={token}")
+        assert (await comm.connect())[0] is True
+        await comm.disconnect()
+    assert len(calls) == 1
+
+    # a second worker (empty LRU) is served by the shared cache
+    claims_lru.clear()
+    comm = WebsocketCommunicator(application, f"/ws/chat/?token={token}")
+    assert (await comm.connect())[0] is True
+    await comm.disconnect()
+    assert len(calls) == 1
+
+    comm = WebsocketCommunicator(application, "/ws/chat/?token=not-a-jwt")
+    assert (await comm.connect())[0] is False
+
+
+def test_claims_lru_is_bounded_and_expires():
+    lru = ClaimsLRU(maxsize=2)
+    now = time.time()
+    lru.put("a", {"exp": now + 60})
+    lru.put("b", {"exp": now + 60})
+    lru.get("a")
+    lru.put("c", {"exp": now + 60})
+    assert lru.get("b") is None and lru.get("a") and lru.get("c")
+
+    lru.put("old", {"exp": now - 1})
+    assert lru.get("old") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_auth_refresh_swaps_token_and_enforces_expiry():
+    from datetime import timedelta
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    alice, mallory = await _create_user("rf_alice"), await _create_user("rf_mallory")
+    comm = WebsocketCommunicator(application, f"/ws/chat/?token={await _access_for(alice)}")
+    assert (await comm.connect())[0] is True
+
+    await comm.send_json_to({"action": "auth.refresh", "token": await _access_for(mallory)})
+    assert await comm.receive_json_from() == {"type": "error", "detail": "token_user_mismatch"}
+    await comm.send_json_to({"action": "auth.refresh", "token": "garbage"})
+    assert await comm.receive_json_from() == {"type": "error", "detail": "invalid_token"}
+
+    short = AccessToken.for_user(alice)
+    short.set_exp(lifetime=timedelta(seconds=1))
+    await comm.send_json_to({"action": "auth.refresh", "token": str(short)})
+    refreshed = await comm.receive_json_from()
+    assert refreshed == {"type": "auth.refreshed", "exp": short["exp"]}
+
+    # the live socket now expires with the new token
+    assert await comm.receive_output(timeout=3) == {"type": "websocket.close", "code": 4401}
@@ -0,0 +1,292 @@
+import msgpack
+import pytest
+from channels.testing import WebsocketCommunicator
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from config.asgi import application
+from chat import presence
+from chat.events import repack_frame, room_event
+from chat.models import ChatRoom, ChatParticipant
+from core.models import User
+
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+
+PRESENCE_FRAMES = ("presence", "presence_changed")
+
+
+@database_sync_to_async
+def _room_with_members(*usernames):
+    room = ChatRoom.objects.create(name="lobby", is_group=True)
+    users = []
+    for name in usernames:
+        u = User.objects.create_user(username=name, password="x")
+        ChatParticipant.objects.create(chat_room=room, user=u)
+        users.append(u)
+    return room, users
+
+@database_sync_to_async
+def _access_for(user):
+    return str(RefreshToken.for_user(user).access_token)
+
+
+async def _connect(user, **kwargs):
+    token = await _access_for(user)
+    comm = WebsocketCommunicator(
+        application, "/ws/chat/",
+        headers=[(b"authorization", f"Bearer {token}".encode())],
+        **kwargs,
+    )
+    connected, _ = await comm.connect()
+    assert connected is True
+    return comm
+
+
+async def _next(comm, binary=False):
+    # next frame that isn't presence chatter
+    while True:
+        frame = msgpack.unpackb(await comm.receive_from()) if binary else await comm.receive_json_from()
+        if frame.get("type") not in PRESENCE_FRAMES:
+            return frame
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_message_is_acked_and_broadcast():
+    room, (alice, bob) = await _room_with_members("ws_alice", "ws_bob")
+    a, b = await _connect(alice), await _connect(bob)
+    for comm in (a, b):
+        await comm.send_json_to({"action": "join", "room_id": room.id})
+        assert (await _next(comm))["type"] == "joined"
+
+    await a.send_json_to({"action": "send_message", "room_id": room.id, "content": "hi", "temp_id": "t1"})
+    ack = await _next(a)
+    assert ack["type"] == "message_created" and ack["temp_id"] == "t1"
+
+    # room broadcast reaches both sockets (sender included) with the same payload
+    for comm in (a, b):
+        event = await _next(comm)
+        assert event == {"type": "message_created", "message": ack["message"]}
+
+    await a.disconnect()
+    await b.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_msgpack_subprotocol_and_mixed_room():
+    room, (alice, bob) = await _room_with_members("ws_alice", "ws_bob")
+    a = await _connect(alice, subprotocols=["chat.msgpack"])
+    b = await _connect(bob)  # JSON client in the same room
+
+    await a.send_to(bytes_data=msgpack.packb({"action": "join", "room_id": room.id}))
+    assert await _next(a, binary=True) == {"type": "joined", "room_id": room.id}
+    await b.send_json_to({"action": "join", "room_id": room.id})
+    await _next(b)
+
+    await a.send_to(bytes_data=msgpack.packb({"action": "send_message", "room_id": room.id, "content": "bin"}))
+    ack = await _next(a, binary=True)
+    assert ack["type"] == "message_created" and ack["message"]["content"] == "bin"
+
+    assert (await _next(a, binary=True))["message"] == ack["message"]
+    assert (await _next(b))["message"] == ack["message"]
+
+    await a.send_to(bytes_data=b"\xc1")  # never-used msgpack byte
+    assert await _next(a, binary=True) == {"type": "error", "detail": "bad_frame"}
+
+    await a.disconnect()
+    await b.disconnect()
+
+
+
+def test_room_events_carry_one_encoding():
+    frame = {"type": "typing", "room_id": 1, "user_id": 2, "is_typing": True}
+    event = room_event("broadcast.typing", frame)
+    assert set(event) == {"type", "text"}  # msgpack sockets derive their bytes
+    assert msgpack.unpackb(repack_frame(event["text"])) == frame
+    assert repack_frame(event["text"]) is repack_frame(event["text"])
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_inbox_mode_receives_room_events_without_join(settings):
+    settings.CHAT_INBOX_FANOUT = True
+    room, (alice, bob) = await _room_with_members("in_alice", "in_bob")
+    token = await _access_for(alice)
+    inbox = WebsocketCommunicator(application, f"/ws/chat/?mode=inbox&token={token}")
+    assert (await inbox.connect())[0] is True
+    b = await _connect(bob)
+    await b.send_json_to({"action": "join", "room_id": room.id})
+    await _next(b)
+
+    await b.send_json_to({"action": "send_message", "room_id": room.id, "content": "to inbox"})
+    ack = await _next(b)
+
+    event = await _next(inbox)
+    assert event == {"type": "message_created", "message": ack["message"]}
+    assert await inbox.receive_nothing()
+
+    await inbox.disconnect()
+    await b.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_presence_snapshot_and_deltas():
+    room, (alice, bob) = await _room_with_members("pr_alice", "pr_bob")
+    a = await _connect(alice)
+    await a.send_json_to({"action": "join", "room_id": room.id})
+    assert (await a.receive_json_from())["type"] == "joined"
+    # snapshot for the joiner + the room-wide delta for her own arrival
+    frames = {f["type"]: f for f in [await a.receive_json_from(), await a.receive_json_from()]}
+    snapshot = frames["presence"]
+    assert snapshot["online_user_ids"] == [alice.id]
+    assert frames["presence_changed"]["user_id"] == alice.id
+
+    b = await _connect(bob)
+    await b.send_json_to({"action": "join", "room_id": room.id})
+    delta = await a.receive_json_from()
+    assert delta["type"] == "presence_changed"
+    assert (delta["user_id"], delta["online"]) == (bob.id, True)
+    assert delta["version"] > snapshot["version"]
+
+    await b.disconnect()
+    delta = await a.receive_json_from()
+    assert (delta["user_id"], delta["online"]) == (bob.id, False)
+    await a.disconnect()
+
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_idle_socket_stays_online_and_expired_users_leave(settings):
+    settings.CHAT_PRESENCE_TTL = 1
+    room, (alice, bob) = await _room_with_members("px_alice", "px_bob")
+    a = await _connect(alice)
+    await a.send_json_to({"action": "join", "room_id": room.id})
+    for _ in range(3):  # joined, snapshot, own arrival
+        await a.receive_json_from()
+
+    # a socket of bob's on a worker that then crashed: it never sends "left"
+    await sync_to_async(presence.touch)(bob.id, "crashed-worker", [room.id])
+
+    # alice sends nothing; the server-driven heartbeat keeps her online
+    # and its prune announces bob's expiry
+    delta = await a.receive_json_from(timeout=3)
+    assert (delta["type"], delta["user_id"], delta["online"]) == ("presence_changed", bob.id, False)
+    assert await sync_to_async(presence.online_user_ids)(room.id) == [alice.id]
+    await a.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_resumption_ticket_restores_rooms_and_replays_gap():
+    room, (alice, bob) = await _room_with_members("rt_alice", "rt_bob")
+    a, b = await _connect(alice), await _connect(bob)
+    for comm in (a, b):
+        await comm.send_json_to({"action": "join", "room_id": room.id})
+        await _next(comm)
+    await b.send_json_to({"action": "send_message", "room_id": room.id, "content": "seen"})
+    await _next(b), await _next(b)  # ack + broadcast
+    seen = await _next(a)
+
+    await a.send_json_to({"action": "heartbeat"})
+    ticket = (await _next(a))["ticket"]
+    await a.disconnect()
+
+    await b.send_json_to({"action": "send_message", "room_id": room.id, "content": "missed"})
+    missed = (await _next(b))["message"]
+
+    # no token: the ticket alone authenticates and restores the room
+    a = WebsocketCommunicator(application, f"/ws/chat/?ticket={ticket}")
+    assert (await a.connect())[0] is True
+    assert await _next(a) == {"type": "session.resumed", "room_ids": [room.id]}
+    resumed = await _next(a)
+    assert resumed["type"] == "resumed" and resumed["messages"] == [missed]
+    assert seen["message"]["id"] < missed["id"]
+
+    # still subscribed: live events keep flowing
+    await b.send_json_to({"action": "send_message", "room_id": room.id, "content": "live"})
+    assert (await _next(a))["message"]["content"] == "live"
+    await a.disconnect()
+    await b.disconnect()
+
+    forged = WebsocketCommunicator(application, f"/ws/chat/?ticket={ticket[:-2]}xx")
+    assert (await forged.connect())[0] is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_resumption_ticket_is_refused_for_deactivated_user():
+    room, (alice,) = await _room_with_members("off_alice")
+    a = await _connect(alice)
+    await a.send_json_to({"action": "heartbeat"})
+    ticket = (await _next(a))["ticket"]
+    await a.disconnect()
+
+    alice.is_active = False
+    await database_sync_to_async(alice.save)()
+    again = WebsocketCommunicator(application, f"/ws/chat/?ticket={ticket}")
+    assert (await again.connect())[0] is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_large_room_fans_out_node_locally(settings, monkeypatch):
+    settings.CHAT_LARGE_ROOM_THRESHOLD = 2
+    room, (alice, bob) = await _room_with_members("lg_alice", "lg_bob")
+    a, b = await _connect(alice), await _connect(bob)
+    for comm in (a, b):
+        await comm.send_json_to({"action": "join", "room_id": room.id})
+        assert (await _next(comm))["type"] == "joined"
+
+    from channels.layers import InMemoryChannelLayer
+    group_sends = []
+    real = InMemoryChannelLayer.group_send
+
+    async def spy(self, group, message):
+        group_sends.append(group)
+        return await real(self, group, message)
+
+    monkeypatch.setattr(InMemoryChannelLayer, "group_send", spy)
+    await a.send_json_to({"action": "send_message", "room_id": room.id, "content": "big"})
+    ack = await _next(a)
+    for comm in (a, b):
+        assert await _next(comm) == {"type": "message_created", "message": ack["message"]}
+    assert f"room_{room.id}" not in group_sends
+
+    await b.send_json_to({"action": "leave", "room_id": room.id})
+    assert await _next(b) == {"type": "left", "room_id": room.id}
+    await a.send_json_to({"action": "send_message", "room_id": room.id, "content": "after leave"})
+    await _next(a), await _next(a)
+    assert await b.receive_nothing()
+    await a.disconnect()
+    await b.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_ws_inbox_mode_receives_large_room_events_once(settings):
+    settings.CHAT_INBOX_FANOUT = True
+    settings.CHAT_LARGE_ROOM_THRESHOLD = 2
+    room, (alice, bob) = await _room_with_members("lgin_alice", "lgin_bob")
+    token = await _access_for(alice)
+    inbox = WebsocketCommunicator(application, f"/ws/chat/?mode=inbox&token={token}")
+    assert (await inbox.connect())[0] is True
+    b = await _connect(bob)
+    await b.send_json_to({"action": "join", "room_id": room.id})
+    await _next(b)
+
+    for content in ("before join", "after join"):
+        await b.send_json_to({"action": "send_message", "room_id": room.id, "content": content})
+        ack = await _next(b)
+        assert await _next(b) == {"type": "message_created", "message": ack["message"]}
+        assert await _next(inbox) == {"type": "message_created", "message": ack["message"]}
+        assert await inbox.receive_nothing()
+        if content == "before join":
+            await inbox.send_json_to({"action": "join", "room_id": room.id})
+            assert (await _next(inbox))["type"] == "joined"
+
+    await inbox.disconnect()
+    await b.disconnect()